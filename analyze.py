@@ -0,0 +1,282 @@
+""" Offline posture analysis of recorded sessions.
+
+    python -m analyze session.mp4
+    python -m analyze monday.mp4 tuesday.mp4 ./snapshots --workers 4 --output-dir audit --report audit.json
+
+    Every video (or image directory) is cut into chunks of --chunk-frames
+    frames that a pool of worker processes analyses in parallel, each
+    worker holding one model and decoding frames on a read-ahead thread
+    while it runs batched forward passes. Results are merged in frame
+    order: the head position is locked after --lock-after frames like the
+    live app does, boundary checks and violations follow, and every frame
+    goes to <output-dir>/<name>.phist (see history.HistoryStore, times are
+    seconds into the recording). The report lists the violations of each
+    input and the throughput per core.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from config import PostureAidConfig
+from events import create_violation_filter
+from sources import IMAGE_EXTENSIONS
+from utils import boundary_margin, check_head_within_boundary
+
+_estimator = None
+_worker_settings = None
+
+# frame index, x, y, w, h, pose score
+ROW = np.dtype([("frame", "<i4"), ("x", "<i2"), ("y", "<i2"), ("w", "<i2"), ("h", "<i2"), ("score", "<f4")])
+
+
+def _load_model(model_id, output_stride, backend):
+    from estimator import load_model
+
+    required_parts = PostureAidConfig.config("REQUIRED_PARTS")
+    restrict = required_parts if PostureAidConfig.config("RESTRICT_MODEL_OUTPUTS") else None
+    return load_model(model_id, output_stride, restrict, backend=backend)
+
+
+def _init_worker(model_id, output_stride, scale_factor, decoder, backend, batch_size, threads):
+    global _estimator, _worker_settings
+    from estimator import PoseEstimator
+    from governor import configure_threads
+
+    _estimator = PoseEstimator(_load_model(model_id, output_stride, backend),
+                               output_stride=output_stride, scale_factor=scale_factor, decoder=decoder,
+                               required_parts=PostureAidConfig.config("REQUIRED_PARTS"))
+    # the pool provides the parallelism, one intra-op thread per worker
+    configure_threads(threads)
+    _worker_settings = {"batch_size": batch_size}
+
+
+def _read_frames(task, frames):
+    kind, path, start, stop = task
+    try:
+        if kind == "video":
+            cap = cv2.VideoCapture(path)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            for index in range(start, stop):
+                res, img = cap.read()
+                if not res:
+                    break
+                frames.put((index, img))
+            cap.release()
+        else:
+            for index, image_path in enumerate(path[start:stop], start):
+                img = cv2.imread(image_path)
+                if img is not None:
+                    frames.put((index, img))
+    finally:
+        frames.put(None)
+
+
+def _analyze_chunk(task):
+    """ Head boxes of one chunk of frames as ROW records, plus the seconds
+        the worker was busy """
+
+    import posenet
+
+    started = time.perf_counter()
+    batch_size = _worker_settings["batch_size"]
+    # decoding runs ahead of the model by up to two batches
+    frames = queue.Queue(2 * batch_size)
+    reader = threading.Thread(target=_read_frames, args=(task, frames), daemon=True)
+    reader.start()
+
+    rows = []
+    done = False
+    while not done:
+        batch = []
+        while len(batch) < batch_size:
+            item = frames.get()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        if not batch:
+            break
+        poses = _estimator.estimate_batch([img for _, img in batch])
+        for (index, img), pose in zip(batch, poses):
+            box = posenet.get_pos_from_img(img, pose.pose_scores, pose.keypoint_scores, pose.keypoint_coords,
+                                           min_pose_score=0.15, min_part_score=0.1)
+            score = float(pose.pose_scores.max()) if len(pose.pose_scores) else 0.0
+            rows.append((index,) + tuple(box) + (score,))
+    reader.join()
+    return np.array(rows, dtype=ROW), time.perf_counter() - started
+
+
+def open_input(path):
+    """ (kind, path or image paths, frame count, frames per second) """
+
+    if os.path.isdir(path):
+        images = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return "images", images, len(images), None
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError("cannot open video file %s" % path)
+    count, fps = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return "video", path, count, fps or None
+
+
+def chunk_tasks(kind, source, count, chunk_frames):
+    if count <= 0:
+        # the container does not say, one worker reads it to the end
+        return [(kind, source, 0, 2 ** 31 - 1)]
+    return [(kind, source, start, min(start + chunk_frames, count)) for start in range(0, count, chunk_frames)]
+
+
+class _SessionChecker:
+    def __init__(self, history, fps, pad_x, pad_y, lock_after):
+        """ The boundary and violation state of PostureMonitor replayed over
+            the merged head boxes of one recording, in frame order """
+
+        self.history = history
+        self.fps = fps
+        self.pad_x = pad_x
+        self.pad_y = pad_y
+        self.lock_after = lock_after
+        self.correct_pos = (0, 0, 0, 0)
+        self.violation_filter = create_violation_filter()
+        self.violations = []
+        self.frames = 0
+
+    def add(self, rows):
+        for row in rows:
+            timestamp = row["frame"] / self.fps
+            box = (int(row["x"]), int(row["y"]), int(row["w"]), int(row["h"]))
+            checking = self.frames >= self.lock_after
+            in_bounds = True
+            if checking:
+                in_bounds = check_head_within_boundary(self.correct_pos, box, self.pad_x, self.pad_y)
+                margin = boundary_margin(self.correct_pos, box, self.pad_x, self.pad_y)
+                was_violation = self.violation_filter.in_violation
+                violation = self.violation_filter.update(in_bounds, margin, timestamp)
+                if violation and not was_violation:
+                    self.violations.append({"start": round(timestamp, 3), "end": None})
+                elif was_violation and not violation:
+                    self.violations[-1]["end"] = round(timestamp, 3)
+            else:
+                self.correct_pos = box
+            self.history.append(timestamp, 0, box, float(row["score"]), checking, in_bounds,
+                                self.violation_filter.in_violation)
+            self.frames += 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="analyze", description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="video files or image directories")
+    parser.add_argument("--output-dir", default="analysis")
+    parser.add_argument("--report", help="also write the report as JSON to this file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-frames", type=int, default=256, help="frames per task")
+    parser.add_argument("--batch-size", type=int, default=8, help="frames per forward pass")
+    parser.add_argument("--threads", type=int, default=1, help="torch / OpenCV threads per worker")
+    parser.add_argument("--image-rate", type=float, default=1.0,
+                        help="frames per second of image directories, for the timeline")
+    parser.add_argument("--model", default=PostureAidConfig.config("MODEL"))
+    parser.add_argument("--backend", choices=["torch", "onnxruntime", "opencv"],
+                        default=PostureAidConfig.config("BACKEND"))
+    parser.add_argument("--scale-factor", type=float, default=PostureAidConfig.config("SCALE_FACTOR"))
+    parser.add_argument("--output-stride", type=int, default=PostureAidConfig.config("OUTPUT_STRIDE"))
+    parser.add_argument("--decoder", choices=["multi", "vectorized", "single"], default=PostureAidConfig.config("DECODER"))
+    parser.add_argument("--pad-x", type=int, default=PostureAidConfig.config("PAD_X"))
+    parser.add_argument("--pad-y", type=int, default=PostureAidConfig.config("PAD_Y"))
+    parser.add_argument("--lock-after", type=int, default=1,
+                        help="lock the correct head position after this many frames")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from history import HistoryStore, summarize
+
+    # download and convert the weights once, not in every worker at the same time
+    try:
+        _load_model(args.model, args.output_stride, args.backend).close()
+    except (FileNotFoundError, ValueError, IOError) as e:
+        print("[WARN] model %s could not be loaded: %s" % (args.model, e), file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    inputs = []
+    tasks = []
+    for path in args.inputs:
+        try:
+            kind, source, count, fps = open_input(path)
+        except IOError as e:
+            print("[WARN] %s" % e, file=sys.stderr)
+            continue
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        output = os.path.join(args.output_dir, name + ".phist")
+        for suffix in ("", ".minutes", ".hours"):
+            if os.path.exists(output + suffix):
+                os.remove(output + suffix)
+        history = HistoryStore(output, clock_offset=0.0)
+        checker = _SessionChecker(history, fps or args.image_rate, args.pad_x, args.pad_y, args.lock_after)
+        inputs.append({"path": path, "output": output, "history": history, "checker": checker})
+        tasks.extend((len(inputs) - 1, task) for task in chunk_tasks(kind, source, count, args.chunk_frames))
+    if not tasks:
+        print("nothing to analyze", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    busy = 0.0
+    # spawned workers do not inherit torch's threads from this process
+    pool = mp.get_context("spawn").Pool(
+        args.workers, initializer=_init_worker,
+        initargs=(args.model, args.output_stride, args.scale_factor, args.decoder, args.backend, args.batch_size,
+                  args.threads))
+    try:
+        # imap hands back the chunks in order, so each recording is replayed front to back
+        results = pool.imap(_analyze_chunk, [task for _, task in tasks])
+        for (input_index, task), (rows, seconds) in zip(tasks, results):
+            inputs[input_index]["checker"].add(rows)
+            busy += seconds
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start
+
+    frames = 0
+    report = {"inputs": []}
+    for item in inputs:
+        checker, history = item["checker"], item["history"]
+        summary = summarize(history.minutes())
+        history.close()
+        frames += checker.frames
+        report["inputs"].append({"path": item["path"], "output": item["output"], "frames": checker.frames,
+                                 "violations": checker.violations, "summary": summary})
+    report.update({
+        "frames": frames,
+        "seconds": round(elapsed, 2),
+        "workers": args.workers,
+        "fps": round(frames / elapsed, 2),
+        "fps_per_core": round(frames / elapsed / min(args.workers, os.cpu_count() or 1), 2),
+        "worker_utilization": round(busy / (elapsed * args.workers), 3),
+    })
+
+    print("[INFO] %d frames in %.1fs: %.1f fps, %.1f fps per core, workers busy %.0f%% of the time" % (
+        frames, elapsed, report["fps"], report["fps_per_core"], 100 * report["worker_utilization"]),
+        file=sys.stderr)
+    for item in report["inputs"]:
+        print("[INFO] %s: %d frames, %d violations" % (item["path"], item["frames"], len(item["violations"])),
+              file=sys.stderr)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
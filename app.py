@@ -1,42 +1,72 @@
+from startup import BackgroundLoader, StartupTimer
+
+import json
+import time
 import tkinter as tk
 import cv2
-import torch
-import posenet
 
 from config import PostureAidConfig
-from alarm import Alarm
-from utils import check_head_within_boundary, draw_boxes
+from metrics import create_metrics
+from renderer import PanelRenderer
+from scheduler import FrameScheduler
+from sources import WebcamSource
 
 
 class PostureAidApplication:
     def __init__(self):
         """ Initialize application which uses OpenCV + Tkinter. It displays
-            a video stream in a Tkinter window and stores current snapshot on disk """
+            a video stream in a Tkinter window and stores current snapshot on disk.
+            The camera preview runs while the model loads in the background,
+            checking becomes available once it is ready """
+
+        self._timer = StartupTimer()
+        self._timer.mark("imports")
 
-        self._running = False
-        self._vs = cv2.VideoCapture(PostureAidConfig.config("CAM_ID"))
+        cam_ids = PostureAidConfig.config("CAM_ID")
+        cam_ids = cam_ids if isinstance(cam_ids, (list, tuple)) else [cam_ids]
+        self._sources = [WebcamSource(cam_id) for cam_id in cam_ids]
         self._pad_x = PostureAidConfig.config("PAD_X")
         self._pad_y = PostureAidConfig.config("PAD_Y")
-        self._correct_pos = PostureAidConfig.config("CORRECT_POS")
-        self._alarm = Alarm(PostureAidConfig.config("ALARM_FILE"))
-        self._model = self._get_model()
-        self._output_stride = self._model.output_stride
+        self._metrics, self._exporter = create_metrics()
+        self._loader = BackgroundLoader(self._load_estimator, self._timer).start()
+        self._monitors = []
+        self._monitor = None
+        self._events = None
+        self._history = None
+        self._governor = None
+
+        self._scheduler = FrameScheduler(
+            max_fps=PostureAidConfig.config("MAX_FPS"),
+            max_latency=PostureAidConfig.config("MAX_LATENCY"),
+            relax_margin=PostureAidConfig.config("RELAX_MARGIN"))
+        self._next_iteration = None
 
         self.root = tk.Tk()
         self.root.title("Posture Aid")
 
         self.root.protocol('WM_DELETE_WINDOW', self._destructor)
 
-        self.panel = tk.Label(self.root)
-        self.panel.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.panelFrame = tk.Frame(self.root)
+        self.panelFrame.pack(fill=tk.BOTH, expand=True)
+
+        self.panels = []
+        self._renderers = []
+        for _ in self._sources:
+            panel = tk.Label(self.panelFrame)
+            panel.pack(fill=tk.BOTH, side=tk.LEFT, expand=True, padx=10, pady=10)
+            self.panels.append(panel)
+            self._renderers.append(PanelRenderer(panel, PostureAidConfig.config("DISPLAY_FPS")))
+
+        self.statusLabel = tk.Label(self.root, text="Loading model...")
+        self.statusLabel.pack(fill=tk.X, side=tk.BOTTOM, padx=10)
 
         self.startBtn = tk.Button(
-            self.root, text="Start", command=self._start_running)
+            self.root, text="Start", command=self._start_running, state=tk.DISABLED)
         self.startBtn.pack(fill=tk.X, side=tk.LEFT,
                            expand=True, padx=10, pady=10)
 
         self.stopBtn = tk.Button(
-            self.root, text="Stop", command=self._stop_running)
+            self.root, text="Stop", command=self._stop_running, state=tk.DISABLED)
         self.stopBtn.pack(fill=tk.X, side=tk.LEFT,
                           expand=True, padx=10, pady=10)
 
@@ -45,13 +75,74 @@ class PostureAidApplication:
         self.settingsBtn.pack(fill=tk.X, side=tk.LEFT,
                               expand=True, padx=10, pady=10)
 
-        self._video_loop()
-    
-    def _get_model(self):
-        model = posenet.load_model(PostureAidConfig.config("MODEL"))
-        if torch.cuda.is_available():
-            model = model.cuda()
-        return model
+        # first iteration once mainloop runs, i.e. once the window is up
+        self._schedule(0)
+
+    def _load_estimator(self, progress):
+        """ Runs on the loader thread, torch (through estimator) is first
+            imported here rather than before the window shows up """
+
+        progress("importing")
+        import events
+        import monitor
+        from estimator import create_estimator
+        if PostureAidConfig.config("AUTO_TUNE") and not PostureAidConfig.config("POSE_SERVER"):
+            from autotune import apply_tuning
+            progress("calibrating")
+            # tuned once per machine and camera resolution, then cached
+            frame_size = self._sources[0].grabber.frame_size
+            apply_tuning(frame_size if all(frame_size) else None, progress=progress)
+        progress("loading model")
+        return create_estimator(metrics=self._metrics)
+
+    def _build_monitors(self):
+        from events import create_event_bus, create_violation_filter
+        from governor import create_governor
+        from history import create_history_store
+        from monitor import MultiPostureMonitor, PostureMonitor
+        from motion import create_motion_gate
+        from tracker import create_head_tracker
+
+        estimator = self._loader.result
+        roi_padding = PostureAidConfig.config("ROI_PADDING") if PostureAidConfig.config("ROI_INFERENCE") else None
+        # the alarm and other consumers of violations run on their own threads
+        self._events = create_event_bus(
+            alarm_file=PostureAidConfig.config("ALARM_FILE"),
+            log_file=PostureAidConfig.config("EVENT_LOG_FILE"),
+            webhook_url=PostureAidConfig.config("EVENT_WEBHOOK_URL"),
+            socket_address=PostureAidConfig.config("EVENT_SOCKET"))
+        self._history = create_history_store()
+        # torch is loaded by now, its thread count can be set
+        self._governor = create_governor()
+
+        # one seat per camera, all seats share the estimator and its model
+        self._monitors = [
+            PostureMonitor(
+                source,
+                estimator,
+                pad_x=self._pad_x,
+                pad_y=self._pad_y,
+                correct_pos=PostureAidConfig.config("CORRECT_POS"),
+                on_event=self._events.publish,
+                seat=seat,
+                roi_padding=roi_padding,
+                motion_gate=create_motion_gate(),
+                tracker=create_head_tracker(),
+                metrics=self._metrics,
+                violation_filter=create_violation_filter(),
+                heartbeat_interval=PostureAidConfig.config("HEARTBEAT_INTERVAL"),
+                history=self._history
+            )
+            for seat, source in enumerate(self._sources)
+        ]
+        if len(self._monitors) == 1:
+            self._monitor = self._monitors[0]
+        else:
+            self._monitor = MultiPostureMonitor(self._monitors, estimator)
+
+        self.statusLabel.pack_forget()
+        self.startBtn.config(state=tk.NORMAL)
+        self.stopBtn.config(state=tk.NORMAL)
 
     def _show_settings(self):
         win = tk.Toplevel()
@@ -86,73 +177,123 @@ class PostureAidApplication:
         win.mainloop()
     
     def _exit_settings(self, win, pad_x, pad_y):
-        self._pad_x = int(pad_x)
-        self._pad_y = int(pad_y)
+        self._pad_x, self._pad_y = int(pad_x), int(pad_y)
+        if self._monitor is not None:
+            self._monitor.set_padding(self._pad_x, self._pad_y)
         win.destroy()
 
     def _start_running(self):
-        self._running = True
+        self._monitor.start()
 
     def _stop_running(self):
-        self._running = False
-        self._alarm.stop()
+        self._monitor.stop()
 
     def _video_loop(self):
         """ Get frame from the video stream and show it in Tkinter """
 
-        input_image, display_image, output_scale = posenet.read_cap(
-            self._vs,
-            scale_factor=PostureAidConfig.config("SCALE_FACTOR"),
-            output_stride=self._output_stride
-        )
-
-        with torch.no_grad():
-            if torch.cuda.is_available():
-                input_image = torch.Tensor(input_image).cuda()
-            else:
-                input_image = torch.Tensor(input_image)
-
-            heatmaps_result, offsets_result, displacement_fwd_result, displacement_bwd_result = self._model(input_image)
-
-            pose_scores, keypoint_scores, keypoint_coords = posenet.decode_multiple_poses(
-                heatmaps_result.squeeze(0),
-                offsets_result.squeeze(0),
-                displacement_fwd_result.squeeze(0),
-                displacement_bwd_result.squeeze(0),
-                output_stride=self._output_stride,
-                max_pose_detections=10,
-                min_pose_score=0.15
-            )
-
-        keypoint_coords *= output_scale        
-        
-        current_pos = posenet.get_pos_from_img(
-            display_image, pose_scores, keypoint_scores, keypoint_coords,
-            min_pose_score=0.15, min_part_score=0.1
-        )
-
-        if self._running:
-            if not check_head_within_boundary(self._correct_pos, current_pos, self._pad_x, self._pad_y):
-                if not self._alarm.is_playing():
-                    self._alarm.play()
+        self._next_iteration = None
+        if not self._scheduler.begin():
+            return
+        self._timer.mark("window")
+        if self._monitor is None:
+            if self._loader.ready:
+                self._build_monitors()
             else:
-                if self._alarm.is_playing():
-                    self._alarm.stop()
+                self._preview()
+                return
+
+        results = self._monitor.step(block=False)
+        if not isinstance(results, list):
+            results = [results]
+        if self._governor is not None:
+            self._govern()
+        if any(results):
+            self._show(results)
+        if any(result is not None and result.poses is not None for result in results):
+            if "first inference" not in self._timer.milestones:
+                self._timer.mark("first inference")
+                print("[INFO] startup: %s" % self._timer.report())
+
+        # the closest seat to its boundary sets the pace, no new frame is retried soon
+        margins = [m.boundary_margin() for m in self._monitors]
+        margins = [m for m in margins if m is not None]
+        delay = self._scheduler.end(
+            margin=min(margins) if margins else None,
+            violation=any(m.in_violation for m in self._monitors),
+            produced=any(results))
+        self._schedule(delay)
+
+    def _govern(self):
+        # frame rate, input resolution and camera decoding follow the CPU budget
+        fps, scale_factor = self._governor.update(any(m.head_found for m in self._monitors))
+        self._scheduler.max_fps = fps
+        self._loader.result.scale_factor = scale_factor
+        for source in self._sources:
+            source.grabber.max_rate = fps
+
+    def _preview(self):
+        """ Plain camera preview while the model is still loading """
+
+        if self._loader.failed:
+            self.statusLabel.config(text="Loading model failed: %s" % self._loader.error)
         else:
-            self._correct_pos = current_pos
-
-        imgtk = draw_boxes(display_image, self._correct_pos, current_pos, self._pad_x, self._pad_y)
-        self.panel.imgtk = imgtk
-        self.panel.config(image=imgtk)
-
-        # call the same function after 30 milliseconds
-        self.root.after(50, self._video_loop)
+            self.statusLabel.config(text="Loading model (%s)..." % self._loader.state)
+
+        produced = False
+        for renderer, source in zip(self._renderers, self._sources):
+            item = source.read(block=False)
+            if item is None:
+                continue
+            self._timer.mark("first frame")
+            renderer.render(item[0])
+            produced = True
+        self._schedule(self._scheduler.end(produced=produced))
+
+    def _schedule(self, delay):
+        # at most one pending iteration, a new request replaces the old one
+        if self._next_iteration is not None:
+            self.root.after_cancel(self._next_iteration)
+        self._next_iteration = self.root.after(int(delay * 1000), self._video_loop)
+
+    def _show(self, results):
+        overlay = None
+        if self._metrics is not None:
+            self._metrics.set_count("dropped_frames", sum(s.grabber.frames_dropped for s in self._sources))
+            if PostureAidConfig.config("METRICS_OVERLAY") and any(r.due() for r in self._renderers):
+                overlay = self._metrics.overlay()
+
+        # renderers drop frames beyond DISPLAY_FPS, inference keeps its own pace
+        for renderer, monitor, result in zip(self._renderers, self._monitors, results):
+            if result is None:
+                continue
+            start = time.perf_counter()
+            rendered = renderer.render(result.frame, result.correct_pos, result.current_pos,
+                                       monitor.pad_x, monitor.pad_y, overlay)
+            if rendered and self._metrics is not None:
+                self._metrics.observe("render", time.perf_counter() - start)
 
     def _destructor(self):
         """ Destroy the root object and release all resources """
         print("[INFO] closing...")
         self.root.destroy()
-        self._vs.release()
+        if self._monitor is not None:
+            self._monitor.close()
+        else:
+            for source in self._sources:
+                source.release()
+            if self._loader.ready:
+                self._loader.result.close()
+        if self._events is not None:
+            self._events.close()
+        if self._history is not None:
+            self._history.close()
+        if self._governor is not None:
+            print("[INFO] cpu: %s" % json.dumps(self._governor.report()))
+        if self._exporter is not None:
+            self._exporter.close()
+        if self._metrics is not None and PostureAidConfig.config("METRICS_DUMP"):
+            self._metrics.dump_json(PostureAidConfig.config("METRICS_DUMP"))
+            print("[INFO] metrics written to %s" % PostureAidConfig.config("METRICS_DUMP"))
         cv2.destroyAllWindows()
 
 
@@ -0,0 +1,207 @@
+""" Pick the model, scale factor and output stride for this machine.
+
+    python -m autotune
+    python -m autotune --target-fps 15 --frame-size 1280x720
+
+    Candidates are tried from the most to the least accurate, by network
+    width times heatmap cells, and the first one whose p90 latency fits the
+    frame budget of the target frame rate wins. The choice is cached per
+    machine, frame size and target, the app runs this on first launch when
+    AUTO_TUNE is set and the command above redoes it.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import posenet
+
+from config import PostureAidConfig
+
+# 100 is left out, it has the architecture and cost of the more accurate 101
+MODEL_IDS = (101, 75, 50)
+SCALE_FACTORS = (1.0, 0.7125, 0.5, 0.35)
+OUTPUT_STRIDES = (8, 16, 32)
+
+# width of the network relative to 101
+DEPTH_MULTIPLIERS = {101: 1.0, 100: 1.0, 75: 0.75, 50: 0.5}
+
+# heatmap cells along the shorter side of the frame, below that a head is a
+# cell or two and the keypoints are mostly guessed from the offsets
+MIN_HEATMAP_SIZE = 9
+
+# part of the cache key, choices made with an earlier ranking are redone
+RANKING_VERSION = 2
+
+CACHE_FILE = os.path.join(os.path.dirname(posenet.MODEL_DIR), "autotune.json")
+
+
+def heatmap_shape(frame_size, scale_factor, output_stride):
+    width, height = posenet.valid_resolution(frame_size[0] * scale_factor, frame_size[1] * scale_factor,
+                                             output_stride=output_stride)
+    return (height - 1) // output_stride + 1, (width - 1) // output_stride + 1
+
+
+def accuracy(frame_size, model_id, scale_factor, output_stride):
+    """ Accuracy proxy of a candidate, network width times heatmap cells """
+
+    rows, columns = heatmap_shape(frame_size, scale_factor, output_stride)
+    return DEPTH_MULTIPLIERS[model_id] * rows * columns
+
+
+def candidates(frame_size, model_ids=MODEL_IDS, scale_factors=SCALE_FACTORS, output_strides=OUTPUT_STRIDES):
+    """ (model, scale factor, output stride) with a heatmap of at least
+        MIN_HEATMAP_SIZE cells a side, most accurate first """
+
+    found = [(model_id, scale_factor, output_stride)
+             for model_id in model_ids for scale_factor in scale_factors for output_stride in output_strides
+             if min(heatmap_shape(frame_size, scale_factor, output_stride)) >= MIN_HEATMAP_SIZE]
+    return sorted(found, key=lambda candidate: accuracy(frame_size, *candidate), reverse=True)
+
+
+def machine_key(frame_size, target_fps, backend):
+    """ Cache key, a tuning only holds for the same hardware, software,
+        camera resolution and target """
+
+    return "|".join(str(part) for part in (
+        platform.node(), platform.machine(), platform.processor(), os.cpu_count(), platform.python_version(),
+        backend, "%dx%d" % tuple(frame_size), target_fps, RANKING_VERSION))
+
+
+def measure(estimator, frame, budget, passes=8, warmup=2):
+    """ p90 latency in seconds of estimating frame. Gives up early, returning
+        what was measured so far, once it is clearly over budget """
+
+    for _ in range(warmup):
+        estimator.estimate(frame)
+    latencies = []
+    for _ in range(passes):
+        start = time.perf_counter()
+        estimator.estimate(frame)
+        latencies.append(time.perf_counter() - start)
+        if len(latencies) >= 3 and min(latencies) > 1.5 * budget:
+            break
+    return float(np.percentile(latencies, 90))
+
+
+def tune(frame_size, target_fps, backend="torch", decoder=None, progress=None, model_ids=MODEL_IDS):
+    """ Benchmark candidates on a synthetic frame_size (width, height) frame
+        and return a dict with the chosen model, scale_factor, output_stride
+        and the measured latencies. Falls back to the fastest candidate when
+        none meets target_fps. Models that can not be loaded are skipped """
+
+    from estimator import PoseEstimator, load_model
+    from sources import SyntheticSource
+
+    decoder = PostureAidConfig.config("DECODER") if decoder is None else decoder
+    required_parts = PostureAidConfig.config("REQUIRED_PARTS")
+    restrict = required_parts if PostureAidConfig.config("RESTRICT_MODEL_OUTPUTS") else None
+    frame = SyntheticSource(*frame_size).read()[0]
+    budget = 1.0 / target_fps
+
+    measured = []
+    chosen = None
+    failed = set()
+    models = {}
+    for model_id, scale_factor, output_stride in candidates(frame_size, model_ids):
+        if model_id in failed:
+            continue
+        if progress is not None:
+            progress("calibrating %s, scale %s, stride %d" % (model_id, scale_factor, output_stride))
+        key = (model_id, output_stride)
+        if key not in models:
+            try:
+                models[key] = load_model(model_id, output_stride, restrict, backend=backend)
+            except (FileNotFoundError, ValueError, IOError) as e:
+                print("[WARN] autotune skips model %s: %s" % (model_id, e))
+                failed.add(model_id)
+                continue
+        estimator = PoseEstimator(models[key], output_stride=output_stride, scale_factor=scale_factor,
+                                  decoder=decoder, required_parts=required_parts)
+        latency = measure(estimator, frame, budget)
+        measured.append({"model": model_id, "scale_factor": scale_factor, "output_stride": output_stride,
+                         "latency": round(latency, 4)})
+        if latency <= budget:
+            chosen = measured[-1]
+            break
+    for model in models.values():
+        model.close()
+
+    if not measured:
+        raise RuntimeError("no model could be loaded for tuning")
+    if chosen is None:
+        chosen = min(measured, key=lambda m: m["latency"])
+        print("[WARN] no configuration reaches %.1f fps, using the fastest one" % target_fps)
+    return dict(chosen, target_fps=target_fps, frame_size=list(frame_size), backend=backend,
+                measured=measured, created=time.time())
+
+
+def load_cache(path=CACHE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=CACHE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(f.name, path)
+
+
+def apply_tuning(frame_size=None, target_fps=None, backend=None, retune=False, progress=None, path=CACHE_FILE):
+    """ Set MODEL, SCALE_FACTOR and OUTPUT_STRIDE in PostureAidConfig from the
+        cached tuning of this machine, tuning first when there is none or
+        retune is set. Returns the tuning """
+
+    frame_size = tuple(frame_size or PostureAidConfig.config("FRAME_SIZE"))
+    target_fps = PostureAidConfig.config("AUTO_TUNE_FPS") if target_fps is None else target_fps
+    backend = PostureAidConfig.config("BACKEND") if backend is None else backend
+
+    cache = load_cache(path)
+    key = machine_key(frame_size, target_fps, backend)
+    tuning = cache.get(key)
+    if tuning is None or retune:
+        start = time.perf_counter()
+        tuning = tune(frame_size, target_fps, backend, progress=progress)
+        print("[INFO] autotune picked model %s, scale factor %s, output stride %d (%.0f ms) in %.1fs" % (
+            tuning["model"], tuning["scale_factor"], tuning["output_stride"], 1000 * tuning["latency"],
+            time.perf_counter() - start))
+        cache[key] = tuning
+        save_cache(cache, path)
+
+    PostureAidConfig.set("MODEL", tuning["model"])
+    PostureAidConfig.set("SCALE_FACTOR", tuning["scale_factor"])
+    PostureAidConfig.set("OUTPUT_STRIDE", tuning["output_stride"])
+    return tuning
+
+
+def _frame_size(value):
+    width, _, height = value.partition("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="autotune", description=__doc__.splitlines()[0])
+    parser.add_argument("--target-fps", type=float, default=PostureAidConfig.config("AUTO_TUNE_FPS"))
+    parser.add_argument("--frame-size", type=_frame_size, default=PostureAidConfig.config("FRAME_SIZE"),
+                        help="camera resolution as WIDTHxHEIGHT")
+    parser.add_argument("--backend", choices=["torch", "onnxruntime", "opencv"],
+                        default=PostureAidConfig.config("BACKEND"))
+    args = parser.parse_args(argv)
+
+    tuning = apply_tuning(args.frame_size, args.target_fps, args.backend, retune=True)
+    for m in tuning["measured"]:
+        print("model %s, scale factor %s, output stride %d: %.1f ms" % (
+            m["model"], m["scale_factor"], m["output_stride"], 1000 * m["latency"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+""" Per stage PostureAid benchmark, no camera needed.
+
+    python -m benchmark --source synthetic --frames 200
+    python -m benchmark --source video --path session.mp4 --models 50 101 --output baseline.json
+    python -m benchmark --models 50 75 100 101 --scale-factors 0.5 0.7125 1.0 --output-strides 8 16
+
+    Frames are read once up front (timed as the capture stage), then every
+    combination of model, scale factor and output stride runs over them.
+    Latencies are reported in milliseconds as p50 / p95 / p99 / mean per
+    stage, together with end to end throughput, as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from config import PostureAidConfig
+
+PERCENTILES = (50, 95, 99)
+
+
+def _summary(samples):
+    samples = np.asarray(samples) * 1000.0
+    summary = {"p%d" % p: round(float(np.percentile(samples, p)), 3) for p in PERCENTILES}
+    summary["mean"] = round(float(samples.mean()), 3)
+    summary["count"] = len(samples)
+    return summary
+
+
+class StageTimer:
+    def __init__(self):
+        """ Collects wall clock durations per stage name """
+
+        self.samples = {}
+
+    def time(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        return {stage: _summary(samples) for stage, samples in self.samples.items()}
+
+
+def read_frames(source, count):
+    """ Up to count frames of a FrameSource, and the time each read took """
+
+    frames = []
+    timer = StageTimer()
+    while len(frames) < count and not source.exhausted:
+        item = timer.time("capture", source.read)
+        if item is not None:
+            frames.append(item[0])
+    source.release()
+    return frames, timer
+
+
+def _display():
+    # draw_boxes creates a Tk PhotoImage, which needs a display
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    return root
+
+
+def run_config(frames, model_id, scale_factor, output_stride, backend="torch", decoder="multi", warmup=5,
+               draw=False):
+    """ Time every stage of one model / scale factor / output stride
+        combination over frames """
+
+    import posenet
+    from estimator import PoseEstimator, load_model
+    from posenet.decode_multi import build_part_with_score, build_part_with_score_torch
+    from utils import check_head_within_boundary, draw_boxes
+
+    required_parts = PostureAidConfig.config("REQUIRED_PARTS")
+    # the same output heads the app builds, so forward times match what ships
+    restrict = required_parts if PostureAidConfig.config("RESTRICT_MODEL_OUTPUTS") else None
+    model = load_model(model_id, output_stride, restrict, backend=backend)
+    keypoints = None if model.keypoints is None else list(model.keypoints)
+
+    def forward(input_image):
+        heatmaps, offsets, displacement_fwd, displacement_bwd = model.run(input_image)
+        if keypoints is not None:
+            heatmaps, offsets = PoseEstimator._expand_keypoints(heatmaps, offsets, keypoints)
+        return heatmaps, offsets, displacement_fwd, displacement_bwd
+
+    decode = posenet.DECODERS[decoder]
+    pad_x, pad_y = PostureAidConfig.config("PAD_X"), PostureAidConfig.config("PAD_Y")
+    correct_pos = None
+
+    try:
+        import torch
+    except ImportError:
+        torch = None
+
+    timer = StageTimer()
+    for i in range(warmup + len(frames)):
+        frame = frames[i % len(frames)]
+        if i == warmup:
+            # warmup passes are not part of the results
+            timer = StageTimer()
+        start = time.perf_counter()
+
+        input_image, _, output_scale = timer.time(
+            "preprocess", posenet.utils._process_input, frame, scale_factor, output_stride)
+        heatmaps, offsets, displacement_fwd, displacement_bwd = timer.time(
+            "forward", forward, input_image)
+        timer.time("part_scores", build_part_with_score, 0.5, posenet.LOCAL_MAXIMUM_RADIUS, heatmaps[0])
+        pose_scores, keypoint_scores, keypoint_coords = timer.time(
+            "decode", decode, heatmaps[0], offsets[0], displacement_fwd[0], displacement_bwd[0],
+            output_stride=output_stride, max_pose_detections=10, min_pose_score=0.15,
+            required_parts=required_parts)
+        keypoint_coords *= output_scale
+        current_pos = timer.time(
+            "head_box", posenet.get_pos_from_img, frame, pose_scores, keypoint_scores, keypoint_coords,
+            min_pose_score=0.15, min_part_score=0.1)
+        # the first frame sets the boundary like pressing Start would
+        correct_pos = correct_pos or current_pos
+        timer.time("boundary", check_head_within_boundary, correct_pos, current_pos, pad_x, pad_y)
+        if draw:
+            timer.time("draw", draw_boxes, frame.copy(), correct_pos, current_pos, pad_x, pad_y)
+        timer.samples.setdefault("end_to_end", []).append(time.perf_counter() - start)
+
+        # the torch part scoring only runs for CUDA outputs, kept out of end_to_end
+        if torch is not None:
+            timer.time("part_scores_torch", build_part_with_score_torch, 0.5, posenet.LOCAL_MAXIMUM_RADIUS,
+                       torch.from_numpy(heatmaps[0]))
+    model.close()
+
+    input_shape = posenet.valid_resolution(
+        frames[0].shape[1] * scale_factor, frames[0].shape[0] * scale_factor, output_stride=output_stride)
+    return {
+        "model": model_id,
+        "scale_factor": scale_factor,
+        "output_stride": output_stride,
+        "backend": backend,
+        "decoder": decoder,
+        "input_size": list(input_shape),
+        "throughput_fps": round(len(frames) / sum(timer.samples["end_to_end"]), 2),
+        "stages": timer.summary(),
+    }
+
+
+def environment():
+    import cv2
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["video", "images", "synthetic"], default="synthetic")
+    parser.add_argument("--path", help="video file or image directory")
+    parser.add_argument("--frames", type=int, default=100, help="frames per combination")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed passes before each combination")
+    parser.add_argument("--models", nargs="+", default=[PostureAidConfig.config("MODEL")],
+                        help="model ids, e.g. 50 75 100 101 101-int8")
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[PostureAidConfig.config("SCALE_FACTOR")])
+    parser.add_argument("--output-strides", type=int, nargs="+", choices=[8, 16, 32],
+                        default=[PostureAidConfig.config("OUTPUT_STRIDE")])
+    parser.add_argument("--backend", choices=["torch", "onnxruntime", "opencv"],
+                        default=PostureAidConfig.config("BACKEND"))
+    parser.add_argument("--decoder", choices=["multi", "vectorized", "single"], default=PostureAidConfig.config("DECODER"))
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from sources import open_source
+
+    if args.source in ("video", "images") and not args.path:
+        print("--path is required for the %s source" % args.source, file=sys.stderr)
+        return 2
+    kwargs = {"num_frames": args.frames} if args.source == "synthetic" else {}
+    frames, capture = read_frames(open_source(args.source, path=args.path, **kwargs), args.frames)
+    if not frames:
+        print("no frames could be read", file=sys.stderr)
+        return 1
+
+    display = _display()
+    if display is None:
+        print("[WARN] no display, the draw stage is not measured", file=sys.stderr)
+
+    results = []
+    errors = []
+    for model_id in args.models:
+        for scale_factor in args.scale_factors:
+            for output_stride in args.output_strides:
+                if any(error["model"] == model_id for error in errors):
+                    # a model that can not be loaded fails the same way at every size
+                    continue
+                try:
+                    result = run_config(frames, model_id, scale_factor, output_stride, args.backend, args.decoder,
+                                        args.warmup, draw=display is not None)
+                except (FileNotFoundError, ValueError, IOError) as e:
+                    print("[WARN] model %s, scale factor %s, output stride %d: %s" % (
+                        model_id, scale_factor, output_stride, e), file=sys.stderr)
+                    errors.append({"model": model_id, "scale_factor": scale_factor,
+                                   "output_stride": output_stride, "error": str(e)})
+                    continue
+                stages = result["stages"]
+                print("[INFO] model %s, scale factor %s, output stride %d: %.1f fps, forward p50 %.1f ms, "
+                      "end to end p95 %.1f ms" % (
+                          model_id, scale_factor, output_stride, result["throughput_fps"],
+                          stages["forward"]["p50"], stages["end_to_end"]["p95"]), file=sys.stderr)
+                results.append(result)
+    if display is not None:
+        display.destroy()
+
+    report = {
+        "environment": environment(),
+        "source": {"kind": args.source, "path": args.path, "frames": len(frames),
+                   "frame_size": [frames[0].shape[1], frames[0].shape[0]]},
+        "capture": capture.summary().get("capture"),
+        "results": results,
+        "errors": errors,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
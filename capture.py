@@ -0,0 +1,120 @@
+import threading
+import time
+
+import cv2
+
+
+class FrameGrabber:
+    def __init__(self, cap, first_frame_timeout=5.0):
+        """ Reads frames from a cv2.VideoCapture on a dedicated thread and keeps
+            only the most recent one, so consumers never wait on the driver
+            buffer and never see stale frames """
+
+        self._cap = cap
+        self._first_frame_timeout = first_frame_timeout
+        self._cond = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._consumed_seq = 0
+        self._failed = False
+        self._running = False
+        self._thread = None
+
+        self.frames_read = 0
+        self.frames_dropped = 0
+        # frames beyond this many per second are grabbed but not decoded
+        self.max_rate = None
+
+    @classmethod
+    def from_camera(cls, cam_id, **kwargs):
+        return cls(cv2.VideoCapture(cam_id), **kwargs)
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._reader, name="FrameGrabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def _reader(self):
+        while self._running:
+            if self.max_rate and time.monotonic() - self._timestamp < 1.0 / self.max_rate:
+                # the driver buffer still has to be drained
+                if self._cap.grab():
+                    continue
+            res, img = self._cap.read()
+            timestamp = time.monotonic()
+            with self._cond:
+                if not res:
+                    self._failed = True
+                    self._cond.notify_all()
+                    break
+                # the previous frame was never picked up by a consumer
+                if self._frame is not None and self._seq != self._consumed_seq:
+                    self.frames_dropped += 1
+                self._frame = img
+                self._timestamp = timestamp
+                self._seq += 1
+                self.frames_read += 1
+                self._cond.notify_all()
+
+    @property
+    def frame_size(self):
+        """ (width, height) the camera delivers, (0, 0) when it does not say """
+
+        return (int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    @property
+    def failed(self):
+        return self._failed
+
+    def has_new_frame(self):
+        with self._cond:
+            return self._seq != self._consumed_seq
+
+    def wait_for_frame(self, timeout=None):
+        """ Block until a frame newer than the last consumed one exists """
+
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._seq != self._consumed_seq or self._failed,
+                timeout=timeout)
+
+    def latest(self):
+        """ Return (frame, timestamp, seq) of the newest frame without blocking.
+            frame is None until the first frame has arrived """
+
+        with self._cond:
+            self._consumed_seq = self._seq
+            return self._frame, self._timestamp, self._seq
+
+    def frame_age(self):
+        with self._cond:
+            if self._frame is None:
+                return None
+            return time.monotonic() - self._timestamp
+
+    def read(self):
+        """ cv2.VideoCapture compatible read. Only waits until the very first
+            frame is available, afterwards it returns the latest frame at once """
+
+        with self._cond:
+            if self._frame is None and not self._failed:
+                self._cond.wait_for(
+                    lambda: self._frame is not None or self._failed,
+                    timeout=self._first_frame_timeout)
+            if self._frame is None or self._failed:
+                return False, None
+            self._consumed_seq = self._seq
+            return True, self._frame
+
+    def release(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self._cap.release()
@@ -3,12 +3,63 @@ class PostureAidConfig:
         "PAD_X": 30,
         "PAD_Y": 30,
         "MODEL": 101,
+        "AUTO_TUNE": False,
+        "AUTO_TUNE_FPS": 10.0,
+        "BACKEND": "torch",
         "CAM_ID": 0,
         "CORRECT_POS": (0,0,0,0),
         "SCALE_FACTOR": 0.7125,
+        "OUTPUT_STRIDE": 16,
+        "DECODER": "multi",
+        "REQUIRED_PARTS": ("nose", "leftEye", "rightEye", "leftEar", "rightEar"),
+        "RESTRICT_MODEL_OUTPUTS": True,
+        "ROI_INFERENCE": False,
+        "ROI_PADDING": 1.0,
+        "MOTION_GATING": False,
+        "MOTION_THRESHOLD": 3.0,
+        "MOTION_REFRESH_INTERVAL": 2.0,
+        "HEAD_TRACKING": False,
+        "TRACKER_MAX_UNCERTAINTY": 6.0,
+        "TRACKER_SAFE_MARGIN": 0.5,
+        "TRACKER_MAX_INTERVAL": 1.0,
+        "CPU_THREADS": None,
+        "NICENESS": 0,
+        "LOW_POWER": False,
+        "CPU_BUDGET": 25.0,
+        "IDLE_AFTER": 120.0,
+        "IDLE_FPS": 0.5,
+        "WATTS_PER_CORE": 10.0,
+        "MAX_FPS": 20.0,
+        "MAX_LATENCY": 0.5,
+        "RELAX_MARGIN": 0.5,
+        "DISPLAY_FPS": 15.0,
+        "COMPILE_MODEL": False,
+        "FOLD_INPUT_NORMALIZATION": False,
+        "FRAME_SIZE": (640, 480),
+        "INFERENCE_PROCESS": False,
+        "WORKER_SLOTS": 3,
+        "POSE_SERVER": None,
+        "POSE_SERVER_JPEG_QUALITY": 90,
+        "POSE_SERVER_TIMEOUT": 2.0,
+        "METRICS": False,
+        "METRICS_OVERLAY": False,
+        "METRICS_FILE": None,
+        "METRICS_PORT": None,
+        "METRICS_DUMP": None,
+        "VIOLATION_START_DELAY": 0.3,
+        "VIOLATION_END_DELAY": 0.5,
+        "VIOLATION_EXIT_MARGIN": 0.1,
+        "HEARTBEAT_INTERVAL": 30.0,
+        "EVENT_LOG_FILE": None,
+        "EVENT_LOG_MAX_BYTES": 1000000,
+        "EVENT_LOG_BACKUPS": 3,
+        "EVENT_WEBHOOK_URL": None,
+        "EVENT_SOCKET": None,
+        "HISTORY_DIR": None,
         "ALARM_FILE": './data/audio/alarm_audio.wav'
     }
-    __setters = []
+    # set by autotune.apply_tuning
+    __setters = ["MODEL", "SCALE_FACTOR", "OUTPUT_STRIDE"]
 
     @staticmethod
     def config(key):
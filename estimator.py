@@ -0,0 +1,495 @@
+import socket
+import time
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+import posenet
+
+import pose_server
+from config import PostureAidConfig
+from inference_worker import InferenceWorker
+
+Poses = namedtuple("Poses", ["pose_scores", "keypoint_scores", "keypoint_coords"])
+
+NUM_KEYPOINTS = len(posenet.PART_NAMES)
+
+# input buffers kept per batch and input size, crop windows come in a few sizes
+MAX_INPUT_BUFFERS = 8
+
+
+class _LazyHeads:
+    def __init__(self, compute):
+        """ Computes some output heads of a batch only when first asked for """
+
+        self._compute = compute
+        self._outputs = None
+
+    def get(self, head_index, batch_index):
+        if self._outputs is None:
+            self._outputs = self._compute()
+        return self._outputs[head_index][batch_index]
+
+    def item(self, head_index, batch_index):
+        return lambda: self.get(head_index, batch_index)
+
+
+class PoseEstimator:
+    def __init__(self, model, output_stride=16, scale_factor=1.0,
+                 max_pose_detections=10, min_pose_score=0.15, decoder="multi",
+                 required_parts=None, metrics=None):
+        """ Turns a BGR frame into decoded poses in frame coordinates. model is
+            a posenet.backends.Backend (a MobileNetV1 module is wrapped in the
+            torch one). decoder names one of posenet.DECODERS, required_parts
+            limits decoding to the keypoints (PART_NAMES) the caller uses.
+            Models with a folded input normalization get the resized frames
+            written straight into reused input buffers. metrics is an optional
+            metrics.PipelineMetrics for the preprocess, forward and decode
+            timings """
+
+        self._decode = posenet.DECODERS[decoder]
+        # the single pose decoder only needs the displacement heads when it has
+        # to fall back to multi pose decoding
+        self._lazy_displacements = decoder == "single"
+        self.required_parts = required_parts
+        self.output_stride = output_stride
+        self.scale_factor = scale_factor
+        self.max_pose_detections = max_pose_detections
+        self.min_pose_score = min_pose_score
+        if not isinstance(model, posenet.backends.Backend):
+            model = posenet.backends.TorchBackend(model)
+        self._model = model
+        self._input_buffers = OrderedDict()
+        self.metrics = metrics
+
+    supports_windows = True
+
+    @staticmethod
+    def _crop(frame, window):
+        if window is None:
+            return frame, np.zeros(2)
+        x0, y0, x1, y1 = window
+        return frame[y0:y1, x0:x1], np.array([y0, x0], dtype=np.float64)
+
+    def preprocess(self, frame, window=None):
+        """ Returns (input_image, output_scale, origin). With a window
+            (x0, y0, x1, y1) only that region of the frame is fed to the model
+            and origin holds its (y, x) offset in the frame """
+
+        start = time.perf_counter()
+        frame, origin = self._crop(frame, window)
+        input_image, _, output_scale = posenet.utils._process_input(
+            frame, scale_factor=self.scale_factor, output_stride=self.output_stride)
+        if self.metrics is not None:
+            self.metrics.observe("preprocess", time.perf_counter() - start)
+        return input_image, output_scale, origin
+
+    def full_input_shape(self, frame):
+        width, height = posenet.valid_resolution(
+            frame.shape[1] * self.scale_factor, frame.shape[0] * self.scale_factor,
+            output_stride=self.output_stride)
+        return height, width
+
+    def estimate(self, frame, window=None):
+        if self._model.input_padding is not None:
+            return self.estimate_batch([frame], [window])[0]
+        return self.estimate_input(*self.preprocess(frame, window))
+
+    def estimate_input(self, input_image, output_scale, origin=None):
+        return self._estimate_batch_input(input_image, [output_scale], [origin])[0]
+
+    def estimate_batch(self, frames, windows=None):
+        """ Estimate poses for several frames with as few forward passes as
+            possible, frames sharing an input size are stacked into one batch """
+
+        windows = windows or [None] * len(frames)
+        if self._model.input_padding is not None:
+            return self._estimate_batch_folded(frames, windows)
+        inputs = [self.preprocess(frame, window) for frame, window in zip(frames, windows)]
+        groups = {}
+        for i, (input_image, _, _) in enumerate(inputs):
+            groups.setdefault(input_image.shape, []).append(i)
+
+        results = [None] * len(frames)
+        for indices in groups.values():
+            batch = np.concatenate([inputs[i][0] for i in indices])
+            output_scales = [inputs[i][1] for i in indices]
+            origins = [inputs[i][2] for i in indices]
+            for i, poses in zip(indices, self._estimate_batch_input(batch, output_scales, origins)):
+                results[i] = poses
+        return results
+
+    def _input_buffer(self, batch, height, width):
+        # (input batch, resize scratch) pair, the border of the input stays at
+        # INPUT_PAD_VALUE and only its interior is ever written
+        key = (batch, height, width)
+        buffers = self._input_buffers.pop(key, None)
+        if buffers is None:
+            padding = self._model.input_padding
+            input_batch = self._model.allocate_input((batch, 3, height + 2 * padding, width + 2 * padding))
+            input_batch.fill(posenet.INPUT_PAD_VALUE)
+            buffers = input_batch, np.empty((height, width, 3), dtype=np.uint8)
+            if len(self._input_buffers) >= MAX_INPUT_BUFFERS:
+                self._input_buffers.popitem(last=False)
+        self._input_buffers[key] = buffers
+        return buffers
+
+    def _estimate_batch_folded(self, frames, windows):
+        crops = [self._crop(frame, window) for frame, window in zip(frames, windows)]
+        groups = {}
+        for i, (crop, _) in enumerate(crops):
+            groups.setdefault(self.full_input_shape(crop), []).append(i)
+
+        results = [None] * len(frames)
+        for (height, width), indices in groups.items():
+            start = time.perf_counter()
+            input_batch, resized = self._input_buffer(len(indices), height, width)
+            output_scales = [
+                posenet.utils._process_input_folded(
+                    crops[i][0], input_batch[j], self._model.input_padding, resized,
+                    scale_factor=self.scale_factor, output_stride=self.output_stride)
+                for j, i in enumerate(indices)]
+            if self.metrics is not None:
+                self.metrics.observe("preprocess", time.perf_counter() - start)
+            origins = [crops[i][1] for i in indices]
+            for i, poses in zip(indices, self._estimate_batch_input(input_batch, output_scales, origins)):
+                results[i] = poses
+        return results
+
+    def _estimate_batch_input(self, input_batch, output_scales, origins):
+        start = time.perf_counter()
+        heatmaps_result, offsets_result, displacements = self._run_model(input_batch)
+        decode_start = time.perf_counter()
+
+        results = []
+        for i, (output_scale, origin) in enumerate(zip(output_scales, origins)):
+            if isinstance(displacements, _LazyHeads):
+                displacement_fwd, displacement_bwd = displacements.item(0, i), displacements.item(1, i)
+            else:
+                displacement_fwd, displacement_bwd = displacements[0][i], displacements[1][i]
+
+            pose_scores, keypoint_scores, keypoint_coords = self._decode(
+                heatmaps_result[i],
+                offsets_result[i],
+                displacement_fwd,
+                displacement_bwd,
+                output_stride=self.output_stride,
+                max_pose_detections=self.max_pose_detections,
+                min_pose_score=self.min_pose_score,
+                required_parts=self.required_parts
+            )
+            keypoint_coords *= output_scale
+            if origin is not None:
+                keypoint_coords += origin
+            results.append(Poses(pose_scores, keypoint_scores, keypoint_coords))
+        if self.metrics is not None:
+            self.metrics.observe("forward", decode_start - start)
+            self.metrics.observe("decode", time.perf_counter() - decode_start)
+            self.metrics.count("inferences", len(results))
+        return results
+
+    def _run_model(self, input_batch):
+        """ Forward pass returning heatmaps and offsets for all 17 keypoints plus
+            the displacement heads, the latter possibly as _LazyHeads """
+
+        displacement_heads = ('displacement_fwd', 'displacement_bwd')
+        if self._lazy_displacements:
+            (heatmaps, offsets), later = self._model.run_split(
+                input_batch, ('heatmap', 'offset'), displacement_heads)
+            displacements = _LazyHeads(later)
+        else:
+            heatmaps, offsets, displacement_fwd, displacement_bwd = self._model.run(
+                input_batch, ('heatmap', 'offset') + displacement_heads)
+            displacements = (displacement_fwd, displacement_bwd)
+
+        keypoints = self._model.keypoints
+        if keypoints is not None:
+            heatmaps, offsets = self._expand_keypoints(heatmaps, offsets, list(keypoints))
+        return heatmaps, offsets, displacements
+
+    @staticmethod
+    def _expand_keypoints(heatmaps, offsets, keypoints):
+        # models restricted to some keypoints output fewer channels, the decoders
+        # index heatmaps and offsets by keypoint id so put them back in place
+        batch, _, height, width = heatmaps.shape
+        full_heatmaps = np.zeros((batch, NUM_KEYPOINTS, height, width), dtype=heatmaps.dtype)
+        full_heatmaps[:, keypoints] = heatmaps
+        full_offsets = np.zeros((batch, 2 * NUM_KEYPOINTS, height, width), dtype=offsets.dtype)
+        full_offsets[:, keypoints + [NUM_KEYPOINTS + k for k in keypoints]] = offsets
+        return full_heatmaps, full_offsets
+
+    def close(self):
+        self._model.close()
+
+
+class WorkerPoseEstimator(PoseEstimator):
+    def __init__(self, model_id, output_stride=16, scale_factor=1.0,
+                 max_pose_detections=10, slots=3, **estimator_kwargs):
+        """ Same interface as PoseEstimator but the model lives in an
+            InferenceWorker process. estimate() returns the newest finished
+            result, or None while nothing new has come back """
+
+        self._model_id = model_id
+        # only preprocessing happens in this process
+        self.metrics = estimator_kwargs.pop("metrics", None)
+        self._estimator_kwargs = estimator_kwargs
+        self._slots = slots
+        self._worker = None
+        self.output_stride = output_stride
+        self.scale_factor = scale_factor
+        self.max_pose_detections = max_pose_detections
+
+    # results arrive frames later, so a crop window can not be checked and
+    # retried on the same frame
+    supports_windows = False
+
+    def _submit(self, key, input_image, output_scale, origin, max_input_shape):
+        if self._worker is None:
+            self._worker = InferenceWorker(
+                self._model_id, self.output_stride,
+                max_input_shape=max_input_shape, slots=self._slots,
+                max_pose_detections=self.max_pose_detections, **self._estimator_kwargs)
+
+        # if every slot is in flight this frame is simply not analysed
+        self._worker.submit(input_image, tag=(key, output_scale, origin))
+
+    def _collect(self):
+        results = {}
+        for (key, output_scale, origin), pose_scores, keypoint_scores, keypoint_coords in self._worker.poll():
+            keypoint_coords *= output_scale
+            keypoint_coords += origin
+            results[key] = Poses(pose_scores, keypoint_scores, keypoint_coords)
+        return results
+
+    def estimate(self, frame, window=None):
+        return self.estimate_batch([frame], [window])[0]
+
+    def estimate_input(self, input_image, output_scale, origin=None):
+        origin = np.zeros(2) if origin is None else origin
+        self._submit(0, input_image, output_scale, origin, input_image.shape[2:])
+        return self._collect().get(0)
+
+    def estimate_batch(self, frames, windows=None):
+        windows = windows or [None] * len(frames)
+        max_input_shape = tuple(np.max([self.full_input_shape(frame) for frame in frames], axis=0))
+        for i, (frame, window) in enumerate(zip(frames, windows)):
+            self._submit(i, *self.preprocess(frame, window), max_input_shape)
+        results = self._collect()
+        return [results.get(i) for i in range(len(frames))]
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
+
+
+class RemotePoseEstimator(PoseEstimator):
+    def __init__(self, address, scale_factor=1.0, max_pose_detections=10, jpeg_quality=90, timeout=2.0,
+                 retry_delay=2.0, metrics=None):
+        """ Same interface as PoseEstimator, the model runs on a pose_server
+            at address ("host:port"). Frames (or their crop window) are
+            scaled by scale_factor and JPEG compressed (raw with jpeg_quality
+            None) before they are sent, the server batches them with the
+            frames of other clients. Frames the server is too busy for, and
+            every frame while it can not be reached, come back as None """
+
+        host, _, port = address.rpartition(":")
+        self.address = (host or "127.0.0.1", int(port))
+        self.scale_factor = scale_factor
+        self.max_pose_detections = max_pose_detections
+        self.jpeg_quality = jpeg_quality
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.metrics = metrics
+        # the server's, known once connected
+        self.output_stride = PostureAidConfig.config("OUTPUT_STRIDE")
+        self.client_limit = None
+        self.rejected = 0
+
+        self._socket = None
+        self._next_id = 0
+        self._last_failure = None
+
+    # a busy or unreachable server answers None, so a cut off crop can not be
+    # counted on to be redone in full on the same frame
+    supports_windows = False
+
+    def _connect(self):
+        if self._socket is not None:
+            return True
+        if self._last_failure is not None and time.monotonic() - self._last_failure < self.retry_delay:
+            return False
+        try:
+            self._socket = socket.create_connection(self.address, timeout=self.timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            hello, _ = pose_server.read_message(self._socket)
+        except (OSError, ValueError) as e:
+            self._disconnect(e)
+            return False
+        self.output_stride = hello["output_stride"]
+        self.client_limit = hello.get("client_limit")
+        if self._last_failure is not None:
+            print("[INFO] pose server %s:%d is back" % self.address)
+        self._last_failure = None
+        return True
+
+    def _disconnect(self, error):
+        if self._last_failure is None:
+            print("[WARN] pose server %s:%d: %s" % (self.address + (error,)))
+        self._last_failure = time.monotonic()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _encode(self, frame, window):
+        crop, origin = self._crop(frame, window)
+        height, width = crop.shape[:2]
+        size = (max(1, int(round(width * self.scale_factor))), max(1, int(round(height * self.scale_factor))))
+        if size != (width, height):
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        header, payload = pose_server.encode_frame(crop, self.jpeg_quality)
+        # (y, x) factor back to frame coordinates
+        scale = np.array([height / size[1], width / size[0]])
+        return header, payload, scale, origin
+
+    def estimate(self, frame, window=None):
+        return self.estimate_batch([frame], [window])[0]
+
+    def estimate_input(self, input_image, output_scale, origin=None):
+        """ Sends a preprocessed model input, turned back into the BGR image
+            it was made from """
+
+        start = time.perf_counter()
+        image = (input_image[0].transpose((1, 2, 0)) + 1.0) * (255.0 / 2.0)
+        image = cv2.cvtColor(np.clip(image, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+        header, payload = pose_server.encode_frame(image, self.jpeg_quality)
+        origin = np.zeros(2) if origin is None else origin
+        return self._request([(header, payload, np.asarray(output_scale), origin)], start)[0]
+
+    def estimate_batch(self, frames, windows=None):
+        """ Sends as many frames as the server takes in flight per client
+            before waiting for their answers, so they can end up in one batch
+            on the server """
+
+        windows = windows or [None] * len(frames)
+        if not self._connect():
+            return [None] * len(frames)
+        start = time.perf_counter()
+        return self._request([self._encode(frame, window) for frame, window in zip(frames, windows)], start)
+
+    def _request(self, encoded, start):
+        results = [None] * len(encoded)
+        if not self._connect():
+            return results
+
+        # more than the server's limit per client in flight would come back busy
+        limit = self.client_limit or max(1, len(encoded))
+        sent = time.perf_counter()
+        try:
+            for first in range(0, len(encoded), limit):
+                requests = {}
+                messages = []
+                for i, (header, payload, scale, origin) in enumerate(encoded[first:first + limit], first):
+                    header["id"] = self._next_id
+                    requests[self._next_id] = (i, scale, origin)
+                    self._next_id += 1
+                    messages.append(pose_server.encode_message(header, payload))
+                self._socket.sendall(b"".join(messages))
+                while requests:
+                    header, payload = pose_server.read_message(self._socket)
+                    if header.get("id") not in requests:
+                        continue
+                    i, scale, origin = requests.pop(header["id"])
+                    if "error" in header:
+                        self.rejected += 1
+                        continue
+                    pose_scores, keypoint_scores, keypoint_coords = pose_server.decode_poses(
+                        header["poses"], payload, self.max_pose_detections)
+                    keypoint_coords *= scale
+                    keypoint_coords += origin
+                    results[i] = Poses(pose_scores, keypoint_scores, keypoint_coords)
+        except (OSError, ValueError) as e:
+            self._disconnect(e)
+
+        if self.metrics is not None:
+            self.metrics.observe("preprocess", sent - start)
+            self.metrics.observe("forward", time.perf_counter() - sent)
+            self.metrics.count("inferences", sum(result is not None for result in results))
+        return results
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def load_model(model_id=None, output_stride=None, required_parts=None, input_shape=None, backend=None,
+               fold_input=False):
+    """ Load MobileNetV1 on one of posenet.backends.BACKENDS. With
+        required_parts the heatmap and offset heads only produce the keypoints
+        decoding those parts can reach. With input_shape (height, width) the
+        model is compiled and warmed up for that size. fold_input folds the
+        input normalization into the model. All three only apply to the
+        torch backend """
+
+    model_id = PostureAidConfig.config("MODEL") if model_id is None else model_id
+    output_stride = PostureAidConfig.config("OUTPUT_STRIDE") if output_stride is None else output_stride
+    backend = PostureAidConfig.config("BACKEND") if backend is None else backend
+    keypoints = None
+    if required_parts is not None:
+        keypoints = posenet.get_connecting_keypoints(required_parts)
+    return posenet.load_backend(backend, model_id, output_stride, keypoints=keypoints, input_shape=input_shape,
+                                fold_input=fold_input)
+
+
+def compiled_input_shape(output_stride=None, scale_factor=None):
+    """ Model input size (height, width) for FRAME_SIZE frames when
+        COMPILE_MODEL is set, None otherwise """
+
+    if not PostureAidConfig.config("COMPILE_MODEL"):
+        return None
+    output_stride = PostureAidConfig.config("OUTPUT_STRIDE") if output_stride is None else output_stride
+    scale_factor = PostureAidConfig.config("SCALE_FACTOR") if scale_factor is None else scale_factor
+    frame_width, frame_height = PostureAidConfig.config("FRAME_SIZE")
+    width, height = posenet.valid_resolution(
+        frame_width * scale_factor, frame_height * scale_factor, output_stride=output_stride)
+    return height, width
+
+
+def create_estimator(model_id=None, output_stride=None, scale_factor=None, model=None, decoder=None,
+                     backend=None, metrics=None, server=None):
+    """ Build the estimator described by PostureAidConfig, any argument given
+        explicitly takes precedence over the config. With a server address
+        ("host:port", POSE_SERVER) poses come from a pose_server """
+
+    model_id = PostureAidConfig.config("MODEL") if model_id is None else model_id
+    output_stride = PostureAidConfig.config("OUTPUT_STRIDE") if output_stride is None else output_stride
+    scale_factor = PostureAidConfig.config("SCALE_FACTOR") if scale_factor is None else scale_factor
+
+    decoder = PostureAidConfig.config("DECODER") if decoder is None else decoder
+    backend = PostureAidConfig.config("BACKEND") if backend is None else backend
+    required_parts = PostureAidConfig.config("REQUIRED_PARTS")
+    restrict_outputs = PostureAidConfig.config("RESTRICT_MODEL_OUTPUTS")
+
+    server = PostureAidConfig.config("POSE_SERVER") if server is None else server
+    if server:
+        return RemotePoseEstimator(
+            server, scale_factor=scale_factor,
+            jpeg_quality=PostureAidConfig.config("POSE_SERVER_JPEG_QUALITY"),
+            timeout=PostureAidConfig.config("POSE_SERVER_TIMEOUT"), metrics=metrics)
+
+    input_shape = compiled_input_shape(output_stride, scale_factor)
+
+    if PostureAidConfig.config("INFERENCE_PROCESS"):
+        return WorkerPoseEstimator(
+            model_id, output_stride=output_stride, scale_factor=scale_factor,
+            slots=PostureAidConfig.config("WORKER_SLOTS"), compile_model=input_shape is not None,
+            backend=backend, restrict_outputs=restrict_outputs, decoder=decoder, required_parts=required_parts,
+            metrics=metrics)
+
+    if model is None:
+        model = load_model(model_id, output_stride, required_parts if restrict_outputs else None,
+                           input_shape=input_shape, backend=backend,
+                           fold_input=PostureAidConfig.config("FOLD_INPUT_NORMALIZATION"))
+    return PoseEstimator(model, output_stride=output_stride, scale_factor=scale_factor,
+                         decoder=decoder, required_parts=required_parts, metrics=metrics)
@@ -0,0 +1,352 @@
+import json
+import logging
+import logging.handlers
+import queue
+import socket
+import sys
+import threading
+import time
+import urllib.request
+
+from config import PostureAidConfig
+from monitor import HEARTBEAT, VIOLATION_END, VIOLATION_START
+
+_STOP = object()
+
+
+def event_dict(event):
+    """ JSON serializable PostureEvent. timestamp is the monotonic frame time,
+        time the wall clock time it corresponds to """
+
+    return {
+        "event": event.kind,
+        "timestamp": round(event.timestamp, 3),
+        "time": round(time.time() - (time.monotonic() - event.timestamp), 3),
+        "seat": event.seat,
+        "in_violation": event.in_violation,
+        "current_pos": list(event.current_pos),
+        "correct_pos": list(event.correct_pos),
+    }
+
+
+class ViolationFilter:
+    def __init__(self, exit_margin=0.1, start_delay=0.3, end_delay=0.5):
+        """ Debounces the per frame boundary check of a PostureMonitor. A
+            violation starts once the head has been outside of the boundary
+            for start_delay seconds and ends once it has been back inside by
+            at least exit_margin (a fraction of the padding, see
+            utils.boundary_margin) for end_delay seconds, so a head sitting
+            on the boundary or a single bad estimate does not toggle it """
+
+        self.exit_margin = exit_margin
+        self.start_delay = start_delay
+        self.end_delay = end_delay
+        self.reset()
+
+    def reset(self):
+        self.in_violation = False
+        self._pending_since = None
+
+    def update(self, in_bounds, margin, timestamp):
+        """ Feed the boundary check of one frame, returns the debounced state """
+
+        if self.in_violation:
+            changing = in_bounds and margin >= self.exit_margin
+            delay = self.end_delay
+        else:
+            changing = not in_bounds
+            delay = self.start_delay
+        if not changing:
+            self._pending_since = None
+        elif self._pending_since is None:
+            self._pending_since = timestamp
+        if self._pending_since is not None and timestamp - self._pending_since >= delay:
+            self.in_violation = not self.in_violation
+            self._pending_since = None
+        return self.in_violation
+
+
+class Sink:
+    """ Consumer of posture events. Every sink runs on its own thread of an
+        EventBus: open() first, then handle() with batches of events, idle()
+        when nothing arrived for poll_interval seconds and close() at the end """
+
+    poll_interval = 1.0
+
+    def __str__(self):
+        return type(self).__name__
+
+    def open(self):
+        pass
+
+    def handle(self, events):
+        raise NotImplementedError
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AudioSink(Sink):
+    poll_interval = 0.1
+
+    def __init__(self, file_path):
+        """ Loops the alarm sound while any seat is in violation """
+
+        self.file_path = file_path
+        self._alarm = None
+        self._violating = set()
+
+    def open(self):
+        # simpleaudio and the wave file load here, off the frame loop
+        from alarm import Alarm
+        self._alarm = Alarm(self.file_path)
+
+    def handle(self, events):
+        for event in events:
+            if event.kind == VIOLATION_START or (event.kind == HEARTBEAT and event.in_violation):
+                self._violating.add(event.seat)
+            elif event.kind == VIOLATION_END or event.kind == HEARTBEAT:
+                self._violating.discard(event.seat)
+        self.idle()
+
+    def idle(self):
+        if self._violating:
+            self._alarm.play()
+        else:
+            self._alarm.stop()
+
+    def close(self):
+        if self._alarm is not None:
+            self._alarm.stop()
+
+
+class StreamSink(Sink):
+    def __init__(self, stream=None):
+        """ JSON lines on a text stream, stdout by default """
+
+        self.stream = stream or sys.stdout
+
+    def handle(self, events):
+        self.stream.write("".join(json.dumps(event_dict(event)) + "\n" for event in events))
+        self.stream.flush()
+
+
+class LogSink(Sink):
+    def __init__(self, path, max_bytes=1000000, backup_count=3):
+        """ JSON lines in a log file rotated at max_bytes, keeping
+            backup_count old files """
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._handler = None
+
+    def open(self):
+        self._handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backup_count)
+
+    def handle(self, events):
+        for event in events:
+            self._handler.emit(logging.makeLogRecord({"msg": json.dumps(event_dict(event))}))
+
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+
+
+class _ReportingSink(Sink):
+    # network sinks warn once per failure streak instead of once per batch
+    _failing = False
+
+    def _failed(self, error):
+        if not self._failing:
+            print("[WARN] %s: %s" % (self, error))
+        self._failing = True
+
+    def _sent(self):
+        if self._failing:
+            print("[INFO] %s recovered" % self)
+        self._failing = False
+
+
+class WebhookSink(_ReportingSink):
+    def __init__(self, url, timeout=5.0):
+        """ POSTs every batch as {"events": [...]} JSON to url. Batches that
+            fail are dropped """
+
+        self.url = url
+        self.timeout = timeout
+
+    def __str__(self):
+        return "webhook %s" % self.url
+
+    def handle(self, events):
+        body = json.dumps({"events": [event_dict(event) for event in events]}).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except OSError as e:
+            self._failed(e)
+        else:
+            self._sent()
+
+
+class SocketSink(_ReportingSink):
+    def __init__(self, address):
+        """ One JSON datagram per event, to "host:port" over UDP or to a unix
+            datagram socket path. Nobody listening is not an error """
+
+        self.address = address
+        host, _, port = address.rpartition(":")
+        if host and port.isdigit():
+            self._family, self._target = socket.AF_INET, (host, int(port))
+        else:
+            self._family, self._target = socket.AF_UNIX, address
+        self._socket = None
+
+    def __str__(self):
+        return "socket %s" % self.address
+
+    def open(self):
+        self._socket = socket.socket(self._family, socket.SOCK_DGRAM)
+
+    def handle(self, events):
+        try:
+            for event in events:
+                self._socket.sendto(json.dumps(event_dict(event)).encode("utf-8"), self._target)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        except OSError as e:
+            self._failed(e)
+        else:
+            self._sent()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+
+
+class _SinkWorker:
+    def __init__(self, sink, max_pending, batch_size):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.enabled = True
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._run, name="events-%s" % type(sink).__name__, daemon=True)
+
+    def _run(self):
+        try:
+            self.sink.open()
+        except Exception as e:
+            print("[WARN] %s disabled: %s" % (self.sink, e))
+            self.enabled = False
+            return
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=self.sink.poll_interval)]
+            except queue.Empty:
+                self._call(self.sink.idle)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # an event published while close() queued the stop can land behind it
+            if _STOP in batch:
+                stopping = True
+                batch = batch[:batch.index(_STOP)]
+            if batch:
+                self._call(self.sink.handle, batch)
+        self._call(self.sink.close)
+
+    def _call(self, method, *args):
+        # a broken sink must not take the others, or the bus, down
+        try:
+            method(*args)
+        except Exception as e:
+            print("[WARN] %s: %s" % (self.sink, e))
+
+
+class EventBus:
+    def __init__(self, sinks=(), max_pending=256, batch_size=32):
+        """ Hands PostureEvents from the frame loop to sinks. publish() only
+            puts the event on a bounded queue per sink and never blocks, each
+            sink drains its own queue on a background thread in batches of
+            up to batch_size, so a slow webhook neither stalls the frame loop
+            nor delays the alarm. A full queue drops the new event """
+
+        self._workers = [_SinkWorker(sink, max_pending, batch_size) for sink in sinks]
+        self.published = 0
+        self._closing = False
+
+    @property
+    def dropped(self):
+        return sum(worker.dropped for worker in self._workers)
+
+    def start(self):
+        for worker in self._workers:
+            worker.thread.start()
+        return self
+
+    def publish(self, event):
+        if self._closing:
+            return
+        self.published += 1
+        for worker in self._workers:
+            if not worker.enabled:
+                continue
+            try:
+                worker.queue.put_nowait(event)
+            except queue.Full:
+                worker.dropped += 1
+
+    def close(self, timeout=2.0):
+        """ Deliver what is queued and stop the sinks, waiting at most timeout
+            seconds in total """
+
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if not worker.enabled:
+                continue
+            try:
+                worker.queue.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                continue
+        for worker in self._workers:
+            worker.thread.join(max(0.0, deadline - time.monotonic()))
+        if self.dropped:
+            print("[WARN] %d posture events were dropped by slow sinks" % self.dropped)
+
+
+def create_event_bus(alarm_file=None, log_file=None, webhook_url=None, socket_address=None, stream=None):
+    """ Started EventBus with a sink for each of the given outputs """
+
+    sinks = []
+    if alarm_file is not None:
+        sinks.append(AudioSink(alarm_file))
+    if stream is not None:
+        sinks.append(StreamSink(stream))
+    if log_file is not None:
+        sinks.append(LogSink(log_file, PostureAidConfig.config("EVENT_LOG_MAX_BYTES"),
+                             PostureAidConfig.config("EVENT_LOG_BACKUPS")))
+    if webhook_url is not None:
+        sinks.append(WebhookSink(webhook_url))
+    if socket_address is not None:
+        sinks.append(SocketSink(socket_address))
+    return EventBus(sinks).start()
+
+
+def create_violation_filter():
+    """ ViolationFilter as configured in PostureAidConfig """
+
+    return ViolationFilter(exit_margin=PostureAidConfig.config("VIOLATION_EXIT_MARGIN"),
+                           start_delay=PostureAidConfig.config("VIOLATION_START_DELAY"),
+                           end_delay=PostureAidConfig.config("VIOLATION_END_DELAY"))
@@ -0,0 +1,175 @@
+import ctypes
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import cv2
+
+from config import PostureAidConfig
+
+# (fraction of the frame rate, fraction of the scale factor), most expensive first
+LEVELS = ((1.0, 1.0), (0.75, 1.0), (0.5, 1.0), (0.5, 0.8), (0.35, 0.8), (0.25, 0.65), (0.15, 0.5))
+
+# stepping back up needs some headroom, otherwise the level flips every window
+RAISE_BELOW = 0.6
+
+
+def configure_threads(threads=None, niceness=0):
+    """ Cap the intra-op threads of OpenCV and, when it is loaded, torch and
+        lower the priority of the process by niceness (POSIX only) """
+
+    if threads is not None:
+        cv2.setNumThreads(threads)
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(threads)
+    if niceness and hasattr(os, "nice"):
+        try:
+            os.nice(niceness)
+        except OSError as e:
+            print("[WARN] could not lower the process priority: %s" % e)
+
+
+def screen_idle_seconds():
+    """ Seconds since the last keyboard or mouse input, None where that can
+        not be told (Windows, X11 with xprintidle installed and macOS are) """
+
+    if sys.platform == "win32":
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+        info = LASTINPUTINFO(ctypes.sizeof(LASTINPUTINFO), 0)
+        if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+            return None
+        return (ctypes.windll.kernel32.GetTickCount() - info.dwTime) / 1000.0
+    try:
+        if sys.platform == "darwin":
+            output = subprocess.run(["ioreg", "-c", "IOHIDSystem"], capture_output=True, text=True,
+                                    timeout=1.0).stdout
+            match = re.search(r'"HIDIdleTime" = (\d+)', output)
+            return int(match.group(1)) / 1e9 if match else None
+        if os.environ.get("DISPLAY") and shutil.which("xprintidle"):
+            output = subprocess.run(["xprintidle"], capture_output=True, text=True, timeout=1.0).stdout
+            return int(output) / 1000.0
+    except (OSError, ValueError, subprocess.SubprocessError):
+        pass
+    return None
+
+
+class CpuGovernor:
+    def __init__(self, budget=25.0, max_fps=20.0, scale_factor=0.7125, adapt_scale=True, idle_after=120.0,
+                 idle_fps=0.5, window=5.0, watts_per_core=10.0, screen_probe_interval=10.0):
+        """ Keeps the CPU use of the process, measured with time.process_time()
+            over window seconds, under budget percent of one core. Above it
+            the frame rate and (with adapt_scale) the scale factor step down
+            through LEVELS, well below it they step back up. When no face
+            was seen or the screen had no input for idle_after seconds, the
+            loop drops to idle_fps until a face shows up again. report()
+            gives the CPU use and an energy estimate at watts_per_core """
+
+        self.budget = budget
+        self.max_fps = max_fps
+        self.scale_factor = scale_factor
+        self.adapt_scale = adapt_scale
+        self.idle_after = idle_after
+        self.idle_fps = idle_fps
+        self.window = window
+        self.watts_per_core = watts_per_core
+        self.screen_probe_interval = screen_probe_interval
+
+        self.level = 0
+        self.idle = False
+        self.cpu_percent = 0.0
+        self.level_changes = 0
+
+        now = time.monotonic()
+        self._started = (now, time.process_time())
+        self._window_start = self._started
+        self._last_face = now
+        self._idle_seconds = 0.0
+        self._last_update = now
+        self._screen_idle = None
+        self._screen_probe = None
+
+    @property
+    def fps(self):
+        if self.idle:
+            return min(self.idle_fps, self.max_fps)
+        return self.max_fps * LEVELS[self.level][0]
+
+    @property
+    def current_scale_factor(self):
+        if not self.adapt_scale:
+            return self.scale_factor
+        return self.scale_factor * LEVELS[self.level][1]
+
+    def _screen_idle_for(self, now):
+        # asking the desktop spawns a process on some platforms, not every frame
+        if self._screen_probe is None or now - self._screen_probe >= self.screen_probe_interval:
+            self._screen_probe = now
+            self._screen_idle = screen_idle_seconds()
+        return self._screen_idle
+
+    def update(self, face_seen, now=None):
+        """ Call once per frame. Returns the (frame rate, scale factor) to run at """
+
+        now = time.monotonic() if now is None else now
+        if self.idle:
+            self._idle_seconds += now - self._last_update
+        self._last_update = now
+
+        if face_seen:
+            self._last_face = now
+        screen_idle = self._screen_idle_for(now)
+        self.idle = (now - self._last_face >= self.idle_after or
+                     (screen_idle is not None and screen_idle >= self.idle_after))
+
+        window_start, cpu_start = self._window_start
+        if now - window_start >= self.window:
+            cpu = time.process_time()
+            self.cpu_percent = 100.0 * (cpu - cpu_start) / (now - window_start)
+            self._window_start = (now, cpu)
+            # the idle duty cycle is cheap anyway, levels only adapt to real load
+            if not self.idle:
+                if self.cpu_percent > self.budget and self.level < len(LEVELS) - 1:
+                    self.level += 1
+                    self.level_changes += 1
+                elif self.cpu_percent < RAISE_BELOW * self.budget and self.level > 0:
+                    self.level -= 1
+                    self.level_changes += 1
+        return self.fps, self.current_scale_factor
+
+    def report(self):
+        """ CPU use since the governor was created, as a JSON serializable dict """
+
+        started, cpu_started = self._started
+        elapsed = max(time.monotonic() - started, 1e-6)
+        cpu_seconds = time.process_time() - cpu_started
+        return {
+            "seconds": round(elapsed, 1),
+            "cpu_seconds": round(cpu_seconds, 1),
+            "cpu_percent": round(100.0 * cpu_seconds / elapsed, 1),
+            "idle_fraction": round(self._idle_seconds / elapsed, 3),
+            "level": self.level,
+            "level_changes": self.level_changes,
+            # busy core seconds times a typical per core draw, an estimate only
+            "energy_wh": round(cpu_seconds * self.watts_per_core / 3600.0, 3),
+        }
+
+
+def create_governor(max_fps=None, scale_factor=None):
+    """ CpuGovernor as configured in PostureAidConfig, None when LOW_POWER is
+        off. Applies CPU_THREADS and NICENESS either way """
+
+    configure_threads(PostureAidConfig.config("CPU_THREADS"), PostureAidConfig.config("NICENESS"))
+    if not PostureAidConfig.config("LOW_POWER"):
+        return None
+    return CpuGovernor(
+        budget=PostureAidConfig.config("CPU_BUDGET"),
+        max_fps=PostureAidConfig.config("MAX_FPS") if max_fps is None else max_fps,
+        scale_factor=PostureAidConfig.config("SCALE_FACTOR") if scale_factor is None else scale_factor,
+        idle_after=PostureAidConfig.config("IDLE_AFTER"),
+        idle_fps=PostureAidConfig.config("IDLE_FPS"),
+        watts_per_core=PostureAidConfig.config("WATTS_PER_CORE"))
@@ -0,0 +1,353 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from config import PostureAidConfig
+
+MAGIC = b"PAHIST1\n"
+
+# one row per processed frame, 22 bytes
+RECORD = np.dtype([
+    ("time", "<f8"), ("seat", "u1"), ("flags", "u1"),
+    ("x", "<i2"), ("y", "<i2"), ("w", "<i2"), ("h", "<i2"), ("score", "<f4")])
+
+# flags of a RECORD row
+CHECKING = 1
+IN_BOUNDS = 2
+IN_VIOLATION = 4
+
+ROLLUP = np.dtype([
+    ("start", "<f8"), ("seat", "u1"), ("frames", "<u4"), ("checked", "<u4"), ("out_of_bounds", "<u4"),
+    ("no_head", "<u4"), ("violations", "<u4"), ("seconds_checked", "<f4"), ("seconds_out", "<f4"),
+    ("score_sum", "<f8"), ("cx_sum", "<f8"), ("cy_sum", "<f8")])
+
+_SUMMED = [name for name in ROLLUP.names if name not in ("start", "seat")]
+
+MINUTE = 60
+HOUR = 3600
+
+# frames further apart than this (paused, suspended) do not count as time
+MAX_GAP = 5.0
+
+
+def _write_header(f, dtype):
+    header = json.dumps({"dtype": dtype.descr, "created": time.time()}).encode("utf-8")
+    # records start on a 64 byte boundary
+    padding = -(len(MAGIC) + 4 + len(header)) % 64
+    f.write(MAGIC + len(header + b" " * padding).to_bytes(4, "little") + header + b" " * padding)
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a posture history file" % path)
+        length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(length).decode("utf-8"))
+    dtype = np.dtype([tuple(field) for field in header["dtype"]])
+    return dtype, len(MAGIC) + 4 + length
+
+
+class _ColumnFile:
+    def __init__(self, path, dtype):
+        """ Append-only file of fixed size dtype records behind a small
+            header, read back through a memory map """
+
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            file_dtype, self.offset = _read_header(path)
+            if file_dtype != dtype:
+                raise ValueError("%s holds %s records, expected %s" % (path, file_dtype, dtype))
+            # drop a record cut short by a crash, or every later one would be misaligned
+            complete = self.offset + (os.path.getsize(path) - self.offset) // dtype.itemsize * dtype.itemsize
+            if os.path.getsize(path) != complete:
+                os.truncate(path, complete)
+        else:
+            with open(path, "wb") as f:
+                _write_header(f, dtype)
+            self.offset = os.path.getsize(path)
+        self.dtype = dtype
+        self._file = open(path, "ab")
+
+    def append(self, records):
+        self._file.write(records.tobytes())
+        self._file.flush()
+
+    def __len__(self):
+        # a record that is still being written is ignored
+        return (os.path.getsize(self.path) - self.offset) // self.dtype.itemsize
+
+    def memmap(self):
+        count = len(self)
+        if count == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,))
+
+    def close(self):
+        self._file.close()
+
+
+def combine(rollups):
+    """ Merge rollup rows of the same seat and period start, e.g. the two
+        halves of a minute split by a restart, sorted by start and seat """
+
+    if len(rollups) == 0:
+        return rollups
+    rollups = np.sort(rollups, order=["start", "seat"])
+    keys = np.stack([rollups["start"], rollups["seat"].astype(np.float64)], axis=1)
+    first = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+    if len(first) == len(rollups):
+        return rollups
+    combined = rollups[first].copy()
+    for name in _SUMMED:
+        combined[name] = np.add.reduceat(rollups[name], first)
+    return combined
+
+
+class _Rollup:
+    def __init__(self, period):
+        """ Open period buckets, one ROLLUP row per seat. They are plain lists
+            (start, seat, *sums), NumPy scalars are slow to add up per frame """
+
+        self.period = period
+        self._open = {}
+
+    def add(self, seat, start, values):
+        """ Add the _SUMMED values of a frame or a shorter period, returns the
+            bucket that closed as a result, if any """
+
+        start = start - start % self.period
+        bucket = self._open.get(seat)
+        closed = None
+        if bucket is not None and bucket[0] != start:
+            closed = bucket
+            bucket = None
+        if bucket is None:
+            bucket = [start, seat] + [0] * len(_SUMMED)
+            self._open[seat] = bucket
+        for i, value in enumerate(values, 2):
+            bucket[i] += value
+        return closed
+
+    def open_buckets(self):
+        return np.array([tuple(bucket) for bucket in self._open.values()], dtype=ROLLUP)
+
+    def close_all(self):
+        buckets = self.open_buckets()
+        self._open = {}
+        return buckets
+
+
+class HistoryStore:
+    def __init__(self, path, chunk_size=4096, flush_interval=10.0, clock_offset=None):
+        """ Per frame head box, pose score and boundary state of every seat
+            over a long session. Rows are written into preallocated NumPy
+            chunks of chunk_size RECORDs, a background thread appends full
+            chunks, and every flush_interval seconds whatever is buffered,
+            to path. Minute and hour ROLLUPs are accumulated as rows come in
+            and appended to path.minutes and path.hours once their period is
+            over. Queries map the files into memory and binary search the
+            time column, so only the requested range is read. Reopening an
+            existing file appends to it. Row times are the appended
+            timestamps plus clock_offset, by default the offset from
+            time.monotonic() to the wall clock """
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.rows = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._records = _ColumnFile(path, RECORD)
+        self._minute_file = _ColumnFile(path + ".minutes", ROLLUP)
+        self._hour_file = _ColumnFile(path + ".hours", ROLLUP)
+        self._minutes = _Rollup(MINUTE)
+        self._hours = _Rollup(HOUR)
+
+        self._clock_offset = time.time() - time.monotonic() if clock_offset is None else clock_offset
+        self._last_time = 0.0
+        self._last = {}
+        self._chunk = np.empty(chunk_size, dtype=RECORD)
+        self._length = 0
+        self._flushed = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, timestamp, seat, box, score, checking, in_bounds, in_violation):
+        """ Record one frame. timestamp is the frame time, time.monotonic()
+            for live frames, box the (x, y, w, h) head box, (0, 0, 0, 0)
+            without a head """
+
+        wall_time = timestamp + self._clock_offset
+        (x, y, w, h) = box
+        flags = (CHECKING if checking else 0) | (IN_BOUNDS if in_bounds else 0) | (IN_VIOLATION if in_violation else 0)
+        with self._lock:
+            # seats are read one after the other, keep the time column sorted
+            wall_time = max(wall_time, self._last_time)
+            self._last_time = wall_time
+            self._chunk[self._length] = (wall_time, seat, flags, x, y, w, h, score)
+            self._length += 1
+            self.rows += 1
+            if self._length == self.chunk_size:
+                self._queue.put(self._chunk[self._flushed:])
+                self._chunk = np.empty(self.chunk_size, dtype=RECORD)
+                self._length = self._flushed = 0
+                self._last_flush = time.monotonic()
+            elif time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_partial()
+            self._roll_up(wall_time, seat, flags, box, score)
+
+    def _flush_partial(self):
+        # rows keep being added to the chunk, so the writer gets a copy
+        if self._length > self._flushed:
+            self._queue.put(self._chunk[self._flushed:self._length].copy())
+            self._flushed = self._length
+        self._last_flush = time.monotonic()
+
+    def _roll_up(self, wall_time, seat, flags, box, score):
+        last_time, last_flags = self._last.get(seat, (None, 0))
+        self._last[seat] = (wall_time, flags)
+        dt = 0.0 if last_time is None else wall_time - last_time
+        dt = dt if dt <= MAX_GAP else 0.0
+        checking = bool(flags & CHECKING)
+        out = checking and not flags & IN_BOUNDS
+        (x, y, w, h) = box
+        head = any(box)
+
+        # in _SUMMED order
+        values = (1, checking, out, not head, bool(flags & IN_VIOLATION and not last_flags & IN_VIOLATION),
+                  dt if checking else 0.0, dt if out else 0.0, score,
+                  x + w / 2 if head else 0.0, y + h / 2 if head else 0.0)
+
+        minute = self._minutes.add(seat, wall_time, values)
+        if minute is not None:
+            self._queue.put((self._minute_file, np.array([tuple(minute)], dtype=ROLLUP)))
+            hour = self._hours.add(seat, minute[0], minute[2:])
+            if hour is not None:
+                self._queue.put((self._hour_file, np.array([tuple(hour)], dtype=ROLLUP)))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if isinstance(item, tuple):
+                    item[0].append(item[1])
+                else:
+                    self._records.append(item)
+            except OSError as e:
+                print("[WARN] posture history could not be written: %s" % e)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """ Write out everything recorded so far and wait until it is on disk """
+
+        with self._lock:
+            self._flush_partial()
+        self._queue.join()
+
+    def rows_between(self, start=None, end=None, seat=None):
+        """ RECORD rows with start <= time < end (wall clock seconds), a copy
+            of just that range """
+
+        self.flush()
+        records = self._records.memmap()
+        times = records["time"]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = len(records) if end is None else int(np.searchsorted(times, end, side="left"))
+        rows = np.array(records[lo:hi])
+        return rows if seat is None else rows[rows["seat"] == seat]
+
+    def iter_rows(self, start=None, end=None, batch=65536):
+        """ rows_between in batches of at most batch rows """
+
+        self.flush()
+        records = self._records.memmap()
+        times = records["time"]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = len(records) if end is None else int(np.searchsorted(times, end, side="left"))
+        for i in range(lo, hi, batch):
+            yield np.array(records[i:min(i + batch, hi)])
+
+    def _rollups(self, column_file, rollup, start, end, seat):
+        self.flush()
+        with self._lock:
+            current = rollup.open_buckets()
+        rows = combine(np.concatenate([np.array(column_file.memmap()), current]))
+        keep = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            keep &= rows["start"] + rollup.period > start
+        if end is not None:
+            keep &= rows["start"] < end
+        if seat is not None:
+            keep &= rows["seat"] == seat
+        return rows[keep]
+
+    def minutes(self, start=None, end=None, seat=None):
+        """ Minute ROLLUPs overlapping [start, end), the current minute included """
+
+        return self._rollups(self._minute_file, self._minutes, start, end, seat)
+
+    def hours(self, start=None, end=None, seat=None):
+        """ Hour ROLLUPs overlapping [start, end). The current hour only
+            covers the minutes that are over """
+
+        return self._rollups(self._hour_file, self._hours, start, end, seat)
+
+    def close(self):
+        # the open buckets are final now, the current hour gets the current minute first
+        with self._lock:
+            self._flush_partial()
+            minutes = self._minutes.close_all()
+        if len(minutes):
+            self._queue.put((self._minute_file, minutes))
+            for minute in minutes:
+                # the minute may start a new hour, which closes the previous one
+                hour = self._hours.add(minute["seat"], minute["start"], [minute[name] for name in _SUMMED])
+                if hour is not None:
+                    self._queue.put((self._hour_file, np.array([tuple(hour)], dtype=ROLLUP)))
+        hours = self._hours.close_all()
+        if len(hours):
+            self._queue.put((self._hour_file, hours))
+        self._queue.put(None)
+        self._writer.join()
+        for column_file in (self._records, self._minute_file, self._hour_file):
+            column_file.close()
+
+
+def summarize(rollups):
+    """ Totals of ROLLUP rows as a JSON serializable dict """
+
+    frames = int(rollups["frames"].sum())
+    heads = frames - int(rollups["no_head"].sum())
+    checked = float(rollups["seconds_checked"].sum())
+    out = float(rollups["seconds_out"].sum())
+    return {
+        "frames": frames,
+        "violations": int(rollups["violations"].sum()),
+        "seconds_checked": round(checked, 1),
+        "seconds_out_of_bounds": round(out, 1),
+        "fraction_out_of_bounds": round(out / checked, 4) if checked else 0.0,
+        "mean_head_position": [round(float(rollups["cx_sum"].sum()) / heads, 1),
+                               round(float(rollups["cy_sum"].sum()) / heads, 1)] if heads else None,
+        "mean_pose_score": round(float(rollups["score_sum"].sum()) / frames, 3) if frames else None,
+    }
+
+
+def create_history_store():
+    """ HistoryStore for today in HISTORY_DIR, None when HISTORY_DIR is not set """
+
+    directory = PostureAidConfig.config("HISTORY_DIR")
+    if directory is None:
+        return None
+    path = os.path.join(os.path.expanduser(directory), time.strftime("%Y-%m-%d") + ".phist")
+    return HistoryStore(path)
@@ -0,0 +1,201 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+NUM_KEYPOINTS = 17
+
+
+class SharedArray:
+    def __init__(self, shape, dtype, name=None):
+        """ NumPy array backed by a multiprocessing.shared_memory block. Only the
+            (name, shape, dtype) triple crosses the process boundary """
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def spec(self):
+        return self._shm.name, self.shape, self.dtype.str
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _worker_main(model_id, output_stride, max_pose_detections, backend, restrict_outputs, compile_shape,
+                 estimator_kwargs, specs, task_queue, result_queue):
+    from estimator import PoseEstimator, load_model
+
+    inputs, shapes, pose_scores, keypoint_scores, keypoint_coords = [
+        SharedArray.attach(spec) for spec in specs]
+
+    required_parts = estimator_kwargs.get("required_parts") if restrict_outputs else None
+    estimator = PoseEstimator(
+        load_model(model_id, output_stride, required_parts, input_shape=compile_shape, backend=backend),
+        output_stride=output_stride,
+        max_pose_detections=max_pose_detections, **estimator_kwargs)
+    result_queue.put(-1)  # ready
+
+    while True:
+        slot = task_queue.get()
+        if slot is None:
+            break
+        height, width = shapes.array[slot]
+        input_image = inputs.array[slot, :3 * height * width].reshape(1, 3, height, width)
+
+        # coordinates stay in input space, the parent process applies the output scale
+        poses = estimator.estimate_input(input_image, 1.0)
+
+        pose_scores.array[slot] = poses.pose_scores
+        keypoint_scores.array[slot] = poses.keypoint_scores
+        keypoint_coords.array[slot] = poses.keypoint_coords
+        result_queue.put(slot)
+
+
+class InferenceWorker:
+    def __init__(self, model_id, output_stride, max_input_shape, slots=3,
+                 max_pose_detections=10, restart_delay=1.0, backend="torch", restrict_outputs=False,
+                 compile_model=False, **estimator_kwargs):
+        """ Runs a PoseEstimator (MobileNetV1 + pose decoding) in a separate
+            process. Frames and poses are exchanged through a ring of shared
+            memory slots, only slot indices travel over the queues. backend
+            names one of posenet.backends.BACKENDS. With
+            restrict_outputs the model only produces the keypoints needed for
+            required_parts. compile_model compiles and warms the model up for
+            max_input_shape. Extra keyword arguments go to the PoseEstimator """
+
+        self.output_stride = output_stride
+        self.max_input_shape = tuple(max_input_shape)
+        self.restarts = 0
+
+        self._model_id = model_id
+        self._max_pose_detections = max_pose_detections
+        self._backend = backend
+        self._restrict_outputs = restrict_outputs
+        self._compile_shape = self.max_input_shape if compile_model else None
+        self._estimator_kwargs = estimator_kwargs
+        self._restart_delay = restart_delay
+        self._ctx = mp.get_context("spawn")
+
+        height, width = self.max_input_shape
+        self._inputs = SharedArray((slots, 3 * height * width), np.float32)
+        self._shapes = SharedArray((slots, 2), np.int32)
+        self._pose_scores = SharedArray((slots, max_pose_detections), np.float64)
+        self._keypoint_scores = SharedArray(
+            (slots, max_pose_detections, NUM_KEYPOINTS), np.float64)
+        self._keypoint_coords = SharedArray(
+            (slots, max_pose_detections, NUM_KEYPOINTS, 2), np.float64)
+
+        self._slots = slots
+        self._free = list(range(slots))
+        self._pending = {}
+        self._process = None
+        self._ready = False
+        self._last_start = 0.0
+        self._start()
+
+    def _start(self):
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        specs = [a.spec() for a in (self._inputs, self._shapes, self._pose_scores,
+                                    self._keypoint_scores, self._keypoint_coords)]
+        self._process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._model_id, self.output_stride, self._max_pose_detections, self._backend,
+                  self._restrict_outputs, self._compile_shape, self._estimator_kwargs, specs, self._task_queue, self._result_queue),
+            name="PostureAidInference",
+            daemon=True)
+        self._process.start()
+        self._ready = False
+        self._last_start = time.monotonic()
+
+    def _ensure_alive(self):
+        if self._process.is_alive():
+            return True
+        if time.monotonic() - self._last_start < self._restart_delay:
+            return False
+        print("[WARN] inference worker exited with code %s, restarting" % self._process.exitcode)
+        # frames that were in flight are lost together with the old queues
+        self._free = list(range(self._slots))
+        self._pending = {}
+        self.restarts += 1
+        self._start()
+        return False
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @property
+    def busy(self):
+        return not self._free
+
+    def submit(self, input_image, tag=None):
+        """ Copy a preprocessed (1, 3, H, W) frame into a free slot. Returns False
+            when the worker is not running or every slot is still in flight """
+
+        if not self._ensure_alive() or not self._ready or not self._free:
+            return False
+
+        _, _, height, width = input_image.shape
+        if height > self.max_input_shape[0] or width > self.max_input_shape[1]:
+            raise ValueError("input of %dx%d exceeds the shared buffer of %dx%d" % (
+                height, width, self.max_input_shape[0], self.max_input_shape[1]))
+
+        slot = self._free.pop()
+        self._shapes.array[slot] = (height, width)
+        self._inputs.array[slot, :3 * height * width] = input_image.ravel()
+        self._pending[slot] = tag
+        self._task_queue.put(slot)
+        return True
+
+    def poll(self):
+        """ Return a list of (tag, pose_scores, keypoint_scores, keypoint_coords)
+            for every frame finished since the last call, oldest first """
+
+        results = []
+        self._ensure_alive()
+        while True:
+            try:
+                slot = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if slot == -1:
+                self._ready = True
+                continue
+            if slot not in self._pending:
+                continue
+            results.append((
+                self._pending.pop(slot),
+                self._pose_scores.array[slot].copy(),
+                self._keypoint_scores.array[slot].copy(),
+                self._keypoint_coords.array[slot].copy()))
+            self._free.append(slot)
+        return results
+
+    def close(self):
+        if self._process is not None and self._process.is_alive():
+            self._task_queue.put(None)
+            self._process.join(timeout=2.0)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._process = None
+        for shared in (self._inputs, self._shapes, self._pose_scores,
+                       self._keypoint_scores, self._keypoint_coords):
+            shared.close()
@@ -0,0 +1,225 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from config import PostureAidConfig
+
+# seconds, upper bounds of the exported Prometheus histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+STAGES = ("capture_age", "preprocess", "forward", "decode", "render", "alarm")
+COUNTERS = ("frames", "inferences", "dropped_frames")
+
+PERCENTILES = (50, 95, 99)
+
+
+class RollingHistogram:
+    def __init__(self, window=300, buckets=BUCKETS):
+        """ Percentiles over the last window observations, plus cumulative
+            bucket counts, sum and count since the start for exporting """
+
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self._recent.append(value)
+
+    def summary(self):
+        """ Milliseconds over the rolling window, None before the first value """
+
+        if not self._recent:
+            return None
+        recent = np.fromiter(self._recent, dtype=np.float64) * 1000.0
+        summary = {"p%d" % p: round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(recent, PERCENTILES))}
+        summary["mean"] = round(float(recent.mean()), 3)
+        summary["count"] = self.count
+        return summary
+
+
+class PipelineMetrics:
+    def __init__(self, window=300):
+        """ Rolling latency histograms for each of STAGES plus the COUNTERS.
+            Recording is a lock, a bisect and an append, cheap enough for
+            every frame. The frame rate is measured over the last window
+            frames """
+
+        self.window = window
+        self.started = time.monotonic()
+        self.histograms = {stage: RollingHistogram(window) for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._frame_times = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.histograms[stage].observe(seconds)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def set_count(self, counter, value):
+        with self._lock:
+            self.counters[counter] = value
+
+    def frame(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.counters["frames"] += 1
+            self._frame_times.append(now)
+
+    def _fps(self):
+        if len(self._frame_times) < 2:
+            return 0.0
+        elapsed = self._frame_times[-1] - self._frame_times[0]
+        return (len(self._frame_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def fps(self):
+        with self._lock:
+            return self._fps()
+
+    def snapshot(self):
+        """ JSON serializable state, latencies in milliseconds """
+
+        with self._lock:
+            return {
+                "uptime": round(time.monotonic() - self.started, 3),
+                "fps": round(self._fps(), 2),
+                "counters": dict(self.counters),
+                "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """ Prometheus text exposition format """
+
+        lines = []
+        with self._lock:
+            lines.append("# TYPE posture_aid_fps gauge")
+            lines.append("posture_aid_fps %.3f" % self._fps())
+            for counter, value in self.counters.items():
+                lines.append("# TYPE posture_aid_%s_total counter" % counter)
+                lines.append("posture_aid_%s_total %d" % (counter, value))
+            lines.append("# TYPE posture_aid_stage_seconds histogram")
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.bucket_counts):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else repr(bound)
+                    lines.append('posture_aid_stage_seconds_bucket{stage="%s",le="%s"} %d' % (stage, le, cumulative))
+                lines.append('posture_aid_stage_seconds_sum{stage="%s"} %.6f' % (stage, histogram.sum))
+                lines.append('posture_aid_stage_seconds_count{stage="%s"} %d' % (stage, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def overlay(self):
+        """ A few short lines of text for drawing on the frame """
+
+        snapshot = self.snapshot()
+        lines = ["%.1f fps, %d dropped" % (snapshot["fps"], snapshot["counters"]["dropped_frames"])]
+        for stage, summary in snapshot["stages"].items():
+            if summary is not None:
+                lines.append("%s %.1f / %.1f ms" % (stage, summary["p50"], summary["p95"]))
+        return lines
+
+    def dump_json(self, path):
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2))
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.prometheus())
+
+
+def _write_atomic(path, text):
+    # readers (e.g. the node exporter textfile collector) never see a partial file
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+
+class MetricsExporter:
+    def __init__(self, metrics, path=None, port=None, interval=5.0):
+        """ Publishes PipelineMetrics as a Prometheus text file rewritten every
+            interval seconds and / or over HTTP on localhost:port, /metrics in
+            Prometheus format and /metrics.json as JSON """
+
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        if self.path is not None:
+            self._thread = threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True)
+            self._thread.start()
+        if self.port is not None:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            print("[INFO] metrics on http://127.0.0.1:%d/metrics" % self._server.server_address[1])
+        return self
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write_prometheus(self.path)
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self.metrics.write_prometheus(self.path)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def create_metrics():
+    """ PipelineMetrics and a started MetricsExporter (None without an
+        output) as configured in PostureAidConfig, (None, None) when metrics
+        are off """
+
+    if not PostureAidConfig.config("METRICS"):
+        return None, None
+    metrics = PipelineMetrics()
+    path, port = PostureAidConfig.config("METRICS_FILE"), PostureAidConfig.config("METRICS_PORT")
+    if path is None and port is None:
+        return metrics, None
+    return metrics, MetricsExporter(metrics, path, port).start()
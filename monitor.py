@@ -0,0 +1,323 @@
+import time
+from collections import namedtuple
+
+import posenet
+
+from utils import boundary_margin, box_touches_window, check_head_within_boundary, roi_window
+
+PostureResult = namedtuple("PostureResult", [
+    "frame", "timestamp", "poses", "current_pos", "correct_pos", "in_bounds"])
+
+PostureEvent = namedtuple("PostureEvent", [
+    "kind", "timestamp", "seat", "current_pos", "correct_pos", "in_violation"])
+
+VIOLATION_START = "violation_start"
+VIOLATION_END = "violation_end"
+HEARTBEAT = "heartbeat"
+
+NO_HEAD = (0, 0, 0, 0)
+
+
+def _interval(rate):
+    rate = rate() if callable(rate) else rate
+    return 1.0 / rate if rate else 0.0
+
+
+class PostureMonitor:
+    def __init__(self, source, estimator, pad_x=30, pad_y=30, correct_pos=NO_HEAD,
+                 on_event=None, min_pose_score=0.15, min_part_score=0.1, seat=0,
+                 roi_padding=None, motion_gate=None, tracker=None, metrics=None, violation_filter=None,
+                 heartbeat_interval=None, history=None):
+        """ Headless posture checking loop. Pulls frames from a FrameSource, runs
+            them through a PoseEstimator and compares the head box against the
+            position locked when start() was called. With roi_padding set, a
+            running monitor only feeds a window around the last head box to
+            the model (see utils.roi_window). A motion.MotionGate skips the
+            model on frames that did not change and keeps the last head box.
+            A tracker.HeadTracker smooths the head box, extrapolates it on
+            frames without inference and decides when the model has to run.
+            metrics (metrics.PipelineMetrics) gets the capture age, alarm
+            decision time and frame count. on_event receives a PostureEvent
+            when a violation starts or ends and, while running, a heartbeat
+            every heartbeat_interval seconds. It is called from the frame
+            loop and should return right away, e.g. events.EventBus.publish.
+            An events.ViolationFilter debounces the violation state. Every
+            frame is recorded in history (history.HistoryStore) if given """
+
+        self.source = source
+        self.estimator = estimator
+        self.pad_x = pad_x
+        self.pad_y = pad_y
+        self.correct_pos = correct_pos
+        self.current_pos = NO_HEAD
+        self.running = False
+        self.in_violation = False
+        self.frames = 0
+        self.inferences = 0
+        self.seat = seat
+        self.roi_padding = roi_padding
+        self.roi_frames = 0
+        self.roi_fallbacks = 0
+        self.motion_gate = motion_gate
+        self.tracker = tracker
+        self.metrics = metrics
+        self.violation_filter = violation_filter
+        self.heartbeat_interval = heartbeat_interval
+        self.history = history
+        self.pose_score = 0.0
+
+        self._on_event = on_event
+        self._last_heartbeat = None
+        self._min_pose_score = min_pose_score
+        self._min_part_score = min_part_score
+
+    def start(self):
+        """ Lock the current head position as the correct one and start checking """
+        self.running = True
+        self._last_heartbeat = None
+
+    def stop(self):
+        self.running = False
+        if self.violation_filter is not None:
+            self.violation_filter.reset()
+        self._set_violation(False, time.monotonic())
+
+    def set_padding(self, pad_x, pad_y):
+        self.pad_x = pad_x
+        self.pad_y = pad_y
+
+    @property
+    def head_found(self):
+        return self.current_pos != NO_HEAD
+
+    def boundary_margin(self):
+        """ utils.boundary_margin of the current head box, None while not checking """
+
+        if not self.running or self.current_pos == NO_HEAD:
+            return None
+        return boundary_margin(self.correct_pos, self.current_pos, self.pad_x, self.pad_y)
+
+    def _emit(self, kind, timestamp):
+        if self._on_event is not None:
+            self._on_event(PostureEvent(
+                kind, timestamp, self.seat, self.current_pos, self.correct_pos, self.in_violation))
+
+    def _heartbeat(self, timestamp):
+        if self.heartbeat_interval is None:
+            return
+        if self._last_heartbeat is None or timestamp - self._last_heartbeat >= self.heartbeat_interval:
+            self._last_heartbeat = timestamp
+            self._emit(HEARTBEAT, timestamp)
+
+    def _set_violation(self, violation, timestamp):
+        if violation == self.in_violation:
+            return
+        self.in_violation = violation
+        self._emit(VIOLATION_START if violation else VIOLATION_END, timestamp)
+
+    def step(self, block=True):
+        """ Process one frame. Returns a PostureResult, or None when the source
+            has no new frame """
+
+        item = self.source.read(block=block)
+        if item is None:
+            return None
+        frame, timestamp = item
+        self.observe_capture(timestamp)
+        if not self.needs_inference(frame, timestamp):
+            return self.update(frame, timestamp, None)
+        window = self.roi_window(frame)
+        return self.update(frame, timestamp, self.estimator.estimate(frame, window), window)
+
+    def observe_capture(self, timestamp):
+        # frame timestamps come from time.monotonic() when the frame was read
+        if self.metrics is not None:
+            self.metrics.observe("capture_age", time.monotonic() - timestamp)
+
+    def needs_inference(self, frame, timestamp):
+        if self.tracker is not None:
+            box = self.tracker.predict(timestamp)
+            margin = None
+            if self.running and box is not None:
+                margin = boundary_margin(self.correct_pos, box, self.pad_x, self.pad_y)
+            if not self.tracker.should_infer(timestamp, margin):
+                return False
+        if self.motion_gate is None:
+            return True
+        box = None if self.current_pos == NO_HEAD else self.current_pos
+        return self.motion_gate.should_infer(frame, timestamp, box)
+
+    def roi_window(self, frame):
+        """ Crop window for the next estimate, None for a full frame pass """
+
+        if (self.roi_padding is None or not self.running or self.current_pos == NO_HEAD or
+                not self.estimator.supports_windows):
+            return None
+        return roi_window(frame.shape, self.current_pos, self.roi_padding,
+                          self.estimator.scale_factor, self.estimator.output_stride)
+
+    def _head_box(self, frame, poses):
+        return posenet.get_pos_from_img(
+            frame, poses.pose_scores, poses.keypoint_scores, poses.keypoint_coords,
+            min_pose_score=self._min_pose_score, min_part_score=self._min_part_score
+        )
+
+    def update(self, frame, timestamp, poses, window=None):
+        """ Advance the boundary and violation state with poses estimated elsewhere.
+            poses may be None when no fresh estimate exists for this frame,
+            window is the crop they were estimated on, if any """
+
+        if poses is not None:
+            self.inferences += 1
+            self.pose_score = float(poses.pose_scores.max()) if len(poses.pose_scores) else 0.0
+            current_pos = self._head_box(frame, poses)
+            if window is not None:
+                self.roi_frames += 1
+                # head lost or cut off by the crop, redo this frame in full
+                if current_pos == NO_HEAD or box_touches_window(current_pos, window, frame.shape):
+                    self.roi_fallbacks += 1
+                    full_poses = self.estimator.estimate(frame)
+                    # a remote estimator may not answer, the crop's box stands then
+                    if full_poses is not None:
+                        self.pose_score = float(full_poses.pose_scores.max()) if len(full_poses.pose_scores) else 0.0
+                        current_pos = self._head_box(frame, full_poses)
+            if self.tracker is not None:
+                current_pos = self.tracker.update(current_pos, timestamp) or NO_HEAD
+            self.current_pos = current_pos
+        elif self.tracker is not None and self.tracker.tracking:
+            self.current_pos = self.tracker.predict(timestamp)
+
+        start = time.perf_counter()
+        in_bounds = True
+        if self.running:
+            in_bounds = check_head_within_boundary(
+                self.correct_pos, self.current_pos, self.pad_x, self.pad_y)
+            violation = not in_bounds
+            if self.violation_filter is not None:
+                margin = boundary_margin(self.correct_pos, self.current_pos, self.pad_x, self.pad_y)
+                violation = self.violation_filter.update(in_bounds, margin, timestamp)
+            self._set_violation(violation, timestamp)
+            self._heartbeat(timestamp)
+        else:
+            self.correct_pos = self.current_pos
+
+        self.frames += 1
+        if self.history is not None:
+            self.history.append(timestamp, self.seat, self.current_pos, self.pose_score, self.running, in_bounds,
+                                self.in_violation)
+        if self.metrics is not None:
+            self.metrics.observe("alarm", time.perf_counter() - start)
+            self.metrics.frame()
+        return PostureResult(frame, timestamp, poses, self.current_pos, self.correct_pos, in_bounds)
+
+    def run(self, rate=None, max_frames=None, callback=None):
+        """ Process frames until the source is exhausted or max_frames is reached.
+            With rate set the loop is paced to that many frames per second,
+            otherwise it runs as fast as frames and inference allow. rate may
+            also be a function returning the rate for the next frame """
+
+        processed = 0
+        next_tick = time.monotonic()
+        while not self.source.exhausted and (max_frames is None or processed < max_frames):
+            result = self.step(block=True)
+            if result is None:
+                continue
+            processed += 1
+            if callback is not None:
+                callback(result)
+            interval = _interval(rate)
+            if interval:
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
+        return processed
+
+    def close(self):
+        self.stop()
+        self.estimator.close()
+        self.source.release()
+
+
+class MultiPostureMonitor:
+    def __init__(self, monitors, estimator):
+        """ Several seats, one camera each, sharing a single estimator. Frames of
+            all seats are estimated together so the model runs one batched
+            forward pass per round instead of one pass per seat """
+
+        self.monitors = monitors
+        self.estimator = estimator
+
+    def start(self):
+        for monitor in self.monitors:
+            monitor.start()
+
+    def stop(self):
+        for monitor in self.monitors:
+            monitor.stop()
+
+    def set_padding(self, pad_x, pad_y):
+        for monitor in self.monitors:
+            monitor.set_padding(pad_x, pad_y)
+
+    @property
+    def exhausted(self):
+        return all(monitor.source.exhausted for monitor in self.monitors)
+
+    def step(self, block=True):
+        """ Process the newest frame of every seat. Returns one PostureResult
+            (or None when that seat had no new frame) per monitor """
+
+        items = [monitor.source.read(block=block) for monitor in self.monitors]
+        results = [None] * len(self.monitors)
+        ready = []
+        for i, item in enumerate(items):
+            if item is None:
+                continue
+            self.monitors[i].observe_capture(item[1])
+            if self.monitors[i].needs_inference(*item):
+                ready.append(i)
+            else:
+                results[i] = self.monitors[i].update(item[0], item[1], None)
+        if not ready:
+            return results
+
+        frames = [items[i][0] for i in ready]
+        windows = [self.monitors[i].roi_window(frame) for i, frame in zip(ready, frames)]
+        poses = self.estimator.estimate_batch(frames, windows)
+        for i, seat_poses, window in zip(ready, poses, windows):
+            frame, timestamp = items[i]
+            results[i] = self.monitors[i].update(frame, timestamp, seat_poses, window)
+        return results
+
+    def run(self, rate=None, max_frames=None, callback=None):
+        """ Same as PostureMonitor.run, max_frames counts rounds over all seats """
+
+        rounds = 0
+        next_tick = time.monotonic()
+        while not self.exhausted and (max_frames is None or rounds < max_frames):
+            results = self.step(block=True)
+            if not any(results):
+                continue
+            rounds += 1
+            if callback is not None:
+                for result in results:
+                    if result is not None:
+                        callback(result)
+            interval = _interval(rate)
+            if interval:
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
+        return rounds
+
+    def close(self):
+        for monitor in self.monitors:
+            monitor.stop()
+            monitor.source.release()
+        self.estimator.close()
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+
+from config import PostureAidConfig
+
+
+class MotionGate:
+    def __init__(self, threshold=3.0, size=64, region_padding=1.0, refresh_interval=2.0):
+        """ Cheap change detector deciding whether a frame is worth a model pass.
+            Frames are shrunk to size pixels wide and turned to grayscale, then
+            compared with the frame of the last inference, limited to a padded
+            head region when one is known. A pass is forced at least every
+            refresh_interval seconds """
+
+        self.threshold = threshold
+        self.size = size
+        self.region_padding = region_padding
+        self.refresh_interval = refresh_interval
+
+        self.frames = 0
+        self.skipped = 0
+
+        self._reference = None
+        self._last_inference = None
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def _downsample(self, frame):
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (self.size, max(1, self.size * height // width)),
+                           interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _region(self, frame_shape, small_shape, box):
+        if box is None or not any(box):
+            return slice(None), slice(None)
+        scale = small_shape[1] / frame_shape[1]
+        (x, y, w, h) = box
+        margin = self.region_padding * max(w, h)
+        x0 = max(0, int((x - margin) * scale))
+        y0 = max(0, int((y - margin) * scale))
+        x1 = min(small_shape[1], int(np.ceil((x + w + margin) * scale)) + 1)
+        y1 = min(small_shape[0], int(np.ceil((y + h + margin) * scale)) + 1)
+        return slice(y0, y1), slice(x0, x1)
+
+    def change(self, frame, box=None):
+        """ Mean absolute gray level difference against the reference frame """
+
+        small = self._downsample(frame)
+        if self._reference is None or self._reference.shape != small.shape:
+            return small, float("inf")
+        rows, cols = self._region(frame.shape, small.shape, box)
+        diff = cv2.absdiff(small[rows, cols], self._reference[rows, cols])
+        return small, float(diff.mean()) if diff.size else float("inf")
+
+    def should_infer(self, frame, timestamp, box=None):
+        self.frames += 1
+        small, change = self.change(frame, box)
+        due = self._last_inference is None or timestamp - self._last_inference >= self.refresh_interval
+        if change > self.threshold or due:
+            self._reference = small
+            self._last_inference = timestamp
+            return True
+        self.skipped += 1
+        return False
+
+    def reset(self):
+        self._reference = None
+        self._last_inference = None
+
+
+def create_motion_gate():
+    """ MotionGate as configured in PostureAidConfig, None when gating is off """
+
+    if not PostureAidConfig.config("MOTION_GATING"):
+        return None
+    return MotionGate(
+        threshold=PostureAidConfig.config("MOTION_THRESHOLD"),
+        refresh_interval=PostureAidConfig.config("MOTION_REFRESH_INTERVAL"))
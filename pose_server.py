@@ -0,0 +1,321 @@
+""" Pose estimation server for thin clients.
+
+    python -m pose_server --port 8765
+    python -m pose_server --host 0.0.0.0 --port 8765 --model 101 --max-batch 8 --max-wait 0.01
+
+    Clients send (usually downscaled) frames over TCP and get poses and the
+    head box back, see RemotePoseEstimator in estimator.py. Requests of all
+    clients are coalesced into batched forward passes of up to --max-batch
+    frames, waiting at most --max-wait seconds for a batch to fill.
+
+    Every message is a struct ">II" (header length, payload length) prefix,
+    a JSON header and a binary payload. The server greets a new connection
+    with {"model", "output_stride", "max_batch", "client_limit"}. A request
+    header holds an "id", the frame "shape" and its "encoding", "raw" (BGR
+    bytes) or "jpeg".
+    The response echoes the id and has "poses" (count), "head_box" in frame
+    coordinates and a float32 payload of pose scores, keypoint scores and
+    keypoint coordinates, or an "error" and no payload. A client with
+    --client-limit requests in flight gets "busy" back for the next one,
+    once --max-pending requests are queued in total the server stops reading
+    from the sockets until the batches catch up.
+"""
+import argparse
+import asyncio
+import json
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import PostureAidConfig
+
+PREFIX = struct.Struct(">II")
+
+# a 1080p raw frame and then some
+MAX_MESSAGE = 8 * 1024 * 1024
+
+BUSY = "busy"
+
+
+def encode_message(header, payload=b""):
+    header = json.dumps(header).encode("utf-8")
+    return PREFIX.pack(len(header), len(payload)) + header + payload
+
+
+def _decode_prefix(prefix):
+    header_length, payload_length = PREFIX.unpack(prefix)
+    if header_length + payload_length > MAX_MESSAGE:
+        raise ValueError("message of %d bytes is too large" % (header_length + payload_length))
+    return header_length, payload_length
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by the server")
+        data += chunk
+    return bytes(data)
+
+
+def read_message(sock):
+    """ Blocking read of one (header, payload) message from a socket """
+
+    header_length, payload_length = _decode_prefix(_recv_exactly(sock, PREFIX.size))
+    data = _recv_exactly(sock, header_length + payload_length)
+    return json.loads(data[:header_length].decode("utf-8")), data[header_length:]
+
+
+async def read_message_async(reader):
+    header_length, payload_length = _decode_prefix(await reader.readexactly(PREFIX.size))
+    data = await reader.readexactly(header_length + payload_length)
+    return json.loads(data[:header_length].decode("utf-8")), data[header_length:]
+
+
+def encode_frame(frame, jpeg_quality=None):
+    """ Request payload and header fields for a BGR frame, JPEG compressed
+        when jpeg_quality is given """
+
+    if jpeg_quality is None:
+        return {"shape": list(frame.shape), "encoding": "raw"}, np.ascontiguousarray(frame).tobytes()
+    ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])
+    if not ok:
+        raise ValueError("frame could not be JPEG encoded")
+    return {"shape": list(frame.shape), "encoding": "jpeg"}, data.tobytes()
+
+
+def decode_frame(header, payload):
+    if header.get("encoding") == "jpeg":
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("invalid JPEG")
+        return frame
+    height, width, channels = header["shape"]
+    if channels != 3 or len(payload) != height * width * channels:
+        raise ValueError("payload does not match the frame shape")
+    return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, channels)
+
+
+def encode_poses(poses):
+    """ float32 payload of the poses that were found, with their count """
+
+    count = int(np.count_nonzero(poses.pose_scores))
+    arrays = (poses.pose_scores[:count], poses.keypoint_scores[:count], poses.keypoint_coords[:count])
+    return count, b"".join(np.ascontiguousarray(a, dtype=np.float32).tobytes() for a in arrays)
+
+
+def decode_poses(count, payload, max_pose_detections=10, num_keypoints=17):
+    """ (pose_scores, keypoint_scores, keypoint_coords) padded with zeros to
+        max_pose_detections like the decoders return them """
+
+    values = np.frombuffer(payload, dtype=np.float32)
+    pose_scores = np.zeros(max_pose_detections)
+    keypoint_scores = np.zeros((max_pose_detections, num_keypoints))
+    keypoint_coords = np.zeros((max_pose_detections, num_keypoints, 2))
+    scores, part_scores, coords = np.split(values, [count, count + count * num_keypoints])
+    count = min(count, max_pose_detections)
+    pose_scores[:count] = scores[:count]
+    keypoint_scores[:count] = part_scores.reshape(-1, num_keypoints)[:count]
+    keypoint_coords[:count] = coords.reshape(-1, num_keypoints, 2)[:count]
+    return pose_scores, keypoint_scores, keypoint_coords
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = 0
+        self.requests = 0
+        self.rejected = 0
+        self.closed = False
+
+    def send(self, header, payload=b""):
+        if not self.closed:
+            self.writer.write(encode_message(header, payload))
+
+
+class _Request:
+    __slots__ = ("client", "id", "frame")
+
+    def __init__(self, client, request_id, frame):
+        self.client = client
+        self.id = request_id
+        self.frame = frame
+
+
+class PoseServer:
+    def __init__(self, estimator, max_batch=8, max_wait=0.01, max_pending=64, client_limit=None,
+                 min_pose_score=0.15, min_part_score=0.1, model=None):
+        """ asyncio TCP server around a PoseEstimator. A single batching task
+            takes requests off one bounded queue, up to max_batch of them or
+            whatever arrived within max_wait seconds of the first, and runs
+            them through estimator.estimate_batch on an inference thread, so
+            the event loop keeps reading and answering while the model runs.
+            client_limit defaults to max_batch, so one client can fill a batch """
+
+        self.estimator = estimator
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.client_limit = max_batch if client_limit is None else client_limit
+        self.min_pose_score = min_pose_score
+        self.min_part_score = min_part_score
+        self.model = model
+
+        self.batches = 0
+        self.frames = 0
+
+        self._max_pending = max_pending
+        self._queue = None
+        self._server = None
+        self._batcher = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="pose-server")
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self._queue = asyncio.Queue(self._max_pending)
+        self._server = await asyncio.start_server(self._serve_client, host, port)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        return self
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        self._executor.shutdown(wait=True)
+
+    async def _serve_client(self, reader, writer):
+        client = _Client(writer)
+        client.send({"model": self.model, "output_stride": self.estimator.output_stride,
+                     "max_batch": self.max_batch, "client_limit": self.client_limit})
+        try:
+            while True:
+                header, payload = await read_message_async(reader)
+                client.requests += 1
+                request_id = header.get("id")
+                if client.pending >= self.client_limit:
+                    client.rejected += 1
+                    client.send({"id": request_id, "error": BUSY})
+                    continue
+                try:
+                    frame = decode_frame(header, payload)
+                except (KeyError, ValueError) as e:
+                    client.send({"id": request_id, "error": str(e)})
+                    continue
+                client.pending += 1
+                # waits while the queue is full, which stops reading from this socket
+                await self._queue.put(_Request(client, request_id, frame))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            client.closed = True
+            writer.close()
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # frames of clients that went away are not worth a forward pass
+        return [request for request in batch if not request.client.closed]
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self._estimate, batch)
+            except Exception as e:
+                print("[WARN] batch of %d frames failed: %s" % (len(batch), e))
+                results = [({"error": str(e)}, b"")] * len(batch)
+            self.batches += 1
+            self.frames += len(batch)
+            for request, (header, payload) in zip(batch, results):
+                request.client.pending -= 1
+                header["id"] = request.id
+                request.client.send(header, payload)
+
+    def _estimate(self, batch):
+        import posenet
+
+        frames = [request.frame for request in batch]
+        results = []
+        for frame, poses in zip(frames, self.estimator.estimate_batch(frames)):
+            head_box = posenet.get_pos_from_img(
+                frame, poses.pose_scores, poses.keypoint_scores, poses.keypoint_coords,
+                min_pose_score=self.min_pose_score, min_part_score=self.min_part_score)
+            count, payload = encode_poses(poses)
+            results.append(({"poses": count, "head_box": [int(v) for v in head_box]}, payload))
+        return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pose_server", description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model", default=PostureAidConfig.config("MODEL"))
+    parser.add_argument("--backend", choices=["torch", "onnxruntime", "opencv"],
+                        default=PostureAidConfig.config("BACKEND"))
+    parser.add_argument("--output-stride", type=int, default=PostureAidConfig.config("OUTPUT_STRIDE"))
+    parser.add_argument("--decoder", choices=["multi", "vectorized", "single"], default=PostureAidConfig.config("DECODER"))
+    parser.add_argument("--max-batch", type=int, default=8, help="frames per forward pass")
+    parser.add_argument("--max-wait", type=float, default=0.01,
+                        help="seconds to wait for a batch to fill after its first frame")
+    parser.add_argument("--max-pending", type=int, default=64, help="queued frames before reading pauses")
+    parser.add_argument("--client-limit", type=int, help="frames in flight per client, --max-batch by default")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from estimator import PoseEstimator, load_model
+
+    required_parts = PostureAidConfig.config("REQUIRED_PARTS")
+    restrict = required_parts if PostureAidConfig.config("RESTRICT_MODEL_OUTPUTS") else None
+    # clients send frames already scaled to the model input size
+    estimator = PoseEstimator(load_model(args.model, args.output_stride, restrict, backend=args.backend),
+                              output_stride=args.output_stride, scale_factor=1.0, decoder=args.decoder,
+                              required_parts=required_parts)
+    server = PoseServer(estimator, args.max_batch, args.max_wait, args.max_pending, args.client_limit,
+                        model=args.model)
+
+    async def serve():
+        await server.start(args.host, args.port)
+        print("[INFO] serving poses on %s:%d" % (args.host, server.port), file=sys.stderr)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        estimator.close()
+        print("[INFO] %d frames in %d batches" % (server.frames, server.batches), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,28 @@
+import importlib
+
 from posenet.constants import *
+from posenet.decode import get_connecting_keypoints, get_decode_edge_mask
 from posenet.decode_multi import decode_multiple_poses
-from posenet.models.model_factory import load_model
-from posenet.models import MobileNetV1, MOBILENET_V1_CHECKPOINTS
+from posenet.decode_vectorized import decode_multiple_poses_vectorized
+from posenet.decode_single import decode_single_pose, decode_single_pose_with_fallback
+from posenet.backends import load_backend
 from posenet.utils import *
+
+DECODERS = {
+    'multi': decode_multiple_poses,
+    'vectorized': decode_multiple_poses_vectorized,
+    'single': decode_single_pose_with_fallback,
+}
+
+# these need torch, which is only imported once one of them is used
+_TORCH_ATTRIBUTES = {
+    'load_model': 'posenet.models.model_factory',
+    'load_compiled_model': 'posenet.models.model_factory',
+    'MobileNetV1': 'posenet.models.mobilenet_v1',
+}
+
+
+def __getattr__(name):
+    if name in _TORCH_ATTRIBUTES:
+        return getattr(importlib.import_module(_TORCH_ATTRIBUTES[name]), name)
+    raise AttributeError("module 'posenet' has no attribute %r" % name)
@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+
+from posenet.constants import HEADS, MODEL_DIR, MOBILENET_V1_CHECKPOINTS
+from posenet.utils import parse_model_id
+
+
+def onnx_path(model_id, output_stride=16, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, '%s_s%d.onnx' % (MOBILENET_V1_CHECKPOINTS[model_id], output_stride))
+
+
+class Backend:
+    """ Runs MobileNetV1 on a (N, 3, H, W) float32 NumPy batch and returns the
+        requested output heads as NumPy arrays. keypoints is set when the
+        heatmap and offset heads only hold those keypoint ids. input_padding
+        is set when the model has its input normalization folded in and takes
+        raw BGR pixels padded by that many pixels instead """
+
+    name = None
+    keypoints = None
+    input_padding = None
+
+    def __init__(self, output_stride=16):
+        self.output_stride = output_stride
+
+    def allocate_input(self, shape):
+        """ float32 array of shape that run() reads without copying it """
+
+        return np.empty(shape, dtype=np.float32)
+
+    def run(self, input_batch, heads=HEADS):
+        raise NotImplementedError
+
+    def run_split(self, input_batch, heads, later_heads):
+        """ Returns the outputs for heads and a callable producing later_heads.
+            Backends that can share work between the two override this """
+
+        outputs = self.run(input_batch, tuple(heads) + tuple(later_heads))
+        return outputs[:len(heads)], lambda: outputs[len(heads):]
+
+    def close(self):
+        pass
+
+
+class TorchBackend(Backend):
+    name = 'torch'
+
+    def __init__(self, model):
+        """ Wraps a MobileNetV1 module. The displacement heads of run_split
+            are only computed if asked for """
+
+        import torch
+
+        super(TorchBackend, self).__init__(model.output_stride)
+        self.model = model
+        self.keypoints = model.keypoints
+        self.input_padding = model.input_padding
+        self._torch = torch
+        self._use_cuda = any(p.is_cuda for p in model.parameters())
+        # allocate_input shape -> CUDA copy of it
+        self._device_inputs = {}
+
+    def allocate_input(self, shape):
+        if not self._use_cuda:
+            return super(TorchBackend, self).allocate_input(shape)
+        # page locked, so the copy to the GPU is a plain DMA transfer
+        self._device_inputs[tuple(shape)] = self._torch.empty(shape, device='cuda')
+        return self._torch.empty(shape, pin_memory=True).numpy()
+
+    def _input(self, input_batch):
+        input_batch = self._torch.from_numpy(np.ascontiguousarray(input_batch))
+        if not self._use_cuda:
+            return input_batch
+        device_input = self._device_inputs.get(tuple(input_batch.shape))
+        if device_input is None:
+            return input_batch.cuda()
+        return device_input.copy_(input_batch, non_blocking=True)
+
+    @staticmethod
+    def _outputs(outputs):
+        return tuple(output.cpu().numpy() for output in outputs)
+
+    def run(self, input_batch, heads=HEADS):
+        with self._torch.no_grad():
+            return self._outputs(self.model(self._input(input_batch), heads=tuple(heads)))
+
+    def run_split(self, input_batch, heads, later_heads):
+        with self._torch.no_grad():
+            features = self.model.features(self._input(input_batch))
+            outputs = self._outputs(self.model.forward_heads(features, tuple(heads)))
+
+        def later():
+            with self._torch.no_grad():
+                return self._outputs(self.model.forward_heads(features, tuple(later_heads)))
+        return outputs, later
+
+
+class OnnxRuntimeBackend(Backend):
+    name = 'onnxruntime'
+
+    def __init__(self, path, output_stride=16, providers=None):
+        """ ONNX model exported by posenet.converter.onnx_export. providers
+            defaults to every execution provider onnxruntime offers """
+
+        import onnxruntime
+
+        super(OnnxRuntimeBackend, self).__init__(output_stride)
+        self._session = onnxruntime.InferenceSession(
+            path, providers=providers or onnxruntime.get_available_providers())
+        self._input_name = self._session.get_inputs()[0].name
+
+    def run(self, input_batch, heads=HEADS):
+        # onnxruntime only evaluates the nodes the requested outputs depend on
+        return tuple(self._session.run(list(heads), {self._input_name: input_batch.astype(np.float32)}))
+
+
+class OpenCVBackend(Backend):
+    name = 'opencv'
+
+    def __init__(self, path, output_stride=16):
+        """ ONNX model exported by posenet.converter.onnx_export, run with cv2.dnn """
+
+        import cv2
+
+        super(OpenCVBackend, self).__init__(output_stride)
+        self._net = cv2.dnn.readNetFromONNX(path)
+
+    def run(self, input_batch, heads=HEADS):
+        self._net.setInput(input_batch.astype(np.float32))
+        return tuple(self._net.forward(list(heads)))
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnxruntime': OnnxRuntimeBackend,
+    'opencv': OpenCVBackend,
+}
+
+
+def load_backend(name, model_id, output_stride=16, model_dir=MODEL_DIR, keypoints=None, input_shape=None,
+                 device=None, fold_input=False):
+    """ Load model_id for one of BACKENDS. keypoints, input_shape (compile and
+        warm up for that size), device (CUDA when available by default) and
+        fold_input (see MobileNetV1.fold_input_normalization, ignored for
+        quantized models) only apply to the torch backend, which is the only
+        one that imports torch """
+
+    if name == 'torch':
+        import torch
+        from posenet.models.model_factory import load_compiled_model, load_model
+
+        # quantized models only run on the CPU
+        quantized = parse_model_id(model_id)[1] is not None
+        device = 'cpu' if quantized else device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        fold_input = fold_input and not quantized
+        if input_shape is not None and not quantized:
+            model = load_compiled_model(model_id, input_shape, output_stride, model_dir, keypoints=keypoints,
+                                        device=device, fold_input=fold_input)
+        else:
+            model = load_model(model_id, output_stride, model_dir, fold_input, keypoints=keypoints).to(device)
+        return TorchBackend(model)
+
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend %s, expected one of %s' % (name, ', '.join(BACKENDS)))
+    model_id, variant = parse_model_id(model_id)
+    if variant is not None:
+        raise ValueError('The %s backend has no %s models' % (name, variant))
+    path = onnx_path(model_id, output_stride, model_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            'Cannot find ONNX models file %s, create it with '
+            'python -m posenet.converter.onnx_export --model %d --output-stride %d' % (path, model_id, output_stride))
+    return BACKENDS[name](path, output_stride)
@@ -1,4 +1,6 @@
 
+import os as _os
+
 PART_NAMES = [
     "nose", "leftEye", "rightEye", "leftEar", "rightEar", "leftShoulder",
     "rightShoulder", "leftElbow", "rightElbow", "leftWrist", "rightWrist",
@@ -22,6 +24,10 @@ CONNECTED_PART_INDICES = [(PART_IDS[a], PART_IDS[b]) for a, b in CONNECTED_PART_
 
 LOCAL_MAXIMUM_RADIUS = 1
 
+# raw pixel value that normalizes to 0, the border of inputs to models with
+# a folded input normalization
+INPUT_PAD_VALUE = 127.5
+
 POSE_CHAIN = [
     ("nose", "leftEye"), ("leftEye", "leftEar"), ("nose", "rightEye"),
     ("rightEye", "rightEar"), ("nose", "leftShoulder"),
@@ -60,4 +66,21 @@ PART_CHANNELS = [
   'right_hand',
   'right_lower_arm_front',
   'left_hand'
-]
\ No newline at end of file
+]
+
+MOBILENET_V1_CHECKPOINTS = {
+    50: 'mobilenet_v1_050',
+    75: 'mobilenet_v1_075',
+    100: 'mobilenet_v1_100',
+    101: 'mobilenet_v1_101'
+}
+
+# output heads of MobileNetV1, in the order the model returns them
+HEADS = ('heatmap', 'offset', 'displacement_fwd', 'displacement_bwd')
+
+# converted weights live in a per user cache, POSENET_MODEL_DIR overrides it
+MODEL_DIR = _os.environ.get('POSENET_MODEL_DIR') or _os.path.join(
+    _os.environ.get('XDG_CACHE_HOME') or _os.path.join(_os.path.expanduser('~'), '.cache'), 'posture-aid', 'models')
+
+# where earlier versions kept converted .pth files, relative to the working directory
+LEGACY_MODEL_DIR = './_models'
@@ -0,0 +1,44 @@
+""" Export MobileNetV1 checkpoints to ONNX for the onnxruntime and opencv backends.
+
+    python -m posenet.converter.onnx_export
+    python -m posenet.converter.onnx_export --model 101 --output-stride 16
+
+    Batch size and input resolution stay dynamic, the output stride is fixed
+    per file.
+"""
+import argparse
+
+import torch
+
+from posenet.backends import onnx_path
+from posenet.constants import HEADS, MODEL_DIR, MOBILENET_V1_CHECKPOINTS
+from posenet.models.model_factory import load_model
+
+
+def export(model_id, output_stride=16, model_dir=MODEL_DIR, opset_version=11):
+    model = load_model(model_id, output_stride, model_dir).eval()
+    example = torch.zeros((1, 3, 257, 257))
+    path = onnx_path(model_id, output_stride, model_dir)
+    dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in ('input',) + HEADS}
+    torch.onnx.export(
+        model, (example,), path, input_names=['input'], output_names=list(HEADS),
+        dynamic_axes=dynamic_axes, opset_version=opset_version, dynamo=False)
+    print('Exported %s' % path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', type=int, action='append', choices=sorted(MOBILENET_V1_CHECKPOINTS),
+                        help='default is every checkpoint')
+    parser.add_argument('--output-stride', type=int, action='append', choices=[8, 16, 32],
+                        help='default is 16')
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    args = parser.parse_args(argv)
+    for model_id in args.model or sorted(MOBILENET_V1_CHECKPOINTS):
+        for output_stride in args.output_stride or [16]:
+            export(model_id, output_stride, args.model_dir)
+
+
+if __name__ == '__main__':
+    main()
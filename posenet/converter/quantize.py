@@ -0,0 +1,109 @@
+""" Post-training static int8 quantization of MobileNetV1.
+
+    python -m posenet.converter.quantize --model 101 --images ./calibration
+
+    Calibrates on a folder of images read with posenet.read_imgfile, saves the
+    quantized checkpoint next to the fp32 one (selected with MODEL "101-int8")
+    and reports speed and keypoint drift against fp32.
+"""
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+
+from posenet.constants import MODEL_DIR
+from posenet.models.model_factory import load_model
+from posenet.models.quantized import convert_quantized, prepare_quantized, quantized_checkpoint_name
+from posenet.utils import read_imgfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def _calibration_inputs(image_dir, scale_factor, output_stride, max_images):
+    paths = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise FileNotFoundError('No images found in %s' % image_dir)
+    return [torch.from_numpy(read_imgfile(path, scale_factor, output_stride)[0]) for path in paths[:max_images]]
+
+
+def _keypoints(heatmap, offset, output_stride):
+    # argmax keypoints of a single (17, H, W) heatmap, in input pixels
+    num_parts, height, width = heatmap.shape
+    y, x = np.divmod(heatmap.reshape(num_parts, -1).argmax(axis=1), width)
+    offset = offset.reshape(2, num_parts, height, width)
+    parts = np.arange(num_parts)
+    coords = np.stack([y, x], axis=1) * output_stride
+    return coords + np.stack([offset[0, parts, y, x], offset[1, parts, y, x]], axis=1), np.stack([y, x], axis=1)
+
+
+def _time(model, inputs, repeats):
+    model(inputs[0])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for input_image in inputs:
+            model(input_image)
+    return (time.perf_counter() - start) / (repeats * len(inputs))
+
+
+def compare(model, quantized, inputs, output_stride, repeats=3):
+    """ Mean seconds per frame of both models, the distance in input pixels
+        between their argmax keypoints and the heatmap error """
+
+    drift = []
+    moved = []
+    heatmap_error = []
+    with torch.no_grad():
+        for input_image in inputs:
+            (heatmap, offset), (q_heatmap, q_offset) = [
+                [t[0].numpy() for t in m(input_image, heads=('heatmap', 'offset'))] for m in (model, quantized)]
+            coords, cells = _keypoints(heatmap, offset, output_stride)
+            q_coords, q_cells = _keypoints(q_heatmap, q_offset, output_stride)
+            drift.append(np.linalg.norm(coords - q_coords, axis=1))
+            moved.append(np.any(cells != q_cells, axis=1))
+            heatmap_error.append(np.abs(heatmap - q_heatmap).mean())
+        fp32_time = _time(model, inputs, repeats)
+        int8_time = _time(quantized, inputs, repeats)
+    return fp32_time, int8_time, np.concatenate(drift), np.concatenate(moved), np.mean(heatmap_error)
+
+
+def quantize(model_id, image_dir, model_dir=MODEL_DIR, output_stride=16, scale_factor=0.7125, max_images=100):
+    model = load_model(model_id, output_stride, model_dir).eval()
+    inputs = _calibration_inputs(image_dir, scale_factor, output_stride, max_images)
+
+    quantized = prepare_quantized(copy.deepcopy(model), inputs[0].shape)
+    with torch.no_grad():
+        for input_image in inputs:
+            quantized(input_image)
+    convert_quantized(quantized)
+
+    checkpoint_path = os.path.join(model_dir, quantized_checkpoint_name(model_id)) + '.pth'
+    torch.save(quantized.state_dict(), checkpoint_path)
+    print('Saved %s, calibrated on %d images' % (checkpoint_path, len(inputs)))
+
+    fp32_time, int8_time, drift, moved, heatmap_error = compare(model, quantized, inputs, output_stride)
+    print('fp32 %.1f ms, int8 %.1f ms per frame (%.2fx)' % (
+        1000 * fp32_time, 1000 * int8_time, fp32_time / int8_time))
+    print('keypoint drift: median %.2f px, p95 %.2f px, max %.2f px, %.1f%% moved to another cell' % (
+        np.median(drift), np.percentile(drift, 95), np.max(drift), 100 * np.mean(moved)))
+    print('heatmap mean absolute error %.4f' % heatmap_error)
+    return quantized
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', type=int, default=101)
+    parser.add_argument('--images', required=True, help='folder of calibration images')
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--output-stride', type=int, default=16)
+    parser.add_argument('--scale-factor', type=float, default=0.7125)
+    parser.add_argument('--max-images', type=int, default=100)
+    args = parser.parse_args(argv)
+    quantize(args.model, args.images, args.model_dir, args.output_stride, args.scale_factor, args.max_images)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 import json
-import struct
+import mmap
 import cv2
 import numpy as np
 import os
+import sys
 import tempfile
+import time
 import torch
 
+from concurrent.futures import ThreadPoolExecutor
+
 from posenet import MobileNetV1, MOBILENET_V1_CHECKPOINTS
 
 
@@ -41,7 +45,19 @@ def to_torch_name(tf_name):
     return torch_name
 
 
-def load_variables(chkpoint, base_dir=BASE_DIR):
+def _read_variable(path, shape, depthwise):
+    # the shard is mapped, not read, and copied exactly once into the tensor
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        d = np.frombuffer(buf, dtype='<f4').reshape(shape)
+        if len(shape) == 4:
+            tpt = (2, 3, 0, 1) if depthwise else (3, 2, 0, 1)
+            d = d.transpose(tpt)
+        tensor = torch.from_numpy(np.array(d, dtype=np.float32, order='C'))
+        del d
+    return tensor
+
+
+def load_variables(chkpoint, base_dir=BASE_DIR, max_workers=None):
     manifest_path = os.path.join(base_dir, chkpoint, "manifest.json")
     if not os.path.exists(manifest_path):
         print('Weights for checkpoint %s are not downloaded. Downloading to %s ...' % (chkpoint, base_dir))
@@ -49,29 +65,36 @@ def load_variables(chkpoint, base_dir=BASE_DIR):
         download(chkpoint, base_dir)
         assert os.path.exists(manifest_path)
 
-    manifest = open(manifest_path)
-    variables = json.load(manifest)
-    manifest.close()
+    with open(manifest_path) as manifest:
+        variables = json.load(manifest)
 
-    state_dict = {}
+    entries = []
     for x in variables:
         torch_name = to_torch_name(x)
         if not torch_name:
             continue
         filename = variables[x]["filename"]
-        byte = open(os.path.join(base_dir, chkpoint, filename), 'rb').read()
-        fmt = str(int(len(byte) / struct.calcsize('f'))) + 'f'
-        d = struct.unpack(fmt, byte)
-        d = np.array(d, dtype=np.float32)
-        shape = variables[x]["shape"]
-        if len(shape) == 4:
-            tpt = (2, 3, 0, 1) if 'depthwise' in filename else (3, 2, 0, 1)
-            d = np.reshape(d, shape).transpose(tpt)
-        state_dict[torch_name] = torch.Tensor(d)
+        entries.append((torch_name, os.path.join(base_dir, chkpoint, filename),
+                        variables[x]["shape"], 'depthwise' in filename))
+
+    # numpy releases the GIL while copying, so shards convert in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tensors = executor.map(lambda entry: _read_variable(*entry[1:]), entries)
+        state_dict = {entry[0]: tensor for entry, tensor in zip(entries, tensors)}
 
     return state_dict
 
 
+def _peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
 def _read_imgfile(path, width, height):
     img = cv2.imread(path)
     img = cv2.resize(img, (width, height))
@@ -90,12 +113,18 @@ def convert(model_id, model_dir, output_stride=16, image_size=513, check=True):
     if not os.path.exists(model_dir):
         os.makedirs(model_dir)
 
+    start = time.perf_counter()
     state_dict = load_variables(checkpoint_name)
     m = MobileNetV1(model_id, output_stride=output_stride)
-    m.load_state_dict(state_dict)
+    # the converted tensors become the parameters as they are, no second copy
+    m.load_state_dict(state_dict, assign=True)
     checkpoint_path = os.path.join(model_dir, checkpoint_name) + '.pth'
     torch.save(m.state_dict(), checkpoint_path)
 
+    peak = _peak_memory_mb()
+    print('Converted %s in %.2fs%s' % (
+        checkpoint_name, time.perf_counter() - start, '' if peak is None else ', peak memory %.0f MB' % peak))
+
     if check and os.path.exists("./images/tennis_in_crowd.jpg"):
         # Result
         input_image = _read_imgfile("./images/tennis_in_crowd.jpg", width, height)
@@ -1,44 +1,140 @@
+import base64
+import hashlib
 import requests
 import json
 import posixpath
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from posenet import MOBILENET_V1_CHECKPOINTS
 
 GOOGLE_CLOUD_STORAGE_DIR = 'https://storage.googleapis.com/tfjs-models/weights/posenet/'
 
+# POSENET_WEIGHTS_URL points the downloader elsewhere, e.g. at a local mirror
+WEIGHTS_URL_ENV = 'POSENET_WEIGHTS_URL'
+
+CHUNK_SIZE = 1 << 16
+
+
+class DownloadError(IOError):
+    pass
+
+
+def create_session(max_workers=4, retries=3):
+    """ requests.Session keeping up to max_workers connections alive, with
+        retries and backoff on connection errors and 5xx responses """
+
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _goog_md5(response):
+    # x-goog-hash: crc32c=<base64>,md5=<base64>
+    for part in response.headers.get('x-goog-hash', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name == 'md5':
+            return base64.b64decode(value).hex()
+    return None
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def download_file(session, url, path, expected_size=None, attempts=3, timeout=30):
+    """ Stream url into path + '.part' and rename it to path once its size
+        (and md5, when the server sends x-goog-hash) checks out. A .part left
+        by an interrupted run is resumed with an HTTP range request """
+
+    if os.path.exists(path) and (expected_size is None or os.path.getsize(path) == expected_size):
+        return path
+
+    part_path = path + '.part'
+    for attempt in range(attempts):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # nothing left to fetch, the .part is either complete or broken
+                    md5 = None
+                else:
+                    response.raise_for_status()
+                    # a server ignoring the range sends everything again
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    # x-goog-hash describes the whole object, also for range requests
+                    md5 = _goog_md5(response)
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+        except requests.RequestException as e:
+            # the .part keeps what arrived, the next attempt resumes from there
+            print('Download of %s interrupted (%s), attempt %d of %d' % (url, e, attempt + 1, attempts))
+            continue
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            error = 'expected %d bytes, got %d' % (expected_size, size)
+        elif md5 is not None and _file_md5(part_path) != md5:
+            error = 'md5 mismatch'
+        else:
+            os.replace(part_path, path)
+            return path
+
+        os.remove(part_path)
+        print('Download of %s failed (%s), attempt %d of %d' % (url, error, attempt + 1, attempts))
+    raise DownloadError('Could not download %s' % url)
+
+
+def download_json(checkpoint, filename, base_dir, session=None, base_url=None):
+    session = session or create_session()
+    base_url = base_url or os.environ.get(WEIGHTS_URL_ENV, GOOGLE_CLOUD_STORAGE_DIR)
+    url = posixpath.join(base_url, checkpoint, filename)
+    path = download_file(session, url, os.path.join(base_dir, checkpoint, filename))
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def download(checkpoint, base_dir='./weights/', base_url=None, max_workers=4):
+    """ Fetch the manifest of checkpoint and every shard it lists, up to
+        max_workers at a time over one pooled session. Shards are checked
+        against the size their shape implies (float32) """
 
-def download_json(checkpoint, filename, base_dir):
-
-    url = posixpath.join(GOOGLE_CLOUD_STORAGE_DIR, checkpoint, filename)
-    response = requests.get(url)
-    data = json.loads(response.content)
-
-    with open(os.path.join(base_dir, checkpoint, filename), 'w') as outfile:
-        json.dump(data, outfile)
-
-def download_file(checkpoint, filename, base_dir):
-
-    url = posixpath.join(GOOGLE_CLOUD_STORAGE_DIR, checkpoint, filename)
-    response = requests.get(url)
-    f = open(os.path.join(base_dir, checkpoint, filename), 'wb')
-    f.write(response.content)
-    f.close()
-
-def download(checkpoint, base_dir='./weights/'):
     save_dir = os.path.join(base_dir, checkpoint)
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
-    download_json(checkpoint, 'manifest.json', base_dir)
-
-    f = open(os.path.join(save_dir, 'manifest.json'), 'r')
-    json_dict = json.load(f)
-
-    for x in json_dict:
-        filename = json_dict[x]['filename']
-        print('Downloading', filename)
-        download_file(checkpoint, filename, base_dir)
+    base_url = base_url or os.environ.get(WEIGHTS_URL_ENV, GOOGLE_CLOUD_STORAGE_DIR)
+    session = create_session(max_workers)
+    try:
+        json_dict = download_json(checkpoint, 'manifest.json', base_dir, session, base_url)
+
+        def fetch(entry):
+            filename = entry['filename']
+            expected_size = 4
+            for dim in entry['shape']:
+                expected_size *= dim
+            download_file(session, posixpath.join(base_url, checkpoint, filename),
+                          os.path.join(save_dir, filename), expected_size)
+            return filename
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for filename in executor.map(fetch, json_dict.values()):
+                print('Downloaded', filename)
+    finally:
+        session.close()
 
 
 def main():
@@ -1,8 +1,71 @@
+import functools
+
 import numpy as np
 
 from posenet.constants import *
 
 
+def as_numpy(x):
+    """ Decoders accept NumPy arrays as well as torch tensors """
+    return x.cpu().numpy() if hasattr(x, 'cpu') else np.asarray(x)
+
+
+def _parent_edges():
+    # child keypoint id -> (parent keypoint id, edge id) of the pose chain tree
+    return {child: (parent, edge) for edge, (parent, child) in enumerate(PARENT_CHILD_TUPLES)}
+
+
+def _path_to_tree_root(keypoint_id, parent_edges):
+    path = [(keypoint_id, None)]
+    while keypoint_id in parent_edges:
+        keypoint_id, edge = parent_edges[keypoint_id]
+        path.append((keypoint_id, edge))
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def get_decode_edge_mask(part_names):
+    """ For a collection of PART_NAMES return a (NUM_KEYPOINTS, num_edges) bool
+        array. Row r marks the PARENT_CHILD_TUPLES edges that lie on the tree
+        paths from root keypoint r to the requested parts, i.e. the minimal
+        sub-tree decode_pose has to traverse when starting from r """
+
+    parent_edges = _parent_edges()
+    targets = [PART_IDS[name] for name in part_names]
+    mask = np.zeros((NUM_KEYPOINTS, len(PARENT_CHILD_TUPLES)), dtype=bool)
+    for root_id in range(NUM_KEYPOINTS):
+        root_path = _path_to_tree_root(root_id, parent_edges)
+        root_ancestors = [k for k, _ in root_path]
+        for target_id in targets:
+            target_path = _path_to_tree_root(target_id, parent_edges)
+            target_ancestors = [k for k, _ in target_path]
+            lca = next(k for k in root_ancestors if k in target_ancestors)
+            # edge stored with a node is the one leading to the node above it
+            for path in (root_path, target_path):
+                for i, (keypoint_id, _) in enumerate(path):
+                    if keypoint_id == lca:
+                        break
+                    mask[root_id, path[i + 1][1]] = True
+    return mask
+
+
+def get_connecting_keypoints(part_names):
+    """ Keypoint ids of the requested parts plus every keypoint on the tree
+        paths between them, i.e. all heatmaps decoding among them can touch """
+
+    keypoint_ids = {PART_IDS[name] for name in part_names}
+    edges = get_decode_edge_mask(tuple(sorted(part_names)))[sorted(keypoint_ids)].any(axis=0)
+    for edge in np.flatnonzero(edges):
+        keypoint_ids.update(PARENT_CHILD_TUPLES[edge])
+    return sorted(keypoint_ids)
+
+
+def get_decoded_part_counts(part_names):
+    """ Number of keypoints filled in when decoding from each root with
+        get_decode_edge_mask(part_names), the root itself included """
+    return get_decode_edge_mask(part_names).sum(axis=1) + 1
+
+
 def traverse_to_targ_keypoint(
         edge_id, source_keypoint, target_keypoint_id, scores, offsets, output_stride, displacements
 ):
@@ -32,10 +95,13 @@ def decode_pose(
         offsets,
         output_stride,
         displacements_fwd,
-        displacements_bwd
+        displacements_bwd,
+        edge_mask=None
 ):
     num_parts = scores.shape[0]
     num_edges = len(PARENT_CHILD_TUPLES)
+    if edge_mask is None:
+        edge_mask = np.ones(num_edges, dtype=bool)
 
     instance_keypoint_scores = np.zeros(num_parts)
     instance_keypoint_coords = np.zeros((num_parts, 2))
@@ -44,7 +110,7 @@ def decode_pose(
 
     for edge in reversed(range(num_edges)):
         target_keypoint_id, source_keypoint_id = PARENT_CHILD_TUPLES[edge]
-        if (instance_keypoint_scores[source_keypoint_id] > 0.0 and
+        if (edge_mask[edge] and instance_keypoint_scores[source_keypoint_id] > 0.0 and
                 instance_keypoint_scores[target_keypoint_id] == 0.0):
             score, coords = traverse_to_targ_keypoint(
                 edge,
@@ -56,7 +122,7 @@ def decode_pose(
 
     for edge in range(num_edges):
         source_keypoint_id, target_keypoint_id = PARENT_CHILD_TUPLES[edge]
-        if (instance_keypoint_scores[source_keypoint_id] > 0.0 and
+        if (edge_mask[edge] and instance_keypoint_scores[source_keypoint_id] > 0.0 and
                 instance_keypoint_scores[target_keypoint_id] == 0.0):
             score, coords = traverse_to_targ_keypoint(
                 edge,
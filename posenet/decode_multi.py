@@ -1,8 +1,5 @@
 from posenet.decode import *
 from posenet.constants import *
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
 
 
 def within_nms_radius_fast(pose_coords, squared_nms_radius, point):
@@ -14,17 +11,39 @@ def within_nms_radius_fast(pose_coords, squared_nms_radius, point):
 def get_instance_score_fast(
         exist_pose_coords,
         squared_nms_radius,
-        keypoint_scores, keypoint_coords):
+        keypoint_scores, keypoint_coords, num_parts=None):
 
     if exist_pose_coords.shape[0]:
         s = np.sum((exist_pose_coords - keypoint_coords) ** 2, axis=2) > squared_nms_radius
         not_overlapped_scores = np.sum(keypoint_scores[np.all(s, axis=0)])
     else:
         not_overlapped_scores = np.sum(keypoint_scores)
-    return not_overlapped_scores / len(keypoint_scores)
+    return not_overlapped_scores / (num_parts or len(keypoint_scores))
+
+
+def build_part_with_score(score_threshold, local_max_radius, scores):
+    """ Local maxima of a (17, H, W) heatmap at or above score_threshold as
+        (scores, (keypoint id, y, x) indices), highest score first """
+
+    num_parts, height, width = scores.shape
+    lmd = 2 * local_max_radius + 1
+    padded = np.pad(scores, ((0, 0), (local_max_radius,) * 2, (local_max_radius,) * 2),
+                    mode='constant', constant_values=-np.inf)
+    max_vals = scores.copy()
+    for dy in range(lmd):
+        for dx in range(lmd):
+            np.maximum(max_vals, padded[:, dy:dy + height, dx:dx + width], out=max_vals)
+    max_loc = (scores == max_vals) & (scores >= score_threshold)
+    max_loc_idx = np.argwhere(max_loc)
+    scores_vec = scores[max_loc]
+    sort_idx = np.argsort(-scores_vec, kind='stable')
+    return scores_vec[sort_idx], max_loc_idx[sort_idx]
 
 
 def build_part_with_score_torch(score_threshold, local_max_radius, scores):
+    import torch
+    import torch.nn.functional as F
+
     lmd = 2 * local_max_radius + 1
     max_vals = F.max_pool2d(scores, lmd, stride=1, padding=1)
     max_loc = (scores == max_vals) & (scores >= score_threshold)
@@ -34,6 +53,14 @@ def build_part_with_score_torch(score_threshold, local_max_radius, scores):
     return scores_vec[sort_idx], max_loc_idx[sort_idx]
 
 
+def build_parts(score_threshold, scores):
+    # perform part scoring step on GPU as it's expensive, when the scores are there already
+    if getattr(scores, 'is_cuda', False):
+        part_scores, part_idx = build_part_with_score_torch(score_threshold, LOCAL_MAXIMUM_RADIUS, scores)
+        return part_scores.cpu().numpy(), part_idx.cpu().numpy()
+    return build_part_with_score(score_threshold, LOCAL_MAXIMUM_RADIUS, as_numpy(scores))
+
+
 # FIXME leaving here as reference for now
 # def build_part_with_score_fast(score_threshold, local_max_radius, scores):
 #     parts = []
@@ -60,21 +87,25 @@ def build_part_with_score_torch(score_threshold, local_max_radius, scores):
 
 def decode_multiple_poses(
         scores, offsets, displacements_fwd, displacements_bwd, output_stride,
-        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5):
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5,
+        required_parts=None):
 
-    # perform part scoring step on GPU as it's expensive
-    # TODO determine how much more of this would be worth performing on the GPU
-    part_scores, part_idx = build_part_with_score_torch(score_threshold, LOCAL_MAXIMUM_RADIUS, scores)
-    part_scores = part_scores.cpu().numpy()
-    part_idx = part_idx.cpu().numpy()
+    part_scores, part_idx = build_parts(score_threshold, scores)
 
-    scores = scores.cpu().numpy()
+    scores = as_numpy(scores)
     height = scores.shape[1]
     width = scores.shape[2]
     # change dimensions from (x, h, w) to (x//2, h, w, 2) to allow return of complete coord array
-    offsets = offsets.cpu().numpy().reshape(2, -1, height, width).transpose((1, 2, 3, 0))
-    displacements_fwd = displacements_fwd.cpu().numpy().reshape(2, -1, height, width).transpose((1, 2, 3, 0))
-    displacements_bwd = displacements_bwd.cpu().numpy().reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+    offsets = as_numpy(offsets).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+    displacements_fwd = as_numpy(displacements_fwd).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+    displacements_bwd = as_numpy(displacements_bwd).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+
+    # with required_parts only the sub-tree reaching those PART_NAMES is decoded,
+    # pose scores are then averaged over the keypoints that were decoded
+    edge_masks = part_counts = None
+    if required_parts is not None:
+        edge_masks = get_decode_edge_mask(tuple(sorted(required_parts)))
+        part_counts = get_decoded_part_counts(tuple(sorted(required_parts)))
 
     squared_nms_radius = nms_radius ** 2
     pose_count = 0
@@ -86,17 +117,22 @@ def decode_multiple_poses(
         root_coord = np.array([root_coord_y, root_coord_x])
         root_image_coords = root_coord * output_stride + offsets[root_id, root_coord_y, root_coord_x]
 
-        if within_nms_radius_fast(
-                pose_keypoint_coords[:pose_count, root_id, :], squared_nms_radius, root_image_coords):
+        exist_root_coords = pose_keypoint_coords[:pose_count, root_id, :]
+        if edge_masks is not None:
+            # poses that never reached this keypoint have no coordinate to compare against
+            exist_root_coords = exist_root_coords[pose_keypoint_scores[:pose_count, root_id] > 0.0]
+        if within_nms_radius_fast(exist_root_coords, squared_nms_radius, root_image_coords):
             continue
 
         keypoint_scores, keypoint_coords = decode_pose(
             root_score, root_id, root_image_coords,
             scores, offsets, output_stride,
-            displacements_fwd, displacements_bwd)
+            displacements_fwd, displacements_bwd,
+            edge_mask=None if edge_masks is None else edge_masks[root_id])
 
         pose_score = get_instance_score_fast(
-            pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords)
+            pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords,
+            num_parts=None if part_counts is None else part_counts[root_id])
 
         # NOTE this isn't in the original implementation, but it appears that by initially ordering by
         # part scores, and having a max # of detections, we can end up populating the returned poses with
@@ -0,0 +1,80 @@
+import numpy as np
+
+from posenet.constants import *
+from posenet.decode import as_numpy
+from posenet.decode_vectorized import decode_multiple_poses_vectorized
+
+
+def count_local_maxima(heatmap, score_threshold, local_max_radius=LOCAL_MAXIMUM_RADIUS):
+    height, width = heatmap.shape
+    lmd = 2 * local_max_radius + 1
+    padded = np.pad(heatmap, local_max_radius, mode='constant', constant_values=-np.inf)
+    max_vals = heatmap.copy()
+    for dy in range(lmd):
+        for dx in range(lmd):
+            np.maximum(max_vals, padded[dy:dy + height, dx:dx + width], out=max_vals)
+    return int(np.count_nonzero((heatmap == max_vals) & (heatmap >= score_threshold)))
+
+
+def decode_single_pose(scores, offsets, output_stride, max_pose_detections=1, min_pose_score=0.,
+                       required_parts=None):
+    """ Single person decoding: each keypoint is the argmax of its heatmap refined
+        by its offset vector. No displacement traversal and no NMS. With
+        required_parts only those PART_NAMES are located """
+
+    scores = as_numpy(scores)
+    offsets = as_numpy(offsets)
+    num_parts, height, width = scores.shape
+
+    if required_parts is None:
+        parts = np.arange(num_parts)
+    else:
+        parts = np.array(sorted(PART_IDS[name] for name in required_parts))
+
+    flat_scores = scores.reshape(num_parts, -1)[parts]
+    flat_idx = np.argmax(flat_scores, axis=1)
+    y, x = np.divmod(flat_idx, width)
+
+    offsets = offsets.reshape(2, num_parts, height, width)
+    keypoint_scores = np.zeros(num_parts)
+    keypoint_coords = np.zeros((num_parts, 2))
+    keypoint_scores[parts] = flat_scores[np.arange(len(parts)), flat_idx]
+    keypoint_coords[parts] = np.stack([y, x], axis=1) * output_stride + np.stack(
+        [offsets[0, parts, y, x], offsets[1, parts, y, x]], axis=1)
+
+    pose_scores = np.zeros(max_pose_detections)
+    pose_keypoint_scores = np.zeros((max_pose_detections, num_parts))
+    pose_keypoint_coords = np.zeros((max_pose_detections, num_parts, 2))
+
+    pose_score = np.sum(keypoint_scores) / len(parts)
+    if min_pose_score == 0. or pose_score >= min_pose_score:
+        pose_scores[0] = pose_score
+        pose_keypoint_scores[0] = keypoint_scores
+        pose_keypoint_coords[0] = keypoint_coords
+    return pose_scores, pose_keypoint_scores, pose_keypoint_coords
+
+
+def decode_single_pose_with_fallback(
+        scores, offsets, displacements_fwd, displacements_bwd, output_stride,
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5,
+        required_parts=None, fallback=decode_multiple_poses_vectorized):
+    """ decode_multiple_poses compatible entry point for the single pose mode.
+        When the nose heatmap has more than one peak above score_threshold there
+        is more than one person in view and the multi pose decoder is used. The
+        displacement arguments may be callables so they are only computed then """
+
+    nose_scores = as_numpy(scores[PART_IDS['nose']])
+    if count_local_maxima(nose_scores, score_threshold) <= 1:
+        return decode_single_pose(
+            scores, offsets, output_stride,
+            max_pose_detections=max_pose_detections, min_pose_score=min_pose_score,
+            required_parts=required_parts)
+
+    if callable(displacements_fwd):
+        displacements_fwd = displacements_fwd()
+    if callable(displacements_bwd):
+        displacements_bwd = displacements_bwd()
+    return fallback(
+        scores, offsets, displacements_fwd, displacements_bwd, output_stride,
+        max_pose_detections=max_pose_detections, score_threshold=score_threshold,
+        nms_radius=nms_radius, min_pose_score=min_pose_score, required_parts=required_parts)
@@ -0,0 +1,170 @@
+import numpy as np
+
+from posenet.constants import *
+from posenet.decode import as_numpy, get_decode_edge_mask, get_decoded_part_counts
+from posenet.decode_multi import build_parts
+
+
+def traverse_to_targ_keypoints(
+        edge_id, source_keypoints, target_keypoint_id, scores, offsets, output_stride, displacements
+):
+    # same as traverse_to_targ_keypoint but for an (N, 2) array of source keypoints
+    height = scores.shape[1]
+    width = scores.shape[2]
+    max_indices = [height - 1, width - 1]
+
+    source_keypoint_indices = np.clip(
+        np.round(source_keypoints / output_stride), a_min=0, a_max=max_indices).astype(np.int32)
+
+    displaced_points = source_keypoints + displacements[
+        edge_id, source_keypoint_indices[:, 0], source_keypoint_indices[:, 1]]
+
+    displaced_point_indices = np.clip(
+        np.round(displaced_points / output_stride), a_min=0, a_max=max_indices).astype(np.int32)
+
+    score = scores[target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]]
+
+    image_coords = displaced_point_indices * output_stride + offsets[
+        target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]]
+
+    return score, image_coords
+
+
+def decode_poses(
+        root_scores, root_ids, root_image_coords,
+        scores,
+        offsets,
+        output_stride,
+        displacements_fwd,
+        displacements_bwd,
+        edge_masks=None
+):
+    """ Batched decode_pose, every root is advanced through each edge of the
+        pose chain at once. edge_masks optionally holds one get_decode_edge_mask
+        row per root """
+
+    num_roots = root_scores.shape[0]
+    num_parts = scores.shape[0]
+    num_edges = len(PARENT_CHILD_TUPLES)
+
+    instance_keypoint_scores = np.zeros((num_roots, num_parts))
+    instance_keypoint_coords = np.zeros((num_roots, num_parts, 2))
+    rows = np.arange(num_roots)
+    instance_keypoint_scores[rows, root_ids] = root_scores
+    instance_keypoint_coords[rows, root_ids] = root_image_coords
+
+    edge_passes = (
+        ((edge,) + PARENT_CHILD_TUPLES[edge] for edge in reversed(range(num_edges))),
+        ((edge,) + PARENT_CHILD_TUPLES[edge][::-1] for edge in range(num_edges)),
+    )
+    for displacements, edges in zip((displacements_bwd, displacements_fwd), edge_passes):
+        for edge, target_keypoint_id, source_keypoint_id in edges:
+            todo = ((instance_keypoint_scores[:, source_keypoint_id] > 0.0) &
+                    (instance_keypoint_scores[:, target_keypoint_id] == 0.0))
+            if edge_masks is not None:
+                todo &= edge_masks[:, edge]
+            sel = np.flatnonzero(todo)
+            if not sel.size:
+                continue
+            score, coords = traverse_to_targ_keypoints(
+                edge,
+                instance_keypoint_coords[sel, source_keypoint_id],
+                target_keypoint_id,
+                scores, offsets, output_stride, displacements)
+            instance_keypoint_scores[sel, target_keypoint_id] = score
+            instance_keypoint_coords[sel, target_keypoint_id] = coords
+
+    return instance_keypoint_scores, instance_keypoint_coords
+
+
+def decode_multiple_poses_vectorized(
+        scores, offsets, displacements_fwd, displacements_bwd, output_stride,
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5,
+        required_parts=None, chunk_size=64):
+    """ Drop-in replacement for decode_multiple_poses. Candidate roots are
+        decoded together, then the greedy NMS walks the candidates in score order
+        keeping per candidate suppression / overlap masks that are updated with
+        one matrix op per accepted pose """
+
+    part_scores, part_idx = build_parts(score_threshold, scores)
+
+    scores = as_numpy(scores)
+    height = scores.shape[1]
+    width = scores.shape[2]
+    # change dimensions from (x, h, w) to (x//2, h, w, 2) to allow return of complete coord array
+    offsets = as_numpy(offsets).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+    displacements_fwd = as_numpy(displacements_fwd).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+    displacements_bwd = as_numpy(displacements_bwd).reshape(2, -1, height, width).transpose((1, 2, 3, 0))
+
+    pose_scores = np.zeros(max_pose_detections)
+    pose_keypoint_scores = np.zeros((max_pose_detections, NUM_KEYPOINTS))
+    pose_keypoint_coords = np.zeros((max_pose_detections, NUM_KEYPOINTS, 2))
+    if not part_scores.shape[0]:
+        return pose_scores, pose_keypoint_scores, pose_keypoint_coords
+
+    root_ids = part_idx[:, 0]
+    root_image_coords = part_idx[:, 1:] * output_stride + offsets[root_ids, part_idx[:, 1], part_idx[:, 2]]
+
+    # see decode_multiple_poses for the meaning of required_parts
+    edge_masks = None
+    part_counts = np.full(part_scores.shape[0], NUM_KEYPOINTS)
+    if required_parts is not None:
+        edge_masks = get_decode_edge_mask(tuple(sorted(required_parts)))[root_ids]
+        part_counts = get_decoded_part_counts(tuple(sorted(required_parts)))[root_ids]
+
+    squared_nms_radius = nms_radius ** 2
+    pose_count = 0
+
+    # candidates are decoded in blocks so a frame that fills max_pose_detections
+    # early does not pay for decoding every low scored root
+    for start in range(0, part_scores.shape[0], chunk_size):
+        block = slice(start, start + chunk_size)
+        block_root_ids = root_ids[block]
+        block_root_coords = root_image_coords[block]
+        block_part_counts = part_counts[block]
+        keypoint_scores, keypoint_coords = decode_poses(
+            part_scores[block], block_root_ids, block_root_coords,
+            scores, offsets, output_stride,
+            displacements_fwd, displacements_bwd,
+            edge_masks=None if edge_masks is None else edge_masks[block])
+
+        # root of candidate i lies within the radius of an accepted pose (within_nms_radius_fast)
+        # keypoint k of candidate i lies within the radius of an accepted pose (get_instance_score_fast)
+        accepted = pose_keypoint_coords[:pose_count]
+        # poses that never reached a keypoint have no coordinate to compare against
+        accepted_root_known = pose_keypoint_scores[:pose_count, block_root_ids] > 0.0
+        if edge_masks is None:
+            accepted_root_known[:] = True
+        suppressed = np.any(accepted_root_known & (np.sum(
+            (accepted[:, block_root_ids] - block_root_coords) ** 2, axis=2) <= squared_nms_radius), axis=0)
+        overlapped = np.any(np.sum(
+            (accepted[:, None] - keypoint_coords) ** 2, axis=3) <= squared_nms_radius, axis=0)
+
+        first_candidate = 0
+        while pose_count < max_pose_detections:
+            instance_scores = np.where(overlapped, 0., keypoint_scores).sum(axis=1) / block_part_counts
+            eligible = ~suppressed
+            # see the note in decode_multiple_poses, min_pose_score of 0. reverts to original behaviour
+            if min_pose_score != 0.:
+                eligible &= instance_scores >= min_pose_score
+            eligible[:first_candidate] = False
+            remaining = np.flatnonzero(eligible)
+            if not remaining.size:
+                break
+
+            i = remaining[0]
+            pose_scores[pose_count] = instance_scores[i]
+            pose_keypoint_scores[pose_count, :] = keypoint_scores[i]
+            pose_keypoint_coords[pose_count, :, :] = keypoint_coords[i]
+            pose_count += 1
+            first_candidate = i + 1
+
+            root_known = keypoint_scores[i, block_root_ids] > 0.0 if edge_masks is not None else True
+            suppressed |= root_known & (np.sum(
+                (keypoint_coords[i, block_root_ids] - block_root_coords) ** 2, axis=1) <= squared_nms_radius)
+            overlapped |= np.sum((keypoint_coords - keypoint_coords[i]) ** 2, axis=2) <= squared_nms_radius
+
+        if pose_count >= max_pose_detections:
+            break
+
+    return pose_scores, pose_keypoint_scores, pose_keypoint_coords
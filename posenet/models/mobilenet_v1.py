@@ -4,6 +4,8 @@ import torch.nn.functional as F
 
 from collections import OrderedDict
 
+from posenet.constants import HEADS, INPUT_PAD_VALUE, MOBILENET_V1_CHECKPOINTS, NUM_KEYPOINTS
+
 
 def _to_output_strided_layers(convolution_def, output_stride):
     current_stride = 1
@@ -68,13 +70,6 @@ class SeperableConv(nn.Module):
         return x
 
 
-MOBILENET_V1_CHECKPOINTS = {
-    50: 'mobilenet_v1_050',
-    75: 'mobilenet_v1_075',
-    100: 'mobilenet_v1_100',
-    101: 'mobilenet_v1_101'
-}
-
 MOBILE_NET_V1_100 = [
     (InputConv, 3, 32, 2),
     (SeperableConv, 32, 64, 1),
@@ -129,11 +124,24 @@ MOBILE_NET_V1_50 = [
 
 class MobileNetV1(nn.Module):
 
-    def __init__(self, model_id, output_stride=16):
+    def __init__(self, model_id, output_stride=16, heads=HEADS, keypoints=None):
+        """ heads selects which of the output heads are built and computed by
+            default. keypoints optionally restricts the heatmap and offset heads
+            to those keypoint ids, the heatmap then has len(keypoints) channels
+            and the offsets 2 * len(keypoints) (all y offsets, then all x).
+            Full checkpoints load into any such variant """
+
         super(MobileNetV1, self).__init__()
 
         assert model_id in MOBILENET_V1_CHECKPOINTS.keys()
+        assert all(h in HEADS for h in heads)
         self.output_stride = output_stride
+        self.heads = tuple(h for h in HEADS if h in heads)
+        self.keypoints = None if keypoints is None else tuple(sorted(keypoints))
+        # set by posenet.models.quantized.convert_quantized
+        self.quantized = False
+        # set by fold_input_normalization
+        self.input_padding = None
 
         if model_id == 50:
             arch = MOBILE_NET_V1_50
@@ -148,16 +156,69 @@ class MobileNetV1(nn.Module):
             for c in conv_def]
         last_depth = conv_def[-1]['outp']
 
-        self.features = nn.Sequential(OrderedDict(conv_list))
-        self.heatmap = nn.Conv2d(last_depth, 17, 1, 1)
-        self.offset = nn.Conv2d(last_depth, 34, 1, 1)
-        self.displacement_fwd = nn.Conv2d(last_depth, 32, 1, 1)
-        self.displacement_bwd = nn.Conv2d(last_depth, 32, 1, 1)
+        num_keypoints = NUM_KEYPOINTS if self.keypoints is None else len(self.keypoints)
+        head_channels = {
+            'heatmap': num_keypoints,
+            'offset': 2 * num_keypoints,
+            'displacement_fwd': 2 * (NUM_KEYPOINTS - 1),
+            'displacement_bwd': 2 * (NUM_KEYPOINTS - 1),
+        }
 
-    def forward(self, x):
-        x = self.features(x)
-        heatmap = torch.sigmoid(self.heatmap(x))
-        offset = self.offset(x)
-        displacement_fwd = self.displacement_fwd(x)
-        displacement_bwd = self.displacement_bwd(x)
-        return heatmap, offset, displacement_fwd, displacement_bwd
+        self.features = nn.Sequential(OrderedDict(conv_list))
+        for head in self.heads:
+            setattr(self, head, nn.Conv2d(last_depth, head_channels[head], 1, 1))
+
+        self._register_load_state_dict_pre_hook(self._select_head_weights)
+
+    def _select_head_weights(self, state_dict, prefix, local_metadata, strict,
+                             missing_keys, unexpected_keys, error_msgs):
+        # full checkpoints carry every head for all 17 keypoints, drop what this
+        # variant does not have and slice the keypoint channels it keeps
+        for head in HEADS:
+            for param in ('weight', 'bias'):
+                key = '%s%s.%s' % (prefix, head, param)
+                if key not in state_dict:
+                    continue
+                if head not in self.heads:
+                    del state_dict[key]
+                    continue
+                value = state_dict[key]
+                expected = getattr(self, head).weight.shape[0]
+                if self.keypoints is None or value.shape[0] == expected:
+                    continue
+                if head == 'heatmap':
+                    state_dict[key] = value[list(self.keypoints)]
+                elif head == 'offset':
+                    state_dict[key] = value[list(self.keypoints) + [NUM_KEYPOINTS + k for k in self.keypoints]]
+
+    def fold_input_normalization(self):
+        """ Fold the x * 2 / 255 - 1 input scaling and the BGR -> RGB swap into
+            conv0, in place. The model then takes BGR pixel values that are
+            already padded by input_padding pixels of INPUT_PAD_VALUE on every
+            side, the padding conv0 used to add itself """
+
+        if self.input_padding is not None:
+            return self
+        conv = self.features.conv0.conv
+        with torch.no_grad():
+            weight = conv.weight.flip(1)
+            bias = conv.bias - weight.sum(dim=(1, 2, 3))
+            conv.weight = nn.Parameter(weight * (1.0 / INPUT_PAD_VALUE))
+            conv.bias = nn.Parameter(bias)
+        # zero padding of normalized inputs is INPUT_PAD_VALUE padding of raw ones
+        self.input_padding = conv.padding[0]
+        conv.padding = (0, 0)
+        return self
+
+    def forward_heads(self, x, heads=None):
+        """ Compute the requested output heads (all built heads by default)
+            from the output of self.features, in the order requested """
+
+        outputs = []
+        for head in heads or self.heads:
+            out = getattr(self, head)(x)
+            outputs.append(torch.sigmoid(out) if head == 'heatmap' else out)
+        return tuple(outputs)
+
+    def forward(self, x, heads=None):
+        return self.forward_heads(self.features(x), heads)
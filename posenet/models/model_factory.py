@@ -1,23 +1,144 @@
 import torch
 import os
+import tempfile
+import time
+import warnings
 
 
+from posenet.constants import LEGACY_MODEL_DIR, MODEL_DIR
 from posenet.models.mobilenet_v1 import MobileNetV1, MOBILENET_V1_CHECKPOINTS
+from posenet.models.tensor_cache import TensorCache, read_tensors
+from posenet.utils import parse_model_id
 
-MODEL_DIR = './_models'
 DEBUG_OUTPUT = False
 
 
-def load_model(model_id, output_stride=16, model_dir=MODEL_DIR):
-    model_path = os.path.join(model_dir, MOBILENET_V1_CHECKPOINTS[model_id] + '.pth')
+def load_model(model_id, output_stride=16, model_dir=MODEL_DIR, fold_input=False, **model_kwargs):
+    """ MobileNetV1 for model_id. fold_input folds the input normalization into
+        the first convolution, see MobileNetV1.fold_input_normalization """
+
+    model_id, variant = parse_model_id(model_id)
+    if fold_input and variant is not None:
+        raise ValueError('The input normalization can not be folded into %s models' % variant)
+    if variant == 'int8':
+        return load_quantized_model(model_id, output_stride, model_dir, **model_kwargs)
+    elif variant is not None:
+        raise ValueError('Unknown model variant %s' % variant)
+
+    # parameters are created on the meta device and replaced by tensors backed
+    # by the mapped cache file, weights are only paged in when used
+    with torch.device('meta'):
+        model = MobileNetV1(model_id, output_stride=output_stride, **model_kwargs)
+    model.load_state_dict(load_state_dict(model_id, model_dir), assign=True)
+    if fold_input:
+        model.fold_input_normalization()
+
+    return model
+
+
+def load_state_dict(model_id, model_dir=MODEL_DIR):
+    """ State dict of a MobileNetV1 checkpoint from the tensor cache in
+        model_dir. The first call imports a .pth left in model_dir or
+        LEGACY_MODEL_DIR, or converts the tfjs weights """
+
+    cache = TensorCache(model_dir)
+    checkpoint_name = MOBILENET_V1_CHECKPOINTS[model_id]
+    path = cache.path(checkpoint_name)
+    if path is None:
+        converted = False
+        for directory in (model_dir, LEGACY_MODEL_DIR):
+            model_path = os.path.join(directory, checkpoint_name + '.pth')
+            if os.path.exists(model_path):
+                break
+        else:
+            print('Cannot find models file %s, converting from tfjs...' % checkpoint_name)
+            from posenet.converter.tfjs2pytorch import convert
+            convert(model_id, model_dir, check=False)
+            model_path = os.path.join(model_dir, checkpoint_name + '.pth')
+            assert os.path.exists(model_path)
+            converted = True
+
+        state_dict = torch.load(model_path)
+        path = cache.put(checkpoint_name, {k: v.numpy() for k, v in state_dict.items()}, model_id=model_id)
+        if converted:
+            os.remove(model_path)
+        if DEBUG_OUTPUT:
+            print('Cached %s as %s' % (model_path, path))
+
+    return {name: torch.from_numpy(array) for name, array in read_tensors(path).items()}
+
+
+def load_quantized_model(model_id, output_stride=16, model_dir=MODEL_DIR, **model_kwargs):
+    """ int8 MobileNetV1 saved by posenet.converter.quantize. The heads always
+        cover all keypoints, restricting them would need a calibration per
+        keypoint selection """
+
+    from posenet.models.quantized import convert_quantized, prepare_quantized, quantized_checkpoint_name
+
+    model_path = os.path.join(model_dir, quantized_checkpoint_name(model_id) + '.pth')
     if not os.path.exists(model_path):
-        print('Cannot find models file %s, converting from tfjs...' % model_path)
-        from posenet.converter.tfjs2pytorch import convert
-        convert(model_id, model_dir, check=False)
-        assert os.path.exists(model_path)
-
-    model = MobileNetV1(model_id, output_stride=output_stride)
-    load_dict = torch.load(model_path)
-    model.load_state_dict(load_dict)
+        raise FileNotFoundError(
+            'Cannot find quantized models file %s, create it with '
+            'python -m posenet.converter.quantize --model %d --images <dir>' % (model_path, model_id))
+
+    model_kwargs.pop('keypoints', None)
+    model = MobileNetV1(model_id, output_stride=output_stride, **model_kwargs)
+    model = convert_quantized(prepare_quantized(model))
+    model.load_state_dict(torch.load(model_path))
+
+    return model
+
+
+def _compiled_path(model, model_id, input_shape, device, model_dir):
+    name = '%s_s%d_%dx%d' % (MOBILENET_V1_CHECKPOINTS[model_id], model.output_stride, *input_shape)
+    if model.keypoints is not None:
+        name += '_k' + '-'.join(str(k) for k in model.keypoints)
+    if model.input_padding is not None:
+        name += '_folded'
+    name += '_%s_torch%s.pt' % (device, torch.__version__.split('+')[0])
+    return os.path.join(model_dir, name)
+
+
+def load_compiled_model(model_id, input_shape, output_stride=16, model_dir=MODEL_DIR, warmup=3,
+                        device='cpu', fold_input=False, **model_kwargs):
+    """ load_model with the feature extractor traced and frozen for (height,
+        width) inputs. The frozen module is cached next to the .pth, keyed by
+        model id, stride, shape and keypoints. warmup passes are run so kernel
+        selection happens before the first real frame. Other input sizes still
+        work, they are just not warmed up """
+
+    model_id = parse_model_id(model_id)[0]
+    model = load_model(model_id, output_stride, model_dir, fold_input, **model_kwargs).eval().to(device)
+    padding = 2 * (model.input_padding or 0)
+    example = torch.zeros((1, 3, input_shape[0] + padding, input_shape[1] + padding), device=device)
+    path = _compiled_path(model, model_id, input_shape, device, model_dir)
+
+    start = time.perf_counter()
+    # torch.jit prints deprecation warnings on recent versions
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter('ignore')
+        features = None
+        if os.path.exists(path):
+            try:
+                features = torch.jit.load(path, map_location=device)
+            except RuntimeError as e:
+                # torn by an interrupted in place save or damaged on disk, the
+                # compiled model below replaces it
+                print('Recompiling %s, the cached file could not be loaded: %s' % (path, e))
+        if features is None:
+            features = torch.jit.freeze(torch.jit.trace(model.features, example).eval())
+            # saved next to the weights and renamed, so a concurrent start never sees half a file
+            with tempfile.NamedTemporaryFile(dir=model_dir, suffix='.tmp', delete=False) as f:
+                torch.jit.save(features, f)
+            os.replace(f.name, path)
+            if DEBUG_OUTPUT:
+                print('Compiled %s in %.2fs' % (path, time.perf_counter() - start))
+        # the optimized graph can not be serialized, so it is redone on every load
+        model.features = torch.jit.optimize_for_inference(features)
+
+        for _ in range(warmup):
+            model(example)
+    if DEBUG_OUTPUT:
+        print('Loaded and warmed up %s in %.2fs' % (path, time.perf_counter() - start))
 
     return model
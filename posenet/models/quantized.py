@@ -0,0 +1,56 @@
+import torch
+import torch.nn as nn
+
+from collections import OrderedDict
+
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from posenet.constants import MOBILENET_V1_CHECKPOINTS
+
+# first supported one wins, onednn has the fastest depthwise int8 kernels
+QUANTIZED_ENGINES = ('onednn', 'x86', 'fbgemm', 'qnnpack')
+
+QUANTIZED_SUFFIX = '_int8'
+
+
+def quantized_checkpoint_name(model_id):
+    return MOBILENET_V1_CHECKPOINTS[model_id] + QUANTIZED_SUFFIX
+
+
+def select_quantized_engine():
+    """ Make the fastest available backend the active quantized engine. Weights
+        are packed for the engine active at conversion / load time """
+
+    supported = torch.backends.quantized.supported_engines
+    engine = next(e for e in QUANTIZED_ENGINES + (torch.backends.quantized.engine,) if e in supported)
+    torch.backends.quantized.engine = engine
+    return engine
+
+
+def prepare_quantized(model, example_shape=(1, 3, 257, 257)):
+    """ Insert observers into the InputConv / SeperableConv stack and each of
+        the output heads of a MobileNetV1 (in place). Heads are quantized one by
+        one so they can still be computed separately """
+
+    qconfig_mapping = get_default_qconfig_mapping(select_quantized_engine())
+    model.eval()
+    example = torch.zeros(example_shape)
+    with torch.no_grad():
+        features = model.features(example)
+    model.features = prepare_fx(model.features, qconfig_mapping, (example,))
+    for head in model.heads:
+        wrapped = nn.Sequential(OrderedDict([(head, getattr(model, head))]))
+        setattr(model, head, prepare_fx(wrapped, qconfig_mapping, (features,)))
+    return model
+
+
+def convert_quantized(model):
+    """ Turn a prepared (and calibrated) model into its int8 version, in place.
+        Inputs and outputs of every part stay float """
+
+    model.features = convert_fx(model.features)
+    for head in model.heads:
+        setattr(model, head, convert_fx(getattr(model, head)))
+    model.quantized = True
+    return model
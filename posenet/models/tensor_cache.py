@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+# file layout: MAGIC, little endian u64 header length, JSON header, padding
+# to ALIGNMENT, then every tensor C-contiguous at an ALIGNMENT multiple
+MAGIC = b'PATENSOR'
+ALIGNMENT = 64
+SUFFIX = '.tensors'
+MANIFEST = 'manifest.json'
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def write_tensors(arrays, f):
+    """ Write a name -> NumPy array mapping in the flat format, returns the
+        sha256 hex digest of everything written """
+
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({'tensors': entries}).encode('utf-8')
+
+    digest = hashlib.sha256()
+
+    def write(data):
+        digest.update(data)
+        f.write(data)
+
+    prefix = MAGIC + struct.pack('<Q', len(header)) + header
+    write(prefix + b'\0' * _padding(len(prefix)))
+    for array in arrays.values():
+        write(memoryview(array).cast('B'))
+        write(b'\0' * _padding(array.nbytes))
+    return digest.hexdigest()
+
+
+def read_tensors(path):
+    """ name -> NumPy array mapping backed by a copy-on-write memory map of
+        path. Nothing is read until a tensor is touched and processes mapping
+        the same file share its pages """
+
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('%s is not a tensor file' % path)
+    header_length, = struct.unpack('<Q', bytes(data[len(MAGIC):len(MAGIC) + 8]))
+    header_end = len(MAGIC) + 8 + header_length
+    header = json.loads(bytes(data[len(MAGIC) + 8:header_end]).decode('utf-8'))
+    start = header_end + _padding(header_end)
+
+    arrays = {}
+    for name, entry in header['tensors'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        begin = start + entry['offset']
+        arrays[name] = data[begin:begin + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+    return arrays
+
+
+class TensorCache:
+    def __init__(self, directory):
+        """ Content addressed store of tensor files, <sha256>.tensors, with a
+            manifest.json mapping a checkpoint name to its hash and the model
+            id it belongs to """
+
+        self.directory = directory
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def path(self, name):
+        """ File holding the tensors of name, None when it is not cached """
+
+        entry = self.manifest().get(name)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry['hash'] + SUFFIX)
+        return path if os.path.exists(path) else None
+
+    def put(self, name, arrays, **info):
+        """ Store arrays under name, info (e.g. model_id) goes into the
+            manifest entry. Returns the path of the tensor file """
+
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            digest = write_tensors(arrays, f)
+        path = os.path.join(self.directory, digest + SUFFIX)
+        # read only for everyone, other users' monitors may map it too
+        os.chmod(f.name, 0o444)
+        os.replace(f.name, path)
+
+        manifest = self.manifest()
+        manifest[name] = dict(info, hash=digest, size=os.path.getsize(path), created=time.time())
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(f.name, self._manifest_path())
+        return path
+
+    def verify(self, name):
+        """ True when the cached file of name still hashes to its address """
+
+        path = self.path(name)
+        if path is None:
+            return False
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest() + SUFFIX == os.path.basename(path)
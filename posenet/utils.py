@@ -5,6 +5,13 @@ import numpy as np
 import posenet.constants
 
 
+def parse_model_id(model_id):
+    """ 101 or '101' -> (101, None), '101-int8' -> (101, 'int8') """
+
+    base, _, variant = str(model_id).partition('-')
+    return int(base), variant or None
+
+
 def valid_resolution(width, height, output_stride=16):
     target_width = (int(width) // output_stride) * output_stride + 1
     target_height = (int(height) // output_stride) * output_stride + 1
@@ -23,6 +30,24 @@ def _process_input(source_img, scale_factor=1.0, output_stride=16):
     return input_img, source_img, scale
 
 
+def _process_input_folded(source_img, input_img, padding, resized=None, scale_factor=1.0, output_stride=16):
+    """ _process_input for models with a folded input normalization: the
+        resized BGR frame is written as is into the interior of input_img, a
+        preallocated (3, H + 2 * padding, W + 2 * padding) float32 array whose
+        border holds INPUT_PAD_VALUE. resized is an optional (H, W, 3) uint8
+        scratch array, with it no frame sized memory is allocated. Returns
+        the output scale """
+
+    target_width, target_height = valid_resolution(
+        source_img.shape[1] * scale_factor, source_img.shape[0] * scale_factor, output_stride=output_stride)
+    scale = np.array([source_img.shape[0] / target_height, source_img.shape[1] / target_width])
+
+    resized = cv2.resize(source_img, (target_width, target_height), dst=resized, interpolation=cv2.INTER_LINEAR)
+    interior = input_img[:, padding:padding + target_height, padding:padding + target_width]
+    np.copyto(interior.transpose((1, 2, 0)), resized)
+    return scale
+
+
 def read_cap(cap, scale_factor=1.0, output_stride=16):
     res, img = cap.read()
     if not res:
@@ -0,0 +1,189 @@
+""" Headless PostureAid runner.
+
+    python -m posture_aid --source webcam
+    python -m posture_aid --source video --path session.mp4 --lock-after 30
+    python -m posture_aid --source synthetic --max-frames 500
+    python -m posture_aid --source webcam --cam-id 0 --cam-id 1
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import PostureAidConfig
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="posture_aid", description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["webcam", "video", "images", "synthetic"], default="webcam")
+    parser.add_argument("--path", action="append",
+                        help="video file or image directory, repeat for several seats")
+    parser.add_argument("--cam-id", type=int, action="append",
+                        help="camera index, repeat for several seats")
+    parser.add_argument("--model", default=PostureAidConfig.config("MODEL"),
+                        help="50, 75, 100 or 101, append -int8 for the quantized variant")
+    parser.add_argument("--backend", choices=["torch", "onnxruntime", "opencv"],
+                        default=PostureAidConfig.config("BACKEND"))
+    parser.add_argument("--server", default=PostureAidConfig.config("POSE_SERVER"),
+                        help="HOST:PORT of a pose_server to run the model on instead of locally")
+    parser.add_argument("--scale-factor", type=float, default=PostureAidConfig.config("SCALE_FACTOR"))
+    parser.add_argument("--output-stride", type=int, default=PostureAidConfig.config("OUTPUT_STRIDE"))
+    parser.add_argument("--decoder", choices=["multi", "vectorized", "single"], default=PostureAidConfig.config("DECODER"))
+    parser.add_argument("--pad-x", type=int, default=PostureAidConfig.config("PAD_X"))
+    parser.add_argument("--pad-y", type=int, default=PostureAidConfig.config("PAD_Y"))
+    parser.add_argument("--roi", action="store_true", default=PostureAidConfig.config("ROI_INFERENCE"),
+                        help="once locked, only run the model on a window around the head")
+    parser.add_argument("--motion-gating", action="store_true", default=PostureAidConfig.config("MOTION_GATING"),
+                        help="skip the model on frames without motion")
+    parser.add_argument("--head-tracking", action="store_true", default=PostureAidConfig.config("HEAD_TRACKING"),
+                        help="track the head box and only run the model when the track gets uncertain")
+    parser.add_argument("--autotune", action="store_true",
+                        help="use the model, scale factor and output stride tuned for this machine")
+    parser.add_argument("--retune", action="store_true", help="redo the tuning, implies --autotune")
+    parser.add_argument("--metrics-json", help="write stage latencies and counters to this file on exit")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--threads", type=int, default=PostureAidConfig.config("CPU_THREADS"),
+                        help="torch / OpenCV threads")
+    parser.add_argument("--nice", type=int, default=PostureAidConfig.config("NICENESS"),
+                        help="lower the process priority by this much")
+    parser.add_argument("--cpu-budget", type=float,
+                        default=PostureAidConfig.config("CPU_BUDGET") if PostureAidConfig.config("LOW_POWER") else None,
+                        help="percent of one core to stay under by lowering the frame rate and resolution")
+    parser.add_argument("--history", help="record every frame in this posture history file")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="frames per second, default is as fast as possible")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--lock-after", type=int, default=1,
+                        help="lock the correct head position after this many frames")
+    parser.add_argument("--alarm", action="store_true", help="play the alarm sound on violations")
+    parser.add_argument("--event-log", default=PostureAidConfig.config("EVENT_LOG_FILE"),
+                        help="also append events to this rotating log file")
+    parser.add_argument("--webhook", default=PostureAidConfig.config("EVENT_WEBHOOK_URL"),
+                        help="also POST events to this URL")
+    parser.add_argument("--event-socket", default=PostureAidConfig.config("EVENT_SOCKET"),
+                        help="also send events as datagrams to HOST:PORT or a unix socket path")
+    parser.add_argument("--heartbeat", type=float, default=PostureAidConfig.config("HEARTBEAT_INTERVAL"),
+                        help="seconds between heartbeat events while checking")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from estimator import create_estimator
+    from events import create_event_bus, create_violation_filter
+    from governor import CpuGovernor, configure_threads
+    from history import HistoryStore, summarize
+    from metrics import MetricsExporter, PipelineMetrics
+    from monitor import MultiPostureMonitor, PostureMonitor
+    from motion import MotionGate
+    from sources import open_source
+    from tracker import HeadTracker
+
+    if args.source in ("video", "images") and not args.path:
+        print("--path is required for the %s source" % args.source, file=sys.stderr)
+        return 2
+
+    if args.source == "webcam":
+        cam_ids = args.cam_id or PostureAidConfig.config("CAM_ID")
+        cam_ids = cam_ids if isinstance(cam_ids, (list, tuple)) else [cam_ids]
+        sources = [open_source("webcam", cam_id=cam_id) for cam_id in cam_ids]
+    elif args.source == "synthetic":
+        sources = [open_source("synthetic")]
+    else:
+        sources = [open_source(args.source, path=path) for path in args.path]
+
+    def make_motion_gate():
+        if not args.motion_gating:
+            return None
+        return MotionGate(threshold=PostureAidConfig.config("MOTION_THRESHOLD"),
+                          refresh_interval=PostureAidConfig.config("MOTION_REFRESH_INTERVAL"))
+
+    def make_tracker():
+        if not args.head_tracking:
+            return None
+        return HeadTracker(max_uncertainty=PostureAidConfig.config("TRACKER_MAX_UNCERTAINTY"),
+                           safe_margin=PostureAidConfig.config("TRACKER_SAFE_MARGIN"),
+                           max_interval=PostureAidConfig.config("TRACKER_MAX_INTERVAL"))
+
+    if args.autotune or args.retune:
+        from autotune import apply_tuning
+        frame = sources[0].read()
+        frame_size = (frame[0].shape[1], frame[0].shape[0]) if frame is not None else None
+        tuning = apply_tuning(frame_size, backend=args.backend, retune=args.retune)
+        args.model, args.scale_factor, args.output_stride = (
+            tuning["model"], tuning["scale_factor"], tuning["output_stride"])
+
+    metrics = exporter = None
+    if args.metrics_json or args.metrics_port is not None:
+        metrics = PipelineMetrics()
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(metrics, port=args.metrics_port).start()
+
+    estimator = create_estimator(args.model, args.output_stride, args.scale_factor, decoder=args.decoder,
+                                 backend=args.backend, metrics=metrics, server=args.server)
+    configure_threads(args.threads, args.nice)
+    roi_padding = PostureAidConfig.config("ROI_PADDING") if args.roi else None
+    # events are printed as JSON lines, off the frame loop like the other sinks
+    events = create_event_bus(alarm_file=PostureAidConfig.config("ALARM_FILE") if args.alarm else None,
+                              log_file=args.event_log, webhook_url=args.webhook,
+                              socket_address=args.event_socket, stream=sys.stdout)
+    history = HistoryStore(args.history) if args.history else None
+    monitors = [PostureMonitor(source, estimator, args.pad_x, args.pad_y, on_event=events.publish, seat=seat,
+                               roi_padding=roi_padding, motion_gate=make_motion_gate(), tracker=make_tracker(),
+                               metrics=metrics, violation_filter=create_violation_filter(),
+                               heartbeat_interval=args.heartbeat or None, history=history)
+                for seat, source in enumerate(sources)]
+    monitor = monitors[0] if len(monitors) == 1 else MultiPostureMonitor(monitors, estimator)
+
+    def lock(result):
+        for seat in monitors:
+            if not seat.running and seat.frames >= args.lock_after:
+                seat.start()
+
+    rate = args.rate
+    governor = None
+    if args.cpu_budget is not None:
+        governor = CpuGovernor(args.cpu_budget, args.rate or PostureAidConfig.config("MAX_FPS"), args.scale_factor,
+                               idle_after=PostureAidConfig.config("IDLE_AFTER"),
+                               idle_fps=PostureAidConfig.config("IDLE_FPS"),
+                               watts_per_core=PostureAidConfig.config("WATTS_PER_CORE"))
+
+        def rate():
+            fps, estimator.scale_factor = governor.update(any(seat.head_found for seat in monitors))
+            return fps
+
+    start = time.perf_counter()
+    try:
+        processed = monitor.run(rate=rate, max_frames=args.max_frames, callback=lock)
+    except KeyboardInterrupt:
+        processed = max(seat.frames for seat in monitors)
+    finally:
+        monitor.close()
+        events.close()
+        if history is not None:
+            summary = summarize(history.minutes())
+            history.close()
+        if exporter is not None:
+            exporter.close()
+    elapsed = time.perf_counter() - start
+
+    print("[INFO] processed %d frames per seat on %d seat(s) in %.2fs (%.1f fps per seat)" % (
+        processed, len(monitors), elapsed, processed / elapsed if elapsed else 0.0), file=sys.stderr)
+    for seat in monitors:
+        if seat.motion_gate is not None or seat.tracker is not None:
+            print("[INFO] seat %d ran the model on %d of %d frames (%.1f%% skipped)" % (
+                seat.seat, seat.inferences, seat.frames,
+                100 * (1 - seat.inferences / seat.frames) if seat.frames else 0.0), file=sys.stderr)
+    if governor is not None:
+        print("[INFO] cpu: %s" % json.dumps(governor.report()), file=sys.stderr)
+    if history is not None:
+        print("[INFO] history written to %s: %s" % (args.history, json.dumps(summary)), file=sys.stderr)
+    if args.metrics_json:
+        metrics.dump_json(args.metrics_json)
+        print("[INFO] metrics written to %s" % args.metrics_json, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from utils import draw_overlay
+
+# RGBA, the buffer is mirrored and RGB by the time boxes are drawn
+HEAD_COLOR = (0, 0, 255, 255)
+BOUNDARY_COLOR = (255, 0, 0, 255)
+
+
+class PanelRenderer:
+    def __init__(self, panel, max_fps=15.0, hysteresis=4):
+        """ Shows BGR frames mirrored in a Tkinter label, the drawing side of
+            utils.draw_boxes without per frame allocations. Frames are shrunk
+            to the size of the label first, then turned RGBA and mirrored into
+            a reused buffer, which a single PhotoImage is repainted from. Sizes
+            within hysteresis pixels of the current one are kept. render()
+            skips frames arriving faster than max_fps """
+
+        self.panel = panel
+        self.max_fps = max_fps
+        self.hysteresis = hysteresis
+        self.rendered = 0
+
+        self._period = 1.0 / max_fps if max_fps else 0.0
+        self._last_render = None
+        self._resized = None
+        self._converted = None
+        self._rgba = None
+        self._image = None
+        self._photo = None
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._last_render is None or now - self._last_render >= self._period
+
+    def _target_size(self, frame_width, frame_height):
+        # the label is image + border + highlight + padding wide on each side
+        inset = 2 * sum(int(self.panel.cget(option)) for option in ("borderwidth", "highlightthickness", "padx"))
+        available_width = self.panel.winfo_width() - inset
+        available_height = self.panel.winfo_height() - inset
+        if available_width <= 1 or available_height <= 1:
+            # not mapped yet
+            return frame_width, frame_height
+        scale = min(1.0, available_width / frame_width, available_height / frame_height)
+        width, height = max(1, int(frame_width * scale)), max(1, int(frame_height * scale))
+        if self._rgba is not None:
+            current_height, current_width = self._rgba.shape[:2]
+            if abs(width - current_width) <= self.hysteresis and abs(height - current_height) <= self.hysteresis:
+                return current_width, current_height
+        return width, height
+
+    def _convert(self, frame, width, height):
+        if (height, width) != frame.shape[:2]:
+            if self._resized is None or self._resized.shape[:2] != (height, width):
+                self._resized = np.empty((height, width, 3), dtype=np.uint8)
+            frame = cv2.resize(frame, (width, height), dst=self._resized, interpolation=cv2.INTER_AREA)
+        if self._rgba is None or self._rgba.shape[:2] != (height, width):
+            self._converted = np.empty((height, width, 4), dtype=np.uint8)
+            self._rgba = np.empty((height, width, 4), dtype=np.uint8)
+            # shares the buffer, RGB images would be copied
+            self._image = Image.frombuffer("RGBA", (width, height), self._rgba, "raw", "RGBA", 0, 1)
+            self._photo = None
+        # two vectorized OpenCV passes beat a single strided NumPy copy
+        # (frame[:, ::-1, ::-1]) by far
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA, dst=self._converted)
+        cv2.flip(self._converted, 1, dst=self._rgba)
+
+    def _draw_box(self, box, scale, color, pad_x=0, pad_y=0):
+        (x, y, w, h) = box
+        width = self._rgba.shape[1]
+        x0 = width - 1 - int((x + w + pad_x) * scale)
+        x1 = width - 1 - int((x - pad_x) * scale)
+        y0, y1 = int((y - pad_y) * scale), int((y + h + pad_y) * scale)
+        cv2.rectangle(self._rgba, (x0, y0), (x1, y1), color, 2)
+
+    def render(self, frame, correct_pos=None, current_pos=None, pad_x=0, pad_y=0, overlay=None, now=None):
+        """ Show frame with the head box and the boundary around correct_pos,
+            when given, and the overlay text lines. Returns False when the
+            frame was skipped """
+
+        now = time.monotonic() if now is None else now
+        if not self.due(now):
+            return False
+        self._last_render = now
+
+        frame_height, frame_width = frame.shape[:2]
+        width, height = self._target_size(frame_width, frame_height)
+        self._convert(frame, width, height)
+        scale = width / frame_width
+        if current_pos is not None:
+            self._draw_box(current_pos, scale, HEAD_COLOR)
+        if correct_pos is not None:
+            self._draw_box(correct_pos, scale, BOUNDARY_COLOR, pad_x, pad_y)
+        if overlay:
+            draw_overlay(self._rgba, overlay, (255, 255, 255, 255))
+
+        if self._photo is None:
+            self._photo = ImageTk.PhotoImage(self._image)
+            # the label does not keep a reference itself
+            self.panel.imgtk = self._photo
+            self.panel.config(image=self._photo)
+        else:
+            self._photo.paste(self._image)
+        self.rendered += 1
+        return True
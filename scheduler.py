@@ -0,0 +1,74 @@
+import time
+
+
+class FrameScheduler:
+    def __init__(self, max_fps=20.0, max_latency=0.5, relax_margin=0.5, violation_hold=3.0,
+                 poll_interval=0.005, smoothing=0.2):
+        """ Decides how long to wait before the next iteration of a frame loop.
+            The period between iteration starts is 1 / max_fps while the head
+            is near the boundary, in violation or for violation_hold seconds
+            after one, and stretches up to max_latency (the longest time a
+            violation may go unnoticed) while the head stays further inside
+            than relax_margin (see utils.boundary_margin). The measured cost of
+            an iteration is subtracted from the wait, so the period holds under
+            load instead of drifting """
+
+        self.max_fps = max_fps
+        self.max_latency = max_latency
+        self.relax_margin = relax_margin
+        self.violation_hold = violation_hold
+        self.poll_interval = poll_interval
+
+        self.cost = 0.0
+        self.period = 1.0 / max_fps
+        self.iterations = 0
+        self.overruns = 0
+
+        self._smoothing = smoothing
+        self._started = None
+        self._last_violation = None
+
+    @property
+    def busy(self):
+        return self._started is not None
+
+    def begin(self):
+        """ Mark the start of an iteration. Returns False when the previous one
+            has not ended yet, the caller should then skip this iteration """
+
+        if self._started is not None:
+            return False
+        self._started = time.perf_counter()
+        return True
+
+    def target_period(self, margin=None, violation=False, now=None):
+        """ Start to start period for the given boundary state. margin is None
+            while nothing is being checked """
+
+        now = time.monotonic() if now is None else now
+        fast = 1.0 / self.max_fps
+        slow = max(fast, self.max_latency - self.cost)
+        if violation:
+            self._last_violation = now
+        recent = self._last_violation is not None and now - self._last_violation < self.violation_hold
+        if violation or recent or margin is None or margin <= 0.0:
+            return fast
+        # linear between the boundary (fast) and relax_margin (slow)
+        return fast + (slow - fast) * min(1.0, margin / self.relax_margin)
+
+    def end(self, margin=None, violation=False, produced=True):
+        """ Mark the end of an iteration and return the delay in seconds until
+            the next one should start. produced is False when the iteration
+            found no new frame, which is retried after poll_interval """
+
+        elapsed = time.perf_counter() - self._started
+        self._started = None
+        if not produced:
+            return self.poll_interval
+
+        self.iterations += 1
+        self.cost += self._smoothing * (elapsed - self.cost) if self.iterations > 1 else elapsed - self.cost
+        self.period = self.target_period(margin, violation)
+        if elapsed >= self.period:
+            self.overruns += 1
+        return max(0.0, self.period - elapsed)
@@ -0,0 +1,139 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from capture import FrameGrabber
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameSource:
+    """ Produces BGR frames for a PostureMonitor. read() returns (frame, timestamp)
+        or None when no new frame is available; exhausted turns True once a
+        finite source has nothing left """
+
+    exhausted = False
+
+    def read(self, block=True):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class WebcamSource(FrameSource):
+    def __init__(self, cam_id=0, grabber=None):
+        self._grabber = grabber or FrameGrabber.from_camera(cam_id)
+        self._grabber.start()
+
+    @property
+    def grabber(self):
+        return self._grabber
+
+    @property
+    def exhausted(self):
+        return self._grabber.failed
+
+    def read(self, block=True):
+        if block:
+            self._grabber.wait_for_frame()
+        elif not self._grabber.has_new_frame():
+            return None
+        frame, timestamp, _ = self._grabber.latest()
+        if frame is None:
+            return None
+        return frame, timestamp
+
+    def release(self):
+        self._grabber.release()
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path):
+        self._cap = cv2.VideoCapture(path)
+        if not self._cap.isOpened():
+            raise IOError("cannot open video file %s" % path)
+        self.exhausted = False
+
+    def read(self, block=True):
+        if self.exhausted:
+            return None
+        res, img = self._cap.read()
+        if not res:
+            self.exhausted = True
+            return None
+        return img, time.monotonic()
+
+    def release(self):
+        self._cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, path, loop=False):
+        self._paths = sorted(
+            os.path.join(path, f) for f in os.listdir(path)
+            if f.lower().endswith(IMAGE_EXTENSIONS))
+        if not self._paths:
+            raise IOError("no images found in %s" % path)
+        self._loop = loop
+        self._index = 0
+        self.exhausted = False
+
+    def read(self, block=True):
+        if self.exhausted:
+            return None
+        img = cv2.imread(self._paths[self._index])
+        self._index += 1
+        if self._index == len(self._paths):
+            if self._loop:
+                self._index = 0
+            else:
+                self.exhausted = True
+        return img, time.monotonic()
+
+
+class SyntheticSource(FrameSource):
+    def __init__(self, width=640, height=480, num_frames=None, seed=0):
+        """ Generates frames with a face-like blob drifting around the frame,
+            useful for throughput measurements without a camera """
+
+        self._width = width
+        self._height = height
+        self._num_frames = num_frames
+        self._count = 0
+        self._rng = np.random.RandomState(seed)
+        self._background = self._rng.randint(
+            0, 60, size=(height, width, 3)).astype(np.uint8)
+        self.exhausted = False
+
+    def read(self, block=True):
+        if self.exhausted:
+            return None
+        t = self._count / 30.0
+        cx = int(self._width * (0.5 + 0.2 * np.sin(t)))
+        cy = int(self._height * (0.4 + 0.1 * np.cos(0.7 * t)))
+        radius = self._height // 8
+
+        frame = self._background.copy()
+        cv2.circle(frame, (cx, cy), radius, (150, 180, 220), -1)
+        cv2.circle(frame, (cx - radius // 3, cy - radius // 4), radius // 8, (40, 40, 40), -1)
+        cv2.circle(frame, (cx + radius // 3, cy - radius // 4), radius // 8, (40, 40, 40), -1)
+
+        self._count += 1
+        if self._num_frames is not None and self._count >= self._num_frames:
+            self.exhausted = True
+        return frame, time.monotonic()
+
+
+def open_source(kind, path=None, cam_id=0, **kwargs):
+    if kind == "webcam":
+        return WebcamSource(cam_id)
+    if kind == "video":
+        return VideoFileSource(path)
+    if kind == "images":
+        return ImageDirectorySource(path, **kwargs)
+    if kind == "synthetic":
+        return SyntheticSource(**kwargs)
+    raise ValueError("unknown frame source %s" % kind)
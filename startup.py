@@ -0,0 +1,64 @@
+import threading
+import time
+
+# everything is measured from the moment this module is first imported, the
+# app imports it before anything else
+_START = time.perf_counter()
+
+
+class StartupTimer:
+    def __init__(self, start=None):
+        """ Records how long after start each named milestone was first
+            reached, e.g. imports, window, first frame, model, first inference """
+
+        self.start = _START if start is None else start
+        self.milestones = {}
+
+    def mark(self, name):
+        if name not in self.milestones:
+            self.milestones[name] = time.perf_counter() - self.start
+        return self.milestones[name]
+
+    def report(self):
+        return ", ".join("%s %.2fs" % item for item in self.milestones.items())
+
+
+class BackgroundLoader:
+    def __init__(self, load, timer=None):
+        """ Runs load() on a daemon thread. load receives a progress(state)
+            callable to describe what it is doing, state, result and error are
+            safe to poll from the Tk thread """
+
+        self.state = "waiting"
+        self.result = None
+        self.error = None
+        self._load = load
+        self._timer = timer
+        self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def progress(self, state):
+        self.state = state
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    @property
+    def failed(self):
+        return self.state == "failed"
+
+    def _run(self):
+        try:
+            self.result = self._load(self.progress)
+        except Exception as e:
+            self.error = e
+            self.state = "failed"
+            print("[WARN] loading the model failed: %s" % e)
+            return
+        if self._timer is not None:
+            self._timer.mark("model")
+        self.state = "ready"
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from posenet.constants import NUM_KEYPOINTS, POSE_CHAIN
+from posenet.decode_multi import decode_multiple_poses
+from posenet.decode_vectorized import decode_multiple_poses_vectorized
+
+HEAD_PARTS = ('nose', 'leftEye', 'rightEye', 'leftEar', 'rightEar')
+
+
+def random_outputs(rng, height=17, width=23, output_stride=16):
+    num_edges = len(POSE_CHAIN)
+    scores = rng.random((NUM_KEYPOINTS, height, width)).astype(np.float32)
+    offsets = rng.normal(0, output_stride / 2, (2 * NUM_KEYPOINTS, height, width)).astype(np.float32)
+    displacements_fwd = rng.normal(0, 2 * output_stride, (2 * num_edges, height, width)).astype(np.float32)
+    displacements_bwd = rng.normal(0, 2 * output_stride, (2 * num_edges, height, width)).astype(np.float32)
+    return scores, offsets, displacements_fwd, displacements_bwd
+
+
+class VectorizedDecoderTest(unittest.TestCase):
+    """ decode_multiple_poses_vectorized is a drop-in replacement for the
+        reference decode_multiple_poses and has to return the same poses """
+
+    def assert_same_poses(self, required_parts):
+        rng = np.random.default_rng(5)
+        for trial in range(25):
+            outputs = random_outputs(rng)
+            kwargs = dict(output_stride=16, max_pose_detections=10, min_pose_score=0.15,
+                          required_parts=required_parts)
+            expected = decode_multiple_poses(*outputs, **kwargs)
+            actual = decode_multiple_poses_vectorized(*outputs, **kwargs)
+            for name, e, a in zip(('pose scores', 'keypoint scores', 'keypoint coords'), expected, actual):
+                np.testing.assert_allclose(a, e, rtol=1e-5, atol=1e-4, err_msg='%s, trial %d' % (name, trial))
+
+    def test_full_body(self):
+        self.assert_same_poses(None)
+
+    def test_required_parts(self):
+        self.assert_same_poses(HEAD_PARTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
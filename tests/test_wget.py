@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from posenet.converter.wget import DownloadError, download_file
+
+CONTENT = bytes(range(256)) * 1024
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # set by the tests: cut the first response short after this many bytes,
+    # and the md5 announced in x-goog-hash
+    cut_after = None
+    md5 = hashlib.md5(CONTENT).digest()
+    ranges = []
+
+    def do_GET(self):
+        offset = 0
+        header = self.headers.get('Range')
+        type(self).ranges.append(header)
+        if header:
+            offset = int(header[len('bytes='):].rstrip('-'))
+        if offset >= len(CONTENT):
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206 if offset else 200)
+        self.send_header('Content-Length', str(len(CONTENT) - offset))
+        self.send_header('x-goog-hash', 'md5=' + base64.b64encode(type(self).md5).decode('ascii'))
+        self.end_headers()
+        body = CONTENT[offset:]
+        if type(self).cut_after is not None:
+            body = body[:type(self).cut_after]
+            type(self).cut_after = None
+            self.wfile.write(body)
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadFileTest(unittest.TestCase):
+    def setUp(self):
+        _Handler.cut_after = None
+        _Handler.md5 = hashlib.md5(CONTENT).digest()
+        _Handler.ranges = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/shard' % self.server.server_address[1]
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'shard')
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_interrupted_download_resumes_with_range_request(self):
+        _Handler.cut_after = 100000
+        download_file(self.session, self.url, self.path, expected_size=len(CONTENT), timeout=5)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        # the retry picks up after the chunks that were written before the cut
+        first, retry = _Handler.ranges
+        self.assertIsNone(first)
+        self.assertGreater(int(retry[len('bytes='):].rstrip('-')), 0)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_leftover_part_is_resumed(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(CONTENT[:5000])
+        download_file(self.session, self.url, self.path, expected_size=len(CONTENT), timeout=5)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(_Handler.ranges, ['bytes=5000-'])
+
+    def test_md5_mismatch_fails_after_all_attempts(self):
+        _Handler.md5 = hashlib.md5(b'something else').digest()
+        with self.assertRaises(DownloadError):
+            download_file(self.session, self.url, self.path, attempts=2, timeout=5)
+        self.assertEqual(len(_Handler.ranges), 2)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+
+if __name__ == '__main__':
+    unittest.main()
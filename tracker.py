@@ -0,0 +1,130 @@
+import numpy as np
+
+from config import PostureAidConfig
+
+
+class HeadTracker:
+    def __init__(self, measurement_noise=3.0, process_noise=200.0, max_uncertainty=6.0, safe_margin=0.5,
+                 max_interval=1.0, adaptation=0.3):
+        """ Constant velocity Kalman filter over the head box center, width and
+            height (pixels, pixels per second). Filtered boxes replace the raw
+            ones from get_pos_from_img, and between measurements the box is
+            extrapolated. should_infer asks for a model pass once the
+            predicted position is more than max_uncertainty pixels uncertain
+            (one standard deviation), the box comes closer to the boundary,
+            from either side, than safe_margin (utils.boundary_margin) or
+            max_interval seconds have passed. process_noise is scaled up while
+            measurements keep surprising the filter, so a moving head is
+            measured more often. A model pass that finds no head ends the
+            track, only skipped frames are extrapolated """
+
+        self.measurement_noise = measurement_noise
+        self.process_noise = process_noise
+        self.max_uncertainty = max_uncertainty
+        self.safe_margin = safe_margin
+        self.max_interval = max_interval
+        self.adaptation = adaptation
+
+        self.frames = 0
+        self.skipped = 0
+
+        self.reset()
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    @property
+    def tracking(self):
+        return self._state is not None
+
+    def reset(self):
+        # (4, 2) position / velocity of cx, cy, w, h and their (4, 2, 2) covariances
+        self._state = None
+        self._covariance = None
+        self._timestamp = None
+        self._last_measurement = None
+        self._noise_scale = 1.0
+
+    def _predicted(self, timestamp):
+        dt = max(0.0, timestamp - self._timestamp)
+        transition = np.array([[1.0, dt], [0.0, 1.0]])
+        q = self.process_noise * self._noise_scale
+        noise = q * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        state = self._state @ transition.T
+        covariance = transition @ self._covariance @ transition.T + noise
+        return state, covariance
+
+    @staticmethod
+    def _box(state):
+        cx, cy, w, h = state[:, 0]
+        w, h = max(w, 0.0), max(h, 0.0)
+        return int(round(cx - w / 2)), int(round(cy - h / 2)), int(round(w)), int(round(h))
+
+    def predict(self, timestamp):
+        """ Extrapolated head box at timestamp, None without a track """
+
+        if self._state is None:
+            return None
+        return self._box(self._predicted(timestamp)[0])
+
+    def uncertainty(self, timestamp):
+        """ Standard deviation in pixels of the predicted box center """
+
+        if self._state is None:
+            return float("inf")
+        covariance = self._predicted(timestamp)[1]
+        return float(np.sqrt(covariance[:2, 0, 0].max()))
+
+    def update(self, box, timestamp):
+        """ Feed a measured (x, y, w, h) box, None or an empty box when no head
+            was found. Returns the filtered box, None while there is no track """
+
+        if box is None or not any(box):
+            # a head that left must reach the boundary check as missing, not as
+            # a prediction that is still in place, and the next frame is measured
+            self.reset()
+            return None
+
+        (x, y, w, h) = box
+        measurement = np.array([x + w / 2, y + h / 2, w, h], dtype=np.float64)
+        if self._state is None:
+            self._state = np.stack([measurement, np.zeros(4)], axis=1)
+            self._covariance = np.tile(np.diag([self.measurement_noise ** 2, 1e4]), (4, 1, 1))
+        else:
+            state, covariance = self._predicted(timestamp)
+            innovation = measurement - state[:, 0]
+            innovation_var = covariance[:, 0, 0] + self.measurement_noise ** 2
+            gain = covariance[:, :, 0] / innovation_var[:, None]
+            self._state = state + gain * innovation[:, None]
+            self._covariance = covariance - gain[:, :, None] * covariance[:, None, 0, :]
+
+            # normalized innovation squared is ~1 while the motion model holds
+            surprise = float(np.mean(innovation ** 2 / innovation_var))
+            self._noise_scale += self.adaptation * (max(1.0, surprise) - self._noise_scale)
+        self._timestamp = timestamp
+        self._last_measurement = timestamp
+        return self._box(self._state)
+
+    def should_infer(self, timestamp, margin=None):
+        """ margin is utils.boundary_margin of the predicted box, None when
+            no boundary is being checked """
+
+        self.frames += 1
+        if (self._state is None or timestamp - self._last_measurement >= self.max_interval or
+                self.uncertainty(timestamp) > self.max_uncertainty or
+                (margin is not None and abs(margin) < self.safe_margin)):
+            return True
+        self.skipped += 1
+        return False
+
+
+def create_head_tracker():
+    """ HeadTracker as configured in PostureAidConfig, None when tracking is off """
+
+    if not PostureAidConfig.config("HEAD_TRACKING"):
+        return None
+    return HeadTracker(
+        max_uncertainty=PostureAidConfig.config("TRACKER_MAX_UNCERTAINTY"),
+        safe_margin=PostureAidConfig.config("TRACKER_SAFE_MARGIN"),
+        max_interval=PostureAidConfig.config("TRACKER_MAX_INTERVAL"))
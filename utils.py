@@ -1,3 +1,5 @@
+import math
+
 from PIL import Image, ImageTk
 import cv2
 
@@ -7,7 +9,60 @@ def check_head_within_boundary(correct_pos, current_pos, pad_x=30, pad_y=30):
 
     return (x1-pad_x <= x2 <= x2+w2 <= x1+w1+pad_x) and (y1-pad_y <= y2 <= y2+h2 <= y1+h1+pad_y)
 
-def draw_boxes(img, correct_pos, current_pos, pad_x, pad_y):
+def boundary_margin(correct_pos, current_pos, pad_x=30, pad_y=30):
+    """ Distance from the head box to the nearest edge of the boundary, as a
+        fraction of the padding on that side. 1.0 when the head sits on the
+        correct position, 0.0 on the boundary and negative outside of it """
+
+    (x1, y1, w1, h1) = correct_pos
+    (x2, y2, w2, h2) = current_pos
+
+    return min((x2 - (x1 - pad_x)) / max(pad_x, 1), ((x1 + w1 + pad_x) - (x2 + w2)) / max(pad_x, 1),
+               (y2 - (y1 - pad_y)) / max(pad_y, 1), ((y1 + h1 + pad_y) - (y2 + h2)) / max(pad_y, 1))
+
+def roi_window(frame_shape, box, padding=1.0, scale_factor=1.0, output_stride=16, max_fraction=0.8):
+    """ Crop window (x0, y0, x1, y1) around a head box, padded by padding times
+        the box size on every side. The origin sits on the output stride grid of
+        the full frame and the size maps onto a valid input resolution, so the
+        model sees the same cells it would on the full frame. Returns None when
+        the window would cover most of the frame anyway """
+
+    frame_h, frame_w = frame_shape[:2]
+    (x, y, w, h) = box
+    margin = padding * max(w, h)
+    step = output_stride / scale_factor
+
+    x0 = max(0, int((x - margin) // step * step))
+    y0 = max(0, int((y - margin) // step * step))
+    cells_x = max(1, math.ceil((x + w + margin - x0) / step))
+    cells_y = max(1, math.ceil((y + h + margin - y0) / step))
+    x1 = min(frame_w, x0 + int(math.ceil((cells_x * output_stride + 1) / scale_factor)))
+    y1 = min(frame_h, y0 + int(math.ceil((cells_y * output_stride + 1) / scale_factor)))
+
+    if (x1 - x0) * (y1 - y0) > max_fraction * frame_w * frame_h:
+        return None
+    return x0, y0, x1, y1
+
+def box_touches_window(box, window, frame_shape, margin=2):
+    """ True when the box reaches a window border that is not also a frame border """
+
+    frame_h, frame_w = frame_shape[:2]
+    (x, y, w, h) = box
+    (x0, y0, x1, y1) = window
+    return ((x0 > 0 and x <= x0 + margin) or (y0 > 0 and y <= y0 + margin) or
+            (x1 < frame_w and x + w >= x1 - margin) or (y1 < frame_h and y + h >= y1 - margin))
+
+def draw_overlay(img, lines, color=(255, 255, 255)):
+    """ Text lines (e.g. PipelineMetrics.overlay()) in the top left corner """
+    # dark outline, keeping the alpha of 4 channel colors
+    outline = (0, 0, 0) + tuple(color[3:])
+    for i, line in enumerate(lines):
+        origin = (8, 18 + 16 * i)
+        cv2.putText(img, line, origin, cv2.FONT_HERSHEY_SIMPLEX, 0.45, outline, 3, cv2.LINE_AA)
+        cv2.putText(img, line, origin, cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+    return img
+
+def draw_boxes(img, correct_pos, current_pos, pad_x, pad_y, overlay=None):
     (fx, fy, fw, fh) = correct_pos
     (x, y, w, h) = current_pos
     frame = cv2.rectangle(
@@ -15,6 +70,8 @@ def draw_boxes(img, correct_pos, current_pos, pad_x, pad_y):
     frame = cv2.rectangle(frame, (fx-pad_x, fy-pad_y),
                             (fx+fw+pad_x, fy+fh+pad_y), (0, 0, 255), 2)
     frame = cv2.flip(frame, 1)
+    if overlay:
+        draw_overlay(frame, overlay)
 
     # convert colors from BGR to RGBA
     cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)